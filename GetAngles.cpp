@@ -31,6 +31,12 @@ david.j.pugh@cantab.net
 #include <iostream>
 #include <stdio.h>
 #include <sstream>
+#include <string.h>
+#include <thread>
+#include <mutex>
+#include <cmath>
+#include <iomanip>
+#include <algorithm>
 //External C GridLib header from NonLinLoc
 extern "C" {
     #include "GridLib.h"
@@ -44,8 +50,81 @@ class Stations{
         vector<int> dimension;//Dimension of the grid file (2D or 3D)
         vector<SourceDesc> srce;//NLLoc source object
 };
+//Binary scatangle file header (see the Scat2Angle module docstring for the format description)
+struct ScatAngleHeader{
+    char magic[8];//"SCATANGB"
+    unsigned int version;//Format version (also used to check the byte order)
+    unsigned int nStations;//Number of stations
+    unsigned long long nSamples;//Number of samples
+    unsigned int nameWidth;//Number of bytes for each station name
+    unsigned int flags;//Bit 0 set if grid sampling (probabilities are output)
+    unsigned int metadataLength;//Number of bytes of JSON metadata after the station names
+    unsigned int dataOffset;//Byte offset of the sample records
+    char reserved[24];
+};
+const unsigned int SCATANGLE_VERSION=1;
+//Summary file format version
+const unsigned int SUMMARY_VERSION=1;
+//Default summary histogram bin width (degrees)
+const double DEFAULT_BIN_WIDTH=5.0;
+//Class to handle a point with angles
+class angleNode{
+public:
+    vector<double> azimuth;
+    vector<double> takeoff;
+    double p;
+    angleNode(double P)
+    {
+        this->p=P;
+    }
+};
+//Number of samples read, converted and written at once
+const int CHUNK_SIZE=10000;
+//Lock for opening and closing grid files (GridLib keeps global counts of the open files)
+mutex gridFileLock;
+//Class to hold the open angle grid files for each station - each thread has its own handles, so the grid files are
+//opened once per thread rather than once per sample and station
+class GridHandles{
+    public:
+        vector<FILE *> fpGrid;//Grid buffer files
+        vector<FILE *> fpHdr;//Grid header files
+        vector<GridDesc> gdesc;//Grid descriptions
+        vector<int> isOpen;//Flag for grid files opened
+        unsigned long long cellReads;//Number of grid cells read in the cell lookup mode
+        unsigned long long lookups;//Number of sample and station lookups in the cell lookup mode
+        GridHandles(const Stations &sta){
+            unsigned int narr;
+            int iSwapBytesOnInput=0;
+            lock_guard<mutex> lock(gridFileLock);
+            cellReads=0;
+            lookups=0;
+            fpGrid.resize(sta.filenames.size(),NULL);
+            fpHdr.resize(sta.filenames.size(),NULL);
+            gdesc.resize(sta.filenames.size());
+            isOpen.resize(sta.filenames.size(),0);
+            for (narr=0;narr<sta.filenames.size();narr++)
+            {
+                //angle filename as c string (not modified by GridLib)
+                char * filename=const_cast<char *>(sta.filenames[narr].c_str());
+                isOpen[narr]=::OpenGrid3dFile(filename,&fpGrid[narr],&fpHdr[narr],&gdesc[narr],(char *)"angle",NULL,iSwapBytesOnInput)>=0;
+                if (isOpen[narr] && fpGrid[narr]==NULL){
+                    //Header only
+                    ::CloseGrid3dFile(&fpGrid[narr],&fpHdr[narr]);
+                    isOpen[narr]=0;
+                }
+            }
+        }
+        ~GridHandles(){
+            unsigned int narr;
+            lock_guard<mutex> lock(gridFileLock);
+            for (narr=0;narr<isOpen.size();narr++)
+            {
+                if (isOpen[narr]){::CloseGrid3dFile(&fpGrid[narr],&fpHdr[narr]);}
+            }
+        }
+};
 //Protoype
-vector<vector<string > > getAngles(double x, double y, double z,double p,Stations sta);
+angleNode getAngles(double x, double y, double z,double p,const Stations &sta,GridHandles &grids);
 //Class to handle an x,y,z point
 class xyzNode{
 public:
@@ -60,100 +139,473 @@ public:
         this->p=pf;
     }
 };
-//Class to handle a point with angles
-class angleNode{
-public:
-    vector<vector<string> >stationAngles;
-    double p;
-    angleNode(vector<vector<string> >angles, double P)
-    {
-        this->stationAngles=angles;
-        this->p=P;
-    }
+//Class to read scatter files in chunks of samples
+class ScatterReader{
+    public:
+        int nSamples;//Number of samples in the scatter file header
+        int nRead;//Number of samples read so far
+        ScatterReader(string filename){
+            nSamples=0;
+            nRead=0;
+            //Print filename to std out
+            cout<<filename<<endl;
+            //Open binary file
+            file.open(filename.c_str(),ios::in|ios::binary);
+            if (file.is_open())
+            {
+                float d[3];
+                //Read number of samples (as integer)
+                file.read((char*)&nSamples,sizeof(int));
+                //Null values
+                file.read((char*)d,3*sizeof(float));
+                if (!file.good()){nSamples=0;}
+                cout <<"Samples: "<<nSamples<<'\n'<<endl;
+            }
+        }
+        ~ScatterReader(){
+            //Close file
+            file.close();
+        }
+        bool isOpen(){
+            return file.is_open();
+        }
+        //Read up to chunkSize samples into nodes and return the number of samples read
+        int readChunk(vector<xyzNode> &nodes,int chunkSize){
+            int i;
+            int n=min(chunkSize,nSamples-nRead);
+            nodes.clear();
+            if (n<=0){return 0;}
+            //Read x,y,z and p values for the samples in a single read
+            buffer.resize(4*n);
+            file.read((char*)&buffer[0],4*n*sizeof(float));
+            n=file.gcount()/(4*sizeof(float));
+            for (i=0;i<n;i++)
+            {
+                nodes.push_back(xyzNode(buffer[4*i],buffer[4*i+1],buffer[4*i+2],buffer[4*i+3]));
+            }
+            nRead+=n;
+            return n;
+        }
+    private:
+        ifstream file;
+        vector<float> buffer;
 };
-//Class to handle scatter files
-class Scatter{
+//Base class for writing angle scatter files in chunks of samples
+class AngleWriter{
     public:
-        vector<xyzNode > nodes;
-        void addNode(float x, float y, float z, float p)
-        {
-            nodes.push_back(xyzNode(x,y,z,p));
+        virtual ~AngleWriter(){}
+        virtual bool isOpen()=0;
+        virtual void writeChunk(const vector<angleNode> &nodes)=0;
+        virtual void close()=0;
+};
+//Class to write text scatangle files
+class TextAngleWriter: public AngleWriter{
+    public:
+        TextAngleWriter(string filename,const Stations &sta,int gridSampling): sta(sta){
+            this->gridSampling=gridSampling;
+            file.open(filename.c_str());
         }
+        bool isOpen(){
+            return file.is_open();
+        }
+        void writeChunk(const vector<angleNode> &nodes){
+            //Loop over samples
+            unsigned int i,j;
+            for (i=0;i<nodes.size();i++)
+            {
+                if (gridSampling>0){
+                    //output probability if grid sampling is set
+                    file<<nodes[i].p<<'\n';
+                }
+                else{
+                    //Otherwise output 1 when samples are drawn directly from the location distribution
+                    file<<'1'<<'\n';
+                }
+                //Output angles for each station.
+                for (j=0;j<nodes[i].azimuth.size();j++)
+                {
+                    file <<sta.names[j]<<'\t'<<nodes[i].azimuth[j]<<'\t'<<nodes[i].takeoff[j]<<'\n';
+                }
+                file <<'\n';
+            }
+        }
+        void close(){
+            file.close();
+        }
+    private:
+        ofstream file;
+        const Stations &sta;
+        int gridSampling;
 };
-//Class to handle angle scatter file
-class Angles{
+//Class to write binary scatangle files
+class BinaryAngleWriter: public AngleWriter{
     public:
-        vector<angleNode > nodes;
-        void addNode(vector<vector<string> > angles, double P)
-        {
-            nodes.push_back(angleNode(angles,P));
+        BinaryAngleWriter(string filename,const Stations &sta,int gridSampling,int nSamples){
+            unsigned int j;
+            this->gridSampling=gridSampling;
+            nWritten=0;
+            file.open(filename.c_str(),ios::out|ios::binary);
+            if (!file.is_open()){return;}
+            //Set up header
+            memset(&header,0,sizeof(header));
+            memcpy(header.magic,"SCATANGB",8);
+            header.version=SCATANGLE_VERSION;
+            header.nStations=sta.names.size();
+            header.nSamples=nSamples;
+            header.nameWidth=1;
+            for (j=0;j<sta.names.size();j++)
+            {
+                if (sta.names[j].size()>header.nameWidth){header.nameWidth=sta.names[j].size();}
+            }
+            header.flags=gridSampling>0 ? 1 : 0;
+            header.metadataLength=0;
+            //Align the sample records to 16 bytes
+            header.dataOffset=((sizeof(header)+header.nStations*header.nameWidth+15)/16)*16;
+            file.write((char*)&header,sizeof(header));
+            //Station names (null padded)
+            for (j=0;j<sta.names.size();j++)
+            {
+                vector<char> name(header.nameWidth,'\0');
+                copy(sta.names[j].begin(),sta.names[j].end(),name.begin());
+                file.write(&name[0],header.nameWidth);
+            }
+            vector<char> padding(header.dataOffset-sizeof(header)-header.nStations*header.nameWidth,'\0');
+            if (padding.size()>0){file.write(&padding[0],padding.size());}
+            record.resize(1+2*header.nStations);
         }
-        Angles(Stations sta,Scatter scatter){
-            //Get angles for the recievers and scatter distribution
-            int i;
-            for (i=0;i<scatter.nodes.size();i++)
+        bool isOpen(){
+            return file.is_open();
+        }
+        void writeChunk(const vector<angleNode> &nodes){
+            //Sample records: p, azimuths, take-off angles
+            unsigned int i,j;
+            for (i=0;i<nodes.size();i++)
             {
-                if (i % 100 ==0)
+                record[0]=gridSampling>0 ? nodes[i].p : 1.0;
+                for (j=0;j<header.nStations;j++)
                 {
-                    cout<<"Retrieved Sample:"<<i<<" of "<<scatter.nodes.size()<<endl;//Print to terminal 
+                    record[1+j]=nodes[i].azimuth[j];
+                    record[1+header.nStations+j]=nodes[i].takeoff[j];
                 }
-                //Vector of resultant angles for each scatter point
-                vector<vector <string> >stationAngles=getAngles(scatter.nodes[i].x,scatter.nodes[i].y,scatter.nodes[i].z,scatter.nodes[i].p,sta);
-                this->addNode(stationAngles,scatter.nodes[i].p);
+                file.write((char*)&record[0],record.size()*sizeof(float));
+            }
+            nWritten+=nodes.size();
+        }
+        void close(){
+            //Rewrite the header if fewer samples were written than expected (e.g. truncated scatter file)
+            if (nWritten!=header.nSamples)
+            {
+                header.nSamples=nWritten;
+                file.seekp(0);
+                file.write((char*)&header,sizeof(header));
             }
+            file.close();
         }
+    private:
+        ofstream file;
+        ScatAngleHeader header;
+        vector<float> record;
+        unsigned long long nWritten;
+        int gridSampling;
 };
+//Class to write summary files - the angles are reduced to per station azimuth and take-off angle histograms and statistics
+//as the chunks are written (see the Scat2Angle module docstring for the format), so the samples are not stored
+class SummaryAngleWriter: public AngleWriter{
+    public:
+        SummaryAngleWriter(string filename,const Stations &sta,int gridSampling,double binWidth): sta(sta){
+            unsigned int nStations=sta.names.size();
+            this->gridSampling=gridSampling;
+            this->binWidth=binWidth;
+            nAzimuthBins=(int)ceil(360.0/binWidth);
+            nTakeoffBins=(int)ceil(180.0/binWidth);
+            nSamples=0;
+            totalWeight=0.0;
+            histogram.assign(nStations*nAzimuthBins*nTakeoffBins,0.0);
+            sumCos.assign(nStations,0.0);
+            sumSin.assign(nStations,0.0);
+            sumTakeoff.assign(nStations,0.0);
+            sumTakeoff2.assign(nStations,0.0);
+            file.open(filename.c_str());
+        }
+        bool isOpen(){
+            return file.is_open();
+        }
+        void writeChunk(const vector<angleNode> &nodes){
+            //Add the samples to the histograms and sums (weighted by the probability if grid sampling is set)
+            unsigned int i,j;
+            for (i=0;i<nodes.size();i++)
+            {
+                double w=gridSampling>0 ? nodes[i].p : 1.0;
+                for (j=0;j<nodes[i].azimuth.size();j++)
+                {
+                    double azimuth=nodes[i].azimuth[j];
+                    double takeoff=nodes[i].takeoff[j];
+                    histogram[(j*nAzimuthBins+binIndex(azimuth,nAzimuthBins))*nTakeoffBins+binIndex(takeoff,nTakeoffBins)]+=w;
+                    sumCos[j]+=w*cos(azimuth*M_PI/180.0);
+                    sumSin[j]+=w*sin(azimuth*M_PI/180.0);
+                    sumTakeoff[j]+=w*takeoff;
+                    sumTakeoff2[j]+=w*takeoff*takeoff;
+                }
+                totalWeight+=w;
+            }
+            nSamples+=nodes.size();
+        }
+        void close(){
+            //Write the JSON summary
+            unsigned int j;
+            int a,t;
+            file<<setprecision(10);
+            file<<"{\n \"version\": "<<SUMMARY_VERSION<<",\n \"nsamples\": "<<nSamples<<",\n \"grid_sampling\": "<<(gridSampling>0 ? "true" : "false");
+            file<<",\n \"total_weight\": "<<totalWeight<<",\n \"bin_width\": "<<binWidth;
+            file<<",\n \"azimuth_bins\": "<<nAzimuthBins<<",\n \"takeoff_bins\": "<<nTakeoffBins<<",\n \"stations\": [";
+            for (j=0;j<sta.names.size();j++)
+            {
+                file<<(j>0 ? "," : "")<<"\n  {\n   \"name\": \""<<sta.names[j]<<"\"";
+                if (totalWeight>0.0){
+                    //Circular mean and mean resultant length of the azimuth, and the weighted mean and standard deviation of the take-off angle
+                    double azimuth=atan2(sumSin[j],sumCos[j])*180.0/M_PI;
+                    double resultant=sqrt(sumCos[j]*sumCos[j]+sumSin[j]*sumSin[j])/totalWeight;
+                    double takeoff=sumTakeoff[j]/totalWeight;
+                    if (azimuth<0.0){azimuth+=360.0;}
+                    file<<",\n   \"azimuth_mean\": "<<azimuth<<",\n   \"azimuth_resultant_length\": "<<resultant;
+                    file<<",\n   \"azimuth_circular_variance\": "<<1.0-resultant<<",\n   \"azimuth_circular_std\": ";
+                    if (resultant>0.0){file<<sqrt(max(0.0,-2.0*log(resultant)));}else{file<<"null";}
+                    file<<",\n   \"takeoff_mean\": "<<takeoff<<",\n   \"takeoff_std\": "<<sqrt(max(0.0,sumTakeoff2[j]/totalWeight-takeoff*takeoff));
+                }else{
+                    file<<",\n   \"azimuth_mean\": null,\n   \"azimuth_resultant_length\": null,\n   \"azimuth_circular_variance\": null";
+                    file<<",\n   \"azimuth_circular_std\": null,\n   \"takeoff_mean\": null,\n   \"takeoff_std\": null";
+                }
+                file<<",\n   \"histogram\": [";
+                for (a=0;a<nAzimuthBins;a++)
+                {
+                    file<<(a>0 ? ",\n    [" : "\n    [");
+                    for (t=0;t<nTakeoffBins;t++)
+                    {
+                        file<<(t>0 ? ", " : "")<<histogram[(j*nAzimuthBins+a)*nTakeoffBins+t];
+                    }
+                    file<<"]";
+                }
+                file<<"\n   ]\n  }";
+            }
+            file<<"\n ]\n}\n";
+            file.close();
+        }
+    private:
+        ofstream file;
+        const Stations &sta;
+        int gridSampling;
+        double binWidth;
+        int nAzimuthBins;
+        int nTakeoffBins;
+        unsigned long long nSamples;
+        double totalWeight;
+        vector<double> histogram;//Station x azimuth bin x take-off bin weights
+        vector<double> sumCos;
+        vector<double> sumSin;
+        vector<double> sumTakeoff;
+        vector<double> sumTakeoff2;
+        int binIndex(double angle,int nBins){
+            //Angles outside the range are put in the end bins
+            int bin=(int)floor(angle/binWidth);
+            return min(max(bin,0),nBins-1);
+        }
+};
+//Function for getting the take-off angles from the packed angles float value for an open grid file
+void decodeTakeOffAngles(GridHandles &grids,int narr,float value,double *pazim,double *pdip,int *piqual,double sta_azim){
+    TakeOffAngles angles;
+    ::SetAnglesFloat(&angles,value);
+    ::GetTakeOffAngles(&angles,pazim,pdip,piqual);
+    //Determine azimuth (2D grids)
+    if (grids.gdesc[narr].type==GRID_ANGLE_2D){
+        if (*pazim>0.0){
+            *pazim=sta_azim;
+        }else{
+            *pazim=sta_azim-180.0;
+            if (*pazim<0.0){*pazim+=360.0;}
+        }
+    }
+}
+//Function for getting the take-off angles from the open grid file (as ReadTakeOffAnglesFile in GridLib.c, without opening the file)
+void readTakeOffAngles(GridHandles &grids,int narr,double xloc,double yloc,double zloc,double *pazim,double *pdip,int *piqual,double sta_azim){
+    TakeOffAngles angles;
+    if (!grids.isOpen[narr]){
+        //Cannot open angle grid file, so ignore angles
+        angles=::SetTakeOffAngles(0.0,0.0,0);
+        ::GetTakeOffAngles(&angles,pazim,pdip,piqual);
+        return;
+    }
+    //Get angles float value on grid
+    decodeTakeOffAngles(grids,narr,::ReadAbsInterpGrid3d(grids.fpGrid[narr],&grids.gdesc[narr],xloc,yloc,zloc),pazim,pdip,piqual,sta_azim);
+}
+//Function for getting the grid location of a sample for a station (the distance and depth for 2D grids, with the station azimuth)
+void gridLocation(double x,double y,double z,const Stations &sta,int narr,double *xloc,double *yloc,double *zloc,double *sta_azim){
+    if (sta.dimension[narr] == 2) {
+        //2D so need to get distance and azimuth
+        double distance = ::GetEpiDist(const_cast<SourceDesc *>(&(sta.srce[narr])), x, y);
+        *sta_azim = ::GetEpiAzim(const_cast<SourceDesc *>(&(sta.srce[narr])), x, y);//Receiver azimuth is calculated here not in the grid file (grid only contains take-off angles)
+        if (GeometryMode == MODE_GLOBAL){distance = KM2DEG*distance;}//Convert Distance to degrees for global grids
+        *xloc=0.0;
+        *yloc=distance;
+    }else{
+        //3D
+        *sta_azim=-1.0;
+        *xloc=x;
+        *yloc=y;
+    }
+    *zloc=z;
+}
 //Function for getting the angles for a given x,y,z point 
-vector<vector<string > > getAngles(double x, double y, double z,double p,Stations sta) {
+angleNode getAngles(double x, double y, double z,double p,const Stations &sta,GridHandles &grids) {
     int narr;
-    int iSwapBytesOnInput=0;
    
     /* loop over arrivals */
-    vector<vector<string > > stationAngles;
-    ::SetConstants();//Set the constant values (NLLoc Gridlib fn)
+    angleNode stationAngles(p);
     for (narr = 0; narr < sta.filenames.size(); narr++) {
-        vector<string > angles;        
-        std::ostringstream sstream;
         //Default values
         double ray_azim=10.0;
         double ray_dip=10.0;
         int ray_qual=0;
-        double azimuth=0.0;
-        double distance=0.0;
-        //convert angle filename to c string
-        char * filename=new char[sta.filenames[narr].size()+1];
-        //Copy the filename into the station filenames object.
-        copy(sta.filenames[narr].begin(),sta.filenames[narr].end(),filename);
-        filename[sta.filenames[narr].size()]='\0';//Null terminate
-        //Check station dimension
-        if (sta.dimension[narr] == 2) {
-            //2D so need to get distance and azimuth
-            distance = ::GetEpiDist(&(sta.srce[narr]), x, y);
-            azimuth = ::GetEpiAzim(&(sta.srce[narr]), x, y);//Receiver azimuth is calculated here not in the grid file (grid only contains take-off angles)
-            if (GeometryMode == MODE_GLOBAL){distance = KM2DEG*distance;}//Convert Distance to degrees for global grids
-            // cout <<" B 2D "<<distance<< " "<<azimuth<<endl; 
-            //Read the angle for the distance and depth
-            ::ReadTakeOffAnglesFile(filename,0.0,distance, z,&ray_azim,&ray_dip,&ray_qual, azimuth, iSwapBytesOnInput);
-        }else{
-            //3D
-            //Read the angles for the x,y, and z values
-            ::ReadTakeOffAnglesFile(filename,x, y, z,&ray_azim,&ray_dip,&ray_qual, -1.0, iSwapBytesOnInput);
-        
-        }
-        //Add  angles name to output vector
-        angles.push_back(sta.names[narr]);       
+        double xloc,yloc,zloc,azimuth;
+        //Get the grid location (distance and depth for 2D grids) and read the angles
+        gridLocation(x,y,z,sta,narr,&xloc,&yloc,&zloc,&azimuth);
+        readTakeOffAngles(grids,narr,xloc,yloc,zloc,&ray_azim,&ray_dip,&ray_qual,azimuth);
+        //Add angles to output node
         ray_azim/=1.0;//Azim is in range 0-3600 in tenths of a degree      
         ray_dip/=1.0;//Dip is in range 0-1800 in tenths of a degree - 1800 is up
         //cout<<ray_dip<<"\t"<<ray_azim<<endl;
-        sstream << ray_azim;
-        sstream<<"\t";
-        sstream << ray_dip;
-        angles.push_back(sstream.str());
-        stationAngles.push_back(angles);
+        stationAngles.azimuth.push_back(ray_azim);
+        stationAngles.takeoff.push_back(ray_dip);
         }
     //Return the station angles output
     return stationAngles;
     }
+//Function for getting the angles for a block of samples (run on each thread), with the results in the same order as the samples
+void getBlockAngles(const vector<xyzNode> &nodes,vector<angleNode> &angles,int start,int end,const Stations &sta,GridHandles *grids){
+    int i;
+    for (i=start;i<end;i++)
+    {
+        angles[i]=getAngles(nodes[i].x,nodes[i].y,nodes[i].z,nodes[i].p,sta,*grids);
+    }
+}
+//Class to hold a sample location in an angle grid cell for the cell lookup
+class cellLocation{
+public:
+    long long cell;//Grid cell index (-1 if outside the grid)
+    double xloc;
+    double yloc;
+    double zloc;
+    double staAzim;
+    int sample;//Sample index
+    bool operator<(const cellLocation &other) const{
+        if (cell!=other.cell){return cell<other.cell;}
+        if (xloc!=other.xloc){return xloc<other.xloc;}
+        if (yloc!=other.yloc){return yloc<other.yloc;}
+        return zloc<other.zloc;
+    }
+};
+//Function for getting the angles for a block of samples by angle grid cell (run on each thread), with the results in the same order as the samples
+//The samples are sorted by the grid cell they fall in for each station, so the eight cell corner values are read from the grid file once per cell,
+//rather than once per sample (as in ReadAbsInterpGrid3d), and are then interpolated for each sample in the cell, giving the same results.
+//If the tolerance is positive, the grid locations are rounded to the nearest multiple of the tolerance first, and samples with the same rounded location
+//reuse the interpolated value.
+void getBlockAnglesByCell(const vector<xyzNode> &nodes,vector<angleNode> &angles,int start,int end,const Stations &sta,GridHandles *grids,double tolerance){
+    int i,narr;
+    unsigned int k;
+    for (i=start;i<end;i++)
+    {
+        angles[i]=angleNode(nodes[i].p);
+        angles[i].azimuth.resize(sta.filenames.size());
+        angles[i].takeoff.resize(sta.filenames.size());
+    }
+    vector<cellLocation> locations(end-start);
+    for (narr=0;narr<(int)sta.filenames.size();narr++)
+    {
+        GridDesc *pgrid=&grids->gdesc[narr];
+        double ray_azim,ray_dip;
+        int ray_qual;
+        if (!grids->isOpen[narr]){
+            for (i=start;i<end;i++)
+            {
+                readTakeOffAngles(*grids,narr,0.0,0.0,0.0,&ray_azim,&ray_dip,&ray_qual,-1.0);
+                angles[i].azimuth[narr]=ray_azim;
+                angles[i].takeoff[narr]=ray_dip;
+            }
+            continue;
+        }
+        //Get the grid cell for each sample (as in ReadAbsInterpGrid3d)
+        for (i=start;i<end;i++)
+        {
+            cellLocation &location=locations[i-start];
+            location.sample=i;
+            gridLocation(nodes[i].x,nodes[i].y,nodes[i].z,sta,narr,&location.xloc,&location.yloc,&location.zloc,&location.staAzim);
+            if (tolerance>0.0){
+                location.xloc=tolerance*floor(location.xloc/tolerance+0.5);
+                location.yloc=tolerance*floor(location.yloc/tolerance+0.5);
+                location.zloc=tolerance*floor(location.zloc/tolerance+0.5);
+            }
+            double xoff=(location.xloc-pgrid->origx)/pgrid->dx;
+            double yoff=(location.yloc-pgrid->origy)/pgrid->dy;
+            double zoff=(location.zloc-pgrid->origz)/pgrid->dz;
+            int ix0=(int)(xoff-VERY_SMALL_DOUBLE);
+            int iy0=(int)(yoff-VERY_SMALL_DOUBLE);
+            int iz0=(int)(zoff-VERY_SMALL_DOUBLE);
+            double xdiff=xoff-(double)ix0;
+            double ydiff=yoff-(double)iy0;
+            double zdiff=zoff-(double)iz0;
+            if (xdiff<0.0 || xdiff>1.0 || ydiff<0.0 || ydiff>1.0 || zdiff<0.0 || zdiff>1.0){
+                location.cell=-1;
+            }else{
+                location.cell=((long long)ix0*pgrid->numy+iy0)*pgrid->numz+iz0;
+            }
+        }
+        sort(locations.begin(),locations.end());
+        //Read the corner values once per cell and interpolate for each sample
+        long long cell=-1;
+        int ix0=0,iy0=0,iz0=0,ix1=0,iy1=0,iz1=0;
+        double vval[8]={0.0,0.0,0.0,0.0,0.0,0.0,0.0,0.0};
+        float value=-VERY_LARGE_FLOAT;
+        for (k=0;k<locations.size();k++)
+        {
+            const cellLocation &location=locations[k];
+            bool reuse=tolerance>0.0 && k>0 && !(locations[k-1]<location);
+            if (location.cell<0){
+                value=-VERY_LARGE_FLOAT;
+            }else if (!reuse){
+                if (location.cell!=cell){
+                    cell=location.cell;
+                    ix0=(int)(cell/((long long)pgrid->numy*pgrid->numz));
+                    iy0=(int)((cell/pgrid->numz)%pgrid->numy);
+                    iz0=(int)(cell%pgrid->numz);
+                    ix1=(ix0<pgrid->numx-1) ? ix0+1 : ix0;
+                    iy1=(iy0<pgrid->numy-1) ? iy0+1 : iy0;
+                    iz1=(iz0<pgrid->numz-1) ? iz0+1 : iz0;
+                    vval[0]=::ReadGrid3dValue(grids->fpGrid[narr],ix0,iy0,iz0,pgrid);
+                    vval[1]=::ReadGrid3dValue(grids->fpGrid[narr],ix0,iy0,iz1,pgrid);
+                    vval[2]=::ReadGrid3dValue(grids->fpGrid[narr],ix0,iy1,iz0,pgrid);
+                    vval[3]=::ReadGrid3dValue(grids->fpGrid[narr],ix0,iy1,iz1,pgrid);
+                    vval[4]=::ReadGrid3dValue(grids->fpGrid[narr],ix1,iy0,iz0,pgrid);
+                    vval[5]=::ReadGrid3dValue(grids->fpGrid[narr],ix1,iy0,iz1,pgrid);
+                    vval[6]=::ReadGrid3dValue(grids->fpGrid[narr],ix1,iy1,iz0,pgrid);
+                    vval[7]=::ReadGrid3dValue(grids->fpGrid[narr],ix1,iy1,iz1,pgrid);
+                    grids->cellReads++;
+                }
+                double xdiff=(location.xloc-pgrid->origx)/pgrid->dx-(double)ix0;
+                double ydiff=(location.yloc-pgrid->origy)/pgrid->dy-(double)iy0;
+                double zdiff=(location.zloc-pgrid->origz)/pgrid->dz-(double)iz0;
+                if (xdiff+ydiff+zdiff<SMALL_FLOAT){
+                    //location at grid node
+                    value=vval[0];
+                }else{
+                    value=::InterpCubeAngles(xdiff,ydiff,zdiff,vval[0],vval[1],vval[2],vval[3],vval[4],vval[5],vval[6],vval[7]);
+                }
+            }
+            decodeTakeOffAngles(*grids,narr,value,&ray_azim,&ray_dip,&ray_qual,location.staAzim);
+            angles[location.sample].azimuth[narr]=ray_azim;
+            angles[location.sample].takeoff[narr]=ray_dip;
+        }
+        grids->lookups+=locations.size();
+    }
+}
 //Read stations
 Stations readStationFile(string filename){
     //Read station files and return the a Stations object
@@ -229,100 +681,132 @@ Stations readStationFile(string filename){
     //Return Station object
 	return stations;
 }
-//Read scatter
-Scatter readScatterFile(string filename){
-    //Read scatter file and returns Scatter object
-	ifstream file;
-    //Print filename to std out
-    cout<<filename<<endl;
-    //Open binary file
-	file.open(filename.c_str(),ios::in|ios::binary);
-	char buffer[128];
-    //Temporary values
-	float xf;
-	float yf;
-	float zf;
-	float pf;
-	int nSamples; 
-    float d;
-    int i;
-	Scatter scatter;
-    //Read number of samples (as integer)
-	file.read((char*)&nSamples,sizeof(int));
-    cout <<"Samples: "<<nSamples<<'\n'<<endl;
-    //Null values
-	file.read((char*)&d,sizeof(float));
-	file.read((char*)&d,sizeof(float));
-	file.read((char*)&d,sizeof(float));
-    //Loop over samples
-    for (i=0;i<nSamples;i++)
-	{
-        //Read x,y,z and p values for each sample
-		file.read((char*)&xf,sizeof(float));
-		file.read((char*)&yf,sizeof(float));
-		file.read((char*)&zf,sizeof(float));
-		file.read((char*)&pf,sizeof(float));
-        //Add scatter node
-		scatter.addNode(xf,yf,zf,pf);
-	}
-    //Close file
-	file.close();
-    //Return Scatter object
-	return scatter;
-}
-//Save results
-int saveAngles(Angles angles,string filename,int gridSampling){
-    //save the resultant angles
-	ofstream file;
-    cout<<"Saving results"<<endl;
-    //Make file extension scatangle
-	filename.append("angle");
-    //open filename
-	file.open(filename.c_str());
-	if (file.is_open())
-	{
-        //Loop over samples
-		int i;
-		for (i=0;i<angles.nodes.size();i++)
-		{
-            if (gridSampling>0){
-                //output probability if grid sampling is set
-    			file<<angles.nodes[i].p<<'\n';
-            }
-            else{
-                //Otherwise output 1 when samples are drawn directly from the location distribution
-                file<<'1'<<'\n';
-
-            }
-			int j;
-            //Output angles for each station.
-			for (j=0;j<angles.nodes[i].stationAngles.size();j++)
-			{
-				file <<angles.nodes[i].stationAngles[j][0]<<'\t'<<angles.nodes[i].stationAngles[j][1]<<'\n';
-			}
-			file <<'\n';
-		}
-        //Close file
-		file.close();
-	}
-	return 0;
-}
 //Main Function
 int main(int argc,char **argv){
     //Main function
-    //Get command line arguments (fn scatterFilename stationFilename gridSampling(integer) )
-	string scatterFilename=string(argv[1]);
-	string stationFilename=string(argv[2]);
-    int gridSampling=atoi(argv[3]);
+    //Get command line arguments (fn scatterFilename stationFilename gridSampling(integer) [outputFormat(text|binary|summary)] [--threads N] [--bin_width W] [--cell_lookup] [--tolerance T])
+    vector<string> args;
+    int nThreads=1;
+    double binWidth=DEFAULT_BIN_WIDTH;
+    int cellLookup=0;
+    double tolerance=0.0;
+    for (int n=1;n<argc;n++)
+    {
+        if (string(argv[n])=="--threads" && n+1<argc){
+            nThreads=atoi(argv[++n]);
+        }else if (string(argv[n])=="--bin_width" && n+1<argc){
+            binWidth=atof(argv[++n]);
+        }else if (string(argv[n])=="--cell_lookup"){
+            cellLookup=1;
+        }else if (string(argv[n])=="--tolerance" && n+1<argc){
+            //A positive tolerance uses the cell lookup
+            tolerance=atof(argv[++n]);
+            cellLookup=cellLookup || tolerance>0.0;
+        }else{
+            args.push_back(string(argv[n]));
+        }
+    }
+    if (args.size()<3){
+        cerr<<"Usage: "<<argv[0]<<" scatterFilename stationFilename gridSampling [text|binary|summary] [--threads N] [--bin_width W] [--cell_lookup] [--tolerance T]"<<endl;
+        return 1;
+    }
+    if (!(binWidth>0.0)){
+        cerr<<"ERROR: summary bin width must be positive"<<endl;
+        return 1;
+    }
+	string scatterFilename=args[0];
+	string stationFilename=args[1];
+    int gridSampling=atoi(args[2].c_str());
+    int binaryOutput=args.size()>3 && args[3]=="binary";
+    int summaryOutput=args.size()>3 && args[3]=="summary";
+    //Use all the cores if the number of threads is not positive
+    if (nThreads<1){nThreads=max(1,(int)thread::hardware_concurrency());}
+    int i,t;
+    //Set the constant values (NLLoc Gridlib fn)
+    ::SetConstants();
 	Stations stations;
     //read stations
 	stations=readStationFile(stationFilename);
-	Scatter scatter;
-    //Read scatter
-	scatter=readScatterFile(scatterFilename);
-    //Get angles
-	Angles angles(stations,scatter);
-    //Save results
-	saveAngles(angles,scatterFilename,gridSampling);
+    if (stations.names.size()==0){
+        cerr<<"ERROR: no stations read from station file: "<<stationFilename<<endl;
+        return 1;
+    }
+    //Open scatter file
+	ScatterReader scatter(scatterFilename);
+    if (!scatter.isOpen()){
+        cerr<<"ERROR: cannot open scatter file: "<<scatterFilename<<endl;
+        return 1;
+    }
+    //Open output file
+    AngleWriter *writer;
+    if (summaryOutput){
+        writer=new SummaryAngleWriter(scatterFilename+"angle.summary",stations,gridSampling,binWidth);
+    }else if (binaryOutput){
+        writer=new BinaryAngleWriter(scatterFilename+"angle.bin",stations,gridSampling,scatter.nSamples);
+    }else{
+        writer=new TextAngleWriter(scatterFilename+"angle",stations,gridSampling);
+    }
+    if (!writer->isOpen()){
+        cerr<<"ERROR: cannot open output file for: "<<scatterFilename<<endl;
+        delete writer;
+        return 1;
+    }
+    //Open the grid files for each thread
+    vector<GridHandles *> grids;
+    for (t=0;t<nThreads;t++){grids.push_back(new GridHandles(stations));}
+    //Read, convert and save the samples in chunks, so only a chunk of samples and angles is held in memory
+    //Each chunk is split into contiguous blocks of samples for the threads, with the angles written back in the sample order
+    vector<xyzNode> nodes;
+    vector<angleNode> angles;
+    while (scatter.readChunk(nodes,CHUNK_SIZE*nThreads)>0)
+    {
+        int n=nodes.size();
+        angles.assign(n,angleNode(0.0));
+        if (nThreads==1){
+            if (cellLookup){
+                getBlockAnglesByCell(nodes,angles,0,n,stations,grids[0],tolerance);
+            }else{
+                getBlockAngles(nodes,angles,0,n,stations,grids[0]);
+            }
+        }else{
+            vector<thread> workers;
+            for (t=0;t<nThreads;t++)
+            {
+                int blockStart=(int)((long long)n*t/nThreads);
+                int blockEnd=(int)((long long)n*(t+1)/nThreads);
+                if (cellLookup){
+                    workers.push_back(thread(getBlockAnglesByCell,cref(nodes),ref(angles),blockStart,blockEnd,cref(stations),grids[t],tolerance));
+                }else{
+                    workers.push_back(thread(getBlockAngles,cref(nodes),ref(angles),blockStart,blockEnd,cref(stations),grids[t]));
+                }
+            }
+            for (t=0;t<nThreads;t++){workers[t].join();}
+        }
+        for (i=0;i<n;i++)
+        {
+            if ((scatter.nRead-n+i) % 100 ==0)
+            {
+                cout<<"Retrieved Sample:"<<scatter.nRead-n+i<<" of "<<scatter.nSamples<<endl;//Print to terminal 
+            }
+        }
+        writer->writeChunk(angles);
+    }
+    if (cellLookup){
+        unsigned long long cellReads=0,lookups=0;
+        for (t=0;t<nThreads;t++)
+        {
+            cellReads+=grids[t]->cellReads;
+            lookups+=grids[t]->lookups;
+        }
+        cout<<"Grid cell reads: "<<cellReads<<" for "<<lookups<<" sample lookups"<<endl;
+    }
+    for (t=0;t<nThreads;t++){delete grids[t];}
+    cout<<"Saving results"<<endl;
+    writer->close();
+    delete writer;
+    if (scatter.nRead<scatter.nSamples){
+        cerr<<"ERROR: scatter file truncated, read "<<scatter.nRead<<" of "<<scatter.nSamples<<" samples: "<<scatterFilename<<endl;
+        return 1;
+    }
 	return 0;
 }
@@ -0,0 +1,372 @@
+#!/usr/bin/python
+"""GridLib
+***********************
+
+Python (numpy) implementation of the parts of the NonLinLoc GridLib code used by GetNLLOCScatterAngles.
+
+The grid buffer (.buf) files are memory mapped once per station, and the angles for all the samples are
+interpolated in a single vectorised operation per station, rather than reopening the grid files for each
+sample and station (as ReadTakeOffAnglesFile does). The interpolation follows ReadAbsInterpGrid3d and
+InterpCubeAngles in GridLib.c, including the packing of the azimuth, dip and quality values into a single float,
+so that the results are the same as those from the C++ executable.
+
+Scatter samples cluster tightly, so many samples fall in the same grid cell. With cell_lookup set, the samples are bucketed by grid cell,
+and the cell corner values are read once per cell (as in the --cell_lookup mode of GetNLLOCScatterAngles), giving the same results with
+fewer reads from the (memory mapped) grid. A positive tolerance rounds the locations to multiples of the tolerance first, so samples with the
+same rounded location share the interpolated value.
+
+As for GetNLLOCScatterAngles, rectangular (non-GLOBAL) geometry is assumed when calculating epicentral
+distances and azimuths for 2D grids.
+"""
+import collections,threading
+import numpy as np
+#Constants from GridLib.h
+VERY_SMALL_DOUBLE=1.0e-30
+SMALL_FLOAT=float(np.float32(1.0e-20))
+VERY_LARGE_FLOAT=float(np.float32(1.0e30))
+ANGLE_QUALITY_CUTOFF=5
+ANGLES_OFFSET=16
+def _numpy_endian(endian='='):
+    """Converts a struct module endian value to the numpy dtype byte order character
+
+    Args
+        endian: endian value for binary numbers (struct module format)
+
+    Returns
+        str: numpy byte order character
+    """
+    return {'@':'=','!':'>'}.get(endian,endian)
+def read_grid_header(grid_file):
+    """Reads a NonLinLoc grid header file
+
+    Args
+        grid_file: str grid file root (without the .hdr or .buf extension)
+
+    Returns
+        dict: dictionary of the grid description (numx, numy, numz, origx, origy, origz, dx, dy, dz, type and float_type)
+                and the source (station) label, x, y and z if present.
+    """
+    lines=open(grid_file+'.hdr').readlines()
+    values=lines[0].split()
+    header={'numx':int(values[0]),'numy':int(values[1]),'numz':int(values[2]),
+            'origx':float(values[3]),'origy':float(values[4]),'origz':float(values[5]),
+            'dx':float(values[6]),'dy':float(values[7]),'dz':float(values[8]),
+            'type':values[9],'float_type':'FLOAT'}
+    if len(values)>10:
+        header['float_type']=values[10]
+    #make sure that dx for 2D grids is non-zero
+    if header['numx']==1:
+        header['dx']=1.0
+    if len(lines)>1 and len(lines[1].split())>=4:
+        source=lines[1].split()
+        header['label']=source[0]
+        header['x']=float(source[1])
+        header['y']=float(source[2])
+        header['z']=float(source[3])
+    return header
+def decode_angles(values):
+    """Decodes take-off angles packed into float values (GetTakeOffAngles in GridLib.c)
+
+    Args
+        values: numpy array of float32 values containing the packed angles
+
+    Returns
+        (numpy.array,numpy.array,numpy.array): tuple of azimuth, dip and quality arrays
+    """
+    packed=np.ascontiguousarray(values,dtype=np.float32).reshape(-1).view(np.uint16).reshape(-1,2)
+    shape=np.shape(values)
+    azimuth=(packed[:,1]/10.0).reshape(shape)
+    dip=((packed[:,0]//ANGLES_OFFSET)/10.0).reshape(shape)
+    quality=(packed[:,0]%ANGLES_OFFSET).astype(np.int32).reshape(shape)
+    return azimuth,dip,quality
+def encode_angles(azimuth,dip,quality):
+    """Packs take-off angles into float values (SetTakeOffAngles in GridLib.c)
+
+    Args
+        azimuth: numpy array of azimuths in degrees
+        dip: numpy array of dips in degrees
+        quality: numpy array of integer qualities
+
+    Returns
+        numpy.array: float32 array of packed angles
+    """
+    azimuth=np.asarray(azimuth,dtype=np.float64)
+    packed=np.empty(azimuth.shape+(2,),dtype=np.uint16)
+    #Casts to unsigned short are truncated through a (wrapping) integer conversion as in the C code
+    packed[...,1]=(0.5+10.0*azimuth).astype(np.int64)&0xFFFF
+    packed[...,0]=(np.asarray(quality,dtype=np.int64)+ANGLES_OFFSET*((0.5+10.0*np.asarray(dip,dtype=np.float64)).astype(np.int64)&0xFFFF))&0xFFFF
+    return packed.view(np.float32).reshape(azimuth.shape)
+def interp_cube_lagrange(xdiff,ydiff,zdiff,vval):
+    """Lagrange interpolation inside a cube (InterpCubeLagrange in GridLib.c)
+
+    Args
+        xdiff: numpy array of fractional x positions in the cube (0-1)
+        ydiff: numpy array of fractional y positions in the cube (0-1)
+        zdiff: numpy array of fractional z positions in the cube (0-1)
+        vval: sequence of the 8 vertex value arrays ordered 000, 001, 010, 011, 100, 101, 110, 111
+
+    Returns
+        numpy.array: interpolated values
+    """
+    one_minus_xdiff=1.0-xdiff
+    one_minus_ydiff=1.0-ydiff
+    one_minus_zdiff=1.0-zdiff
+    #Same order of operations as the C code
+    return (vval[0]*one_minus_xdiff*one_minus_ydiff*one_minus_zdiff
+            +vval[1]*one_minus_xdiff*one_minus_ydiff*zdiff
+            +vval[2]*one_minus_xdiff*ydiff*one_minus_zdiff
+            +vval[3]*one_minus_xdiff*ydiff*zdiff
+            +vval[4]*xdiff*one_minus_ydiff*one_minus_zdiff
+            +vval[5]*xdiff*one_minus_ydiff*zdiff
+            +vval[6]*xdiff*ydiff*one_minus_zdiff
+            +vval[7]*xdiff*ydiff*zdiff)
+def interp_cube_angles(xdiff,ydiff,zdiff,vval):
+    """Interpolates packed take-off angles inside a cube (InterpCubeAngles in GridLib.c)
+
+    Args
+        xdiff: numpy array of fractional x positions in the cube (0-1)
+        ydiff: numpy array of fractional y positions in the cube (0-1)
+        zdiff: numpy array of fractional z positions in the cube (0-1)
+        vval: sequence of the 8 vertex float32 value arrays ordered 000, 001, 010, 011, 100, 101, 110, 111
+
+    Returns
+        numpy.array: float32 array of packed interpolated angles
+    """
+    azimuth,dip,quality=decode_angles(np.array(vval,dtype=np.float32))
+    quality_low=quality.min(axis=0)
+    #correct azimuths to avoid discontinuity at 0/360 deg
+    azimuth_test=azimuth-azimuth[0]
+    azimuth=np.where(azimuth_test<-90.0,azimuth+360.0,np.where(azimuth_test>90.0,azimuth-360.0,azimuth))
+    azimuth_interp=interp_cube_lagrange(xdiff,ydiff,zdiff,azimuth)
+    azimuth_interp=np.where(azimuth_interp<0.0,azimuth_interp+360.0,np.where(azimuth_interp>360.0,azimuth_interp-360.0,azimuth_interp))
+    dip_interp=interp_cube_lagrange(xdiff,ydiff,zdiff,dip)
+    #if lowest quality is too low, use nearest node
+    return np.where(quality_low<ANGLE_QUALITY_CUTOFF,np.asarray(vval[0],dtype=np.float32),encode_angles(azimuth_interp,dip_interp,quality_low))
+class Grid(object):
+    """NonLinLoc grid with a memory mapped buffer
+
+    Args
+        grid_file: str grid file root (without the .hdr or .buf extension)
+
+    Keyword Args
+        endian: endian value for the grid buffer file (struct module format)
+    """
+    def __init__(self,grid_file,endian='='):
+        self.grid_file=grid_file
+        self.header=read_grid_header(grid_file)
+        if self.header['float_type']!='FLOAT':
+            raise ValueError('Grid file: "'+grid_file+'" float type '+self.header['float_type']+' is not supported (only FLOAT)')
+        self.buffer=np.memmap(grid_file+'.buf',dtype=_numpy_endian(endian)+'f4',mode='r',
+                              shape=(self.header['numx'],self.header['numy'],self.header['numz']))
+    def load(self):
+        """Loads the grid buffer into memory (as native byte order floats) rather than reading it from the memory mapped file"""
+        self.buffer=np.array(self.buffer,dtype=np.float32)
+    @property
+    def is_2d(self):
+        return self.header['type'].endswith('2D')
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+    def epicentral(self,x,y):
+        """Calculates the epicentral distance and azimuth from the locations to the grid source (station)
+
+        Uses rectangular geometry, as in GetEpiDist and GetEpiAzim in GridLib.c
+
+        Args
+            x: numpy array of x coordinates
+            y: numpy array of y coordinates
+
+        Returns
+            (numpy.array,numpy.array): tuple of distance and azimuth (degrees) arrays
+        """
+        xtmp=self.header['x']-np.asarray(x,dtype=np.float64)
+        ytmp=self.header['y']-np.asarray(y,dtype=np.float64)
+        azimuth=np.degrees(np.arctan2(xtmp,ytmp))
+        azimuth=np.where(azimuth<0.0,azimuth+360.0,azimuth)
+        return np.sqrt(xtmp*xtmp+ytmp*ytmp),azimuth
+    def _vertex_values(self,ix,iy,iz):
+        """Reads grid values at index locations, with out of range indices set to -VERY_LARGE_FLOAT (ReadGrid3dValue in GridLib.c)"""
+        valid=(ix>=0)&(ix<self.header['numx'])&(iy>=0)&(iy<self.header['numy'])&(iz>=0)&(iz<self.header['numz'])
+        values=self.buffer[np.clip(ix,0,self.header['numx']-1),np.clip(iy,0,self.header['numy']-1),np.clip(iz,0,self.header['numz']-1)]
+        return np.where(valid,values,np.float32(-VERY_LARGE_FLOAT)).astype(np.float32)
+    def _cell_vertex_values(self,ix0,iy0,iz0):
+        """Reads the 8 corner values of the grid cells, ordered 000, 001, 010, 011, 100, 101, 110, 111 (as in ReadAbsInterpGrid3d in GridLib.c)"""
+        ix1=np.where(ix0<self.header['numx']-1,ix0+1,ix0)
+        iy1=np.where(iy0<self.header['numy']-1,iy0+1,iy0)
+        iz1=np.where(iz0<self.header['numz']-1,iz0+1,iz0)
+        return [self._vertex_values(ix0,iy0,iz0),self._vertex_values(ix0,iy0,iz1),
+                self._vertex_values(ix0,iy1,iz0),self._vertex_values(ix0,iy1,iz1),
+                self._vertex_values(ix1,iy0,iz0),self._vertex_values(ix1,iy0,iz1),
+                self._vertex_values(ix1,iy1,iz0),self._vertex_values(ix1,iy1,iz1)]
+    def interpolate(self,xloc,yloc,zloc,cell_lookup=False,tolerance=0.0):
+        """Interpolates the grid values at absolute locations (ReadAbsInterpGrid3d in GridLib.c)
+
+        Locations outside the grid are set to -VERY_LARGE_FLOAT
+
+        Args
+            xloc: numpy array of x coordinates
+            yloc: numpy array of y coordinates
+            zloc: numpy array of z coordinates
+
+        Keyword Args
+            cell_lookup: bool flag to read the corner values once for each grid cell containing locations
+            tolerance: float tolerance to round the locations to before interpolating, with each rounded location interpolated once (uses the cell lookup)
+
+        Returns
+            numpy.array: float32 array of interpolated values
+        """
+        xloc,yloc,zloc=np.broadcast_arrays(np.asarray(xloc,dtype=np.float64),np.asarray(yloc,dtype=np.float64),np.asarray(zloc,dtype=np.float64))
+        shape=xloc.shape
+        if tolerance>0:
+            #Same rounding as getBlockAnglesByCell in GetAngles.cpp
+            locations=np.stack([tolerance*np.floor(loc.ravel()/tolerance+0.5) for loc in (xloc,yloc,zloc)],axis=1)
+            locations,inverse=np.unique(locations,axis=0,return_inverse=True)
+            values=self.interpolate(locations[:,0],locations[:,1],locations[:,2],cell_lookup=True)
+            return values[inverse.ravel()].reshape(shape)
+        values=np.full(shape,-VERY_LARGE_FLOAT,dtype=np.float32)
+        #calculate grid locations on edge of solid containing point
+        xoff=(xloc-self.header['origx'])/self.header['dx']
+        yoff=(yloc-self.header['origy'])/self.header['dy']
+        zoff=(zloc-self.header['origz'])/self.header['dz']
+        #C integer casts truncate towards zero
+        ix0=(xoff-VERY_SMALL_DOUBLE).astype(np.int64)
+        iy0=(yoff-VERY_SMALL_DOUBLE).astype(np.int64)
+        iz0=(zoff-VERY_SMALL_DOUBLE).astype(np.int64)
+        xdiff=xoff-ix0
+        ydiff=yoff-iy0
+        zdiff=zoff-iz0
+        inside=(xdiff>=0.0)&(xdiff<=1.0)&(ydiff>=0.0)&(ydiff<=1.0)&(zdiff>=0.0)&(zdiff<=1.0)
+        if not inside.any():
+            return values
+        ix0,iy0,iz0,xdiff,ydiff,zdiff=ix0[inside],iy0[inside],iz0[inside],xdiff[inside],ydiff[inside],zdiff[inside]
+        if cell_lookup:
+            #Bucket the locations by grid cell and read the corner values for each cell once
+            cells,first,inverse=np.unique((ix0*self.header['numy']+iy0)*self.header['numz']+iz0,return_index=True,return_inverse=True)
+            vval=[values[inverse.ravel()] for values in self._cell_vertex_values(ix0[first],iy0[first],iz0[first])]
+        else:
+            vval=self._cell_vertex_values(ix0,iy0,iz0)
+        interp=self._interpolate_cube(xdiff,ydiff,zdiff,vval)
+        #location at grid node
+        values[inside]=np.where(xdiff+ydiff+zdiff<SMALL_FLOAT,vval[0],interp)
+        return values
+    def _interpolate_cube(self,xdiff,ydiff,zdiff,vval):
+        """Interpolates the values inside the grid cells"""
+        #check for invalid / mask nodes
+        invalid=np.any([v<0.0 for v in vval],axis=0)
+        interp=interp_cube_lagrange(xdiff,ydiff,zdiff,[v.astype(np.float64) for v in vval])
+        return np.where(invalid,-VERY_LARGE_FLOAT,interp).astype(np.float32)
+class AngleGrid(Grid):
+    """NonLinLoc take-off angle grid (ANGLE or ANGLE2D) with a memory mapped buffer
+
+    Args
+        grid_file: str angle grid file root (without the .hdr or .buf extension)
+
+    Keyword Args
+        endian: endian value for the grid buffer file (struct module format)
+    """
+    def _interpolate_cube(self,xdiff,ydiff,zdiff,vval):
+        return interp_cube_angles(xdiff,ydiff,zdiff,vval)
+    def angles(self,x,y,z,cell_lookup=False,tolerance=0.0):
+        """Gets the take-off angles for the locations (ReadTakeOffAnglesFile in GridLib.c)
+
+        For 2D grids the grid is evaluated at the epicentral distance, and the azimuth is calculated
+        from the location to the station.
+
+        Args
+            x: numpy array of x coordinates
+            y: numpy array of y coordinates
+            z: numpy array of z coordinates
+
+        Keyword Args
+            cell_lookup: bool flag to read the corner values once for each grid cell containing locations
+            tolerance: float tolerance (km) to round the grid locations to before interpolating (see interpolate)
+
+        Returns
+            (numpy.array,numpy.array,numpy.array): tuple of azimuth, dip (take-off angle) and quality arrays
+        """
+        if self.is_2d:
+            distance,station_azimuth=self.epicentral(x,y)
+            azimuth,dip,quality=decode_angles(self.interpolate(0.0,distance,z,cell_lookup,tolerance))
+            azimuth=np.where(azimuth>0.0,station_azimuth,np.where(station_azimuth-180.0<0.0,station_azimuth+180.0,station_azimuth-180.0))
+            return azimuth,dip,quality
+        return decode_angles(self.interpolate(x,y,z,cell_lookup,tolerance))
+class TimeGrid(Grid):
+    """NonLinLoc travel time grid (TIME or TIME2D) with a memory mapped buffer
+
+    Args
+        grid_file: str time grid file root (without the .hdr or .buf extension)
+
+    Keyword Args
+        endian: endian value for the grid buffer file (struct module format)
+    """
+    def times(self,x,y,z):
+        """Gets the travel times for the locations
+
+        For 2D grids the grid is evaluated at the epicentral distance (as in ReadAbsInterpGrid2d in GridLib.c).
+        Locations outside the grid, or next to invalid nodes, are set to -VERY_LARGE_FLOAT.
+
+        Args
+            x: numpy array of x coordinates
+            y: numpy array of y coordinates
+            z: numpy array of z coordinates
+
+        Returns
+            numpy.array: float32 array of travel times
+        """
+        if self.is_2d:
+            distance=self.epicentral(x,y)[0]
+            return self.interpolate(0.0,distance,z)
+        return self.interpolate(x,y,z)
+class GridCache(object):
+    """Least recently used cache of grids loaded into memory, bounded by the total size of the grid buffers
+
+    Grids larger than the cache size are returned memory mapped and not cached. The cache can be shared between threads.
+
+    Keyword Args
+        max_bytes: int maximum total size of the cached grid buffers in bytes
+        endian: endian value for the grid buffer files (struct module format)
+        grid_class: class of grid to load (e.g. AngleGrid)
+    """
+    def __init__(self,max_bytes=1024**3,endian='=',grid_class=None):
+        self.max_bytes=max_bytes
+        self.endian=endian
+        self.grid_class=grid_class or AngleGrid
+        self.nbytes=0
+        self._grids=collections.OrderedDict()
+        self._lock=threading.Lock()
+    def __len__(self):
+        return len(self._grids)
+    def __contains__(self,grid_file):
+        return grid_file in self._grids
+    def get(self,grid_file):
+        """Gets a grid from the cache, loading it if it is not cached
+
+        Args
+            grid_file: str grid file root (without the .hdr or .buf extension)
+
+        Returns
+            Grid: grid object
+        """
+        with self._lock:
+            return self._get(grid_file)
+    def _get(self,grid_file):
+        if grid_file in self._grids:
+            grid=self._grids.pop(grid_file)
+            self._grids[grid_file]=grid
+            return grid
+        grid=self.grid_class(grid_file,self.endian)
+        if grid.nbytes>self.max_bytes:
+            return grid
+        grid.load()
+        #Evict least recently used grids
+        while len(self._grids) and self.nbytes+grid.nbytes>self.max_bytes:
+            evicted_file,evicted=self._grids.popitem(last=False)
+            self.nbytes-=evicted.nbytes
+        self._grids[grid_file]=grid
+        self.nbytes+=grid.nbytes
+        return grid
+    def clear(self):
+        """Removes all the grids from the cache"""
+        with self._lock:
+            self._grids.clear()
+            self.nbytes=0
@@ -20,6 +20,45 @@ where the grid files are in ~/mynlloc/time and begin with e.g. grid.***** for th
 
 There is an optional third line which sets the phase to use (i.e. P or S), where the default is P.
 
+The angles can also be calculated in-process using numpy (GridLib.py), without the C++ executable, by adding the -i or --in-process flag
+after the control file. The angle grids are memory mapped once for each station and the angles for all the samples are interpolated together,
+giving the same results as the C++ executable. The stations are found once for each run, and the angle grids are kept in an in-memory
+least recently used cache for all the scatter files, with the cache size in MB set by the -c N or --cache_size N flag (default 1024 MB).
+A Scat2AngleSession can also be used from within python to process any number of scatter files against the same stations.
+
+Multiple scatter files can be converted in parallel on a process pool by adding the -w N or --workers N flag, where N is the number of worker processes.
+The scatter samples can be resampled before the angles are calculated, so that only a representative set of samples is converted,
+using the -r METHOD or --resample METHOD flag, with the number of samples set by the -n N or --resample_samples N flag (default 10000)
+and the random seed by the --seed N flag. The methods are:
+
+    * systematic - systematic resampling weighted by the sample probabilities
+    * stratified - stratified resampling weighted by the sample probabilities
+    * decimate - uniform decimation, keeping every k-th sample (and its probability)
+    * ess - systematic resampling to the smaller of N and the effective sample size of the sample probabilities
+
+The sample probabilities are only used as weights if grid sampling is set (-g or the fourth control file line), as otherwise the samples
+are drawn directly from the location PDF and are equally weighted. After weighted resampling the samples are equally weighted, so the output
+probability of each sample is the total probability divided by the number of samples. Scatter files with fewer samples than N are not resampled.
+The resampling parameters are written to a JSON file next to the output file (e.g. event.scatangle.resample.json), and are also stored in the
+metadata of binary scatangle files written in-process.
+
+The samples in each scatter file can be converted on multiple threads in the C++ executable by adding the -t N or --threads N flag, where N is the number
+of threads (0 to use all the cores), so a single large scatter file can use a whole node. The angles are written in the same order as the samples.
+Files that fail to convert are reported, but do not stop the other files being converted, and the exit code is non-zero if any file failed.
+
+By default the angles are calculated for every station with an angle grid for the phase. With the -p or --picks flag, the stations for each
+event are restricted to those with picks for the phase, read from the PHASE section of the location hypocentre file next to the scatter file
+(e.g. event.grid0.loc.hyp for event.grid0.loc.scat). If there is no hypocentre file, the picks are read from the NLLOC_OBS observation file set by
+the --obs FILE flag (which implies -p), such as ./obs/obs.out. If the observation file has more than one event, the scatter file is matched to the event
+with the first pick closest after the origin date and time in the scatter file name (e.g. loc.20150101.120000.grid0.loc.scat). A phase pick matches
+if the pick phase starts with the phase (e.g. Pn and Pg for P). The output then only contains the picked stations, and events with no picked stations
+are skipped (reported, but not counted as failures). The location summary scatter file (e.g. loc.sum.grid0.loc.scat) has the samples for all the events,
+so the stations for it are those picked in any of the events in the summary hypocentre file (or the observation file).
+
+Scatter samples cluster tightly, so many samples fall in the same angle grid cell. With the -l or --cell_lookup flag, the samples are bucketed
+by grid cell for each station, and the eight cell corner values are read once per cell rather than once per sample, giving the same angles with
+far fewer grid reads (both in the C++ executable and in-process). The --tolerance T flag rounds the grid locations to multiples of T (km) first,
+so samples with the same rounded location reuse the angles outright (this is approximate, and implies the cell lookup).
 
 
 Command line flags
@@ -111,9 +150,76 @@ e.g.::
             .
             .
             .
+
+Binary output file
+*********************************
+
+If the -b or --binary flag is set, the angles are written to a binary scatangle file (.scatangle.bin) instead, which stores
+the station names once and the angles as 4 byte floats. This can be memory mapped using read_scatangle. The format is (in native byte order):
+
+    ======  ==========  ============================================================
+    Offset  Type        Description
+    ======  ==========  ============================================================
+    0       char[8]     Magic string SCATANGB
+    8       uint32      Format version (1) - also used to detect the byte order
+    12      uint32      Number of stations (S)
+    16      uint64      Number of samples (N)
+    24      uint32      Station name width in bytes (W)
+    28      uint32      Flags - bit 0 set if grid sampling (probabilities output)
+    32      uint32      Metadata length in bytes (M)
+    36      uint32      Data offset in bytes (multiple of 16)
+    40      char[24]    Reserved
+    64      char[S*W]   Station names, null padded
+    64+S*W  char[M]     JSON metadata (optional)
+    Data    float32     N records of: probability, S azimuths, S take-off angles
+    ======  ==========  ============================================================
+
+The text output remains the default.
+
+Summary output file
+*********************************
+
+If the -s or --summary flag is set, the angles are reduced to per station azimuth and take-off angle histograms and statistics as they are calculated,
+and written to a summary file (.scatangle.summary) instead of the samples, so the file size depends on the number of bins and stations rather than
+the number of samples. The histogram bin width in degrees is set by the --bin_width W flag (default 5). The samples are weighted by their probabilities
+if grid sampling is set, otherwise equally. The summary is a JSON file, which can be read using read_scatangle_summary, with the keys:
+
+    =============================  ========================================================================================
+    Key                            Description
+    =============================  ========================================================================================
+    version                        Summary format version (1)
+    nsamples                       Number of samples
+    grid_sampling                  Whether the samples are weighted by their probabilities
+    total_weight                   Sum of the sample weights
+    bin_width                      Histogram bin width (degrees)
+    azimuth_bins                   Number of azimuth bins from 0 to 360 degrees (A)
+    takeoff_bins                   Number of take-off angle bins from 0 to 180 degrees (T)
+    stations                       List of station summaries, with keys:
+      name                         Station name
+      azimuth_mean                 Weighted circular mean azimuth (degrees)
+      azimuth_resultant_length     Weighted mean resultant length of the azimuths (1 if all the azimuths are the same)
+      azimuth_circular_variance    1 - the mean resultant length
+      azimuth_circular_std         Circular standard deviation, sqrt(-2 ln(resultant length)) (radians)
+      takeoff_mean                 Weighted mean take-off angle (degrees)
+      takeoff_std                  Weighted standard deviation of the take-off angle (degrees)
+      histogram                    A x T nested list of the sample weights in each azimuth and take-off angle bin
+    =============================  ========================================================================================
+
+The statistics are null if there are no samples. Existing text or binary scatangle files can be summarised using summarise_scatangle.
+
+Existing text scatangle files can be read without loading the whole file into memory, either sample by sample using iter_scatangle, or in chunks of numpy
+arrays using iter_scatangle_chunks, and converted to the binary format in a single pass using convert_scatangle.
 """
 EXECUTABLE="GetNLLOCScatterAngles"#Default name for C++ executable compiled using make_angles.sh
-import glob,sys,os
+SCATANGLE_MAGIC=b'SCATANGB'#Binary scatangle file magic string
+SCATANGLE_VERSION=1#Binary scatangle file format version
+SCATANGLE_HEADER_FORMAT='8sIIQIIII24x'#Binary scatangle file header struct format
+DEFAULT_CACHE_SIZE=1024#Default in-process angle grid cache size in MB
+DEFAULT_RESAMPLE_SAMPLES=10000#Default number of samples to resample to
+RESAMPLE_METHODS=['systematic','stratified','decimate','ess']#Scatter sample resampling methods
+SUMMARY_VERSION=1#Summary file format version
+DEFAULT_BIN_WIDTH=5.0#Default summary histogram bin width in degrees
+import glob,sys,os,subprocess,multiprocessing,collections,struct,json,re,datetime
 def read_control():
     """Read control file from command line arguments.
 
@@ -158,12 +264,394 @@ def get_stations(grid_root,phase='P'):
 def get_scatter(scatter_root):
     """Gets input scatter files in the scatter file path
 
-    Only returns those files which do not have a scatangle file.
+    Only returns those files which do not have a scatangle (or binary or summary scatangle) file.
 
     Returns
         list: list of scatter files without a scatangle equivalent.
     """
-    return [u for u in glob.glob(scatter_root+'*.scat') if u+'angle' not in glob.glob(scatter_root+'*.scatangle')]    
+    converted=set(glob.glob(scatter_root+'*.scatangle'))
+    converted.update([u[:-len('.bin')] for u in glob.glob(scatter_root+'*.scatangle.bin')])
+    converted.update([u[:-len('.summary')] for u in glob.glob(scatter_root+'*.scatangle.summary')])
+    return [u for u in glob.glob(scatter_root+'*.scat') if u+'angle' not in converted]
+def scatter_dtypes(endian='='):
+    """Returns the numpy dtypes for the scatter file header and samples
+
+    The scatter file header is an integer number of samples followed by three unused 4 byte values (as read by readScatterFile in GetAngles.cpp),
+    and each sample is four 4 byte floats: x, y, z, p.
+
+    Keyword Args
+        endian: endian value for binary numbers (struct module format)
+
+    Returns
+        (numpy.dtype,numpy.dtype): tuple of header and sample dtypes
+    """
+    import numpy as np
+    try:
+        from .GridLib import _numpy_endian
+    except:
+        from GridLib import _numpy_endian
+    endian=_numpy_endian(endian)
+    header_dtype=np.dtype([('nsamples',endian+'i4'),('unused',endian+'f4',(3,))])
+    sample_dtype=np.dtype([('x',endian+'f4'),('y',endian+'f4'),('z',endian+'f4'),('p',endian+'f4')])
+    return header_dtype,sample_dtype
+def read_scatter(scatter_file,endian='='):
+    """Memory maps a NonLinLoc binary scatter file
+
+    The samples are not copied into memory, so slicing, filtering and resampling only reads the parts of the file that are used.
+    The byte order is handled by the dtype, so no byte-swapped copy is made for non-native files (numpy swaps values as they are used).
+
+    Args
+        scatter_file: str scatter file path
+
+    Keyword Args
+        endian: endian value for binary numbers (struct module format)
+
+    Returns
+        (numpy.memmap,numpy.record): tuple of the read-only structured sample array with x, y, z, p float32 fields and the header record
+
+    Raises
+        ValueError: if the number of samples in the header does not match the file size (e.g. the wrong endian value is used)
+    """
+    import numpy as np
+    header_dtype,sample_dtype=scatter_dtypes(endian)
+    header=np.fromfile(scatter_file,dtype=header_dtype,count=1)
+    if not len(header):
+        raise ValueError('Scatter file: "'+scatter_file+'" has no header')
+    header=header[0]
+    nsamples=int(header['nsamples'])
+    if nsamples<0 or header_dtype.itemsize+nsamples*sample_dtype.itemsize>os.path.getsize(scatter_file):
+        raise ValueError('Scatter file: "'+scatter_file+'" header has '+str(nsamples)+' samples, which does not match the file size - check the endian value')
+    if nsamples==0:
+        return np.zeros(0,dtype=sample_dtype),header
+    samples=np.memmap(scatter_file,dtype=sample_dtype,mode='r',offset=header_dtype.itemsize,shape=(nsamples,))
+    return samples,header
+def write_scatter(scatter_file,samples,header=None,endian='='):
+    """Writes a NonLinLoc binary scatter file
+
+    Args
+        scatter_file: str scatter file path
+        samples: numpy structured array of samples with x, y, z, p fields
+
+    Keyword Args
+        header: numpy record of the scatter file header (e.g. from read_scatter) for the unused header values
+        endian: endian value for binary numbers (struct module format)
+    """
+    import numpy as np
+    header_dtype,sample_dtype=scatter_dtypes(endian)
+    file_header=np.zeros(1,dtype=header_dtype)
+    if header is not None:
+        file_header['unused']=header['unused']
+    file_header['nsamples']=len(samples)
+    records=np.empty(len(samples),dtype=sample_dtype)
+    for field in ['x','y','z','p']:
+        records[field]=samples[field]
+    fid=open(scatter_file,'wb')
+    file_header.tofile(fid)
+    records.tofile(fid)
+    fid.close()
+def effective_sample_size(weights):
+    """Calculates the effective sample size of weighted samples ((sum of the weights)^2/sum of the squared weights)
+
+    Args
+        weights: numpy array of sample weights
+
+    Returns
+        float: effective sample size
+    """
+    import numpy as np
+    weights=np.asarray(weights,dtype=np.float64)
+    squared=np.sum(weights*weights)
+    if squared<=0:
+        return 0.0
+    return float(np.sum(weights)**2/squared)
+def resample_scatter(samples,method='systematic',nsamples=DEFAULT_RESAMPLE_SAMPLES,grid_sampling=False,seed=None):
+    """Resamples the scatter samples (see the module docstring for the methods)
+
+    The samples are only weighted by their probabilities if grid_sampling is set, otherwise they are equally weighted.
+    The samples are not resampled if there are no more than nsamples samples.
+
+    Args
+        samples: numpy structured array of samples with x, y, z, p fields (e.g. from read_scatter)
+
+    Keyword Args
+        method: str resampling method (systematic, stratified, decimate or ess)
+        nsamples: int number of samples to resample to (the maximum number of samples for the ess method)
+        grid_sampling: bool flag for grid sampling, where the sample probabilities are used as weights
+        seed: int random seed [default is to use a random seed, which is recorded in the parameters]
+
+    Returns
+        (numpy.array,dict): tuple of the resampled samples and the resampling parameters (method, nsamples, grid_sampling, seed,
+                                input_samples, output_samples and the effective sample size of the input samples)
+
+    Raises
+        ValueError: if the resampling method is not recognised
+    """
+    import numpy as np
+    if method not in RESAMPLE_METHODS:
+        raise ValueError('Resampling method: "'+str(method)+'" is not one of '+', '.join(RESAMPLE_METHODS))
+    if seed is None:
+        seed=int(np.random.randint(0,2**31-1))
+    weights=np.asarray(samples['p'],dtype=np.float64) if grid_sampling else np.ones(len(samples))
+    weights=np.where(np.isfinite(weights)&(weights>0),weights,0.0)
+    ess=effective_sample_size(weights)
+    parameters={'method':method,'nsamples':int(nsamples),'grid_sampling':bool(grid_sampling),'seed':seed,
+                'input_samples':len(samples),'effective_sample_size':ess}
+    if method=='ess':
+        nsamples=min(nsamples,max(1,int(np.ceil(ess))))
+    if len(samples)<=nsamples or weights.sum()<=0:
+        parameters['output_samples']=len(samples)
+        return samples,parameters
+    if method=='decimate':
+        resampled=samples[(np.arange(nsamples)*len(samples))//nsamples]
+    else:
+        state=np.random.RandomState(seed)
+        if method=='stratified':
+            positions=(np.arange(nsamples)+state.uniform(0.0,1.0,nsamples))/nsamples
+        else:
+            positions=(np.arange(nsamples)+state.uniform(0.0,1.0))/nsamples
+        cumulative=np.cumsum(weights)
+        indices=np.searchsorted(cumulative,positions*cumulative[-1],side='right')
+        resampled=samples[np.minimum(indices,len(samples)-1)]
+        resampled['p']=cumulative[-1]/nsamples
+    parameters['output_samples']=len(resampled)
+    return resampled,parameters
+def write_resample_parameters(filename,parameters=None):
+    """Writes the resampling parameters to a JSON file next to the output file (filename.resample.json)
+
+    Any existing parameters file is removed if there are no parameters (the output file was not resampled).
+
+    Args
+        filename: str output (scatangle) file path
+
+    Keyword Args
+        parameters: dict of resampling parameters (from resample_scatter)
+    """
+    if parameters:
+        fid=open(filename+'.resample.json','w')
+        json.dump(parameters,fid,indent=1,sort_keys=True)
+        fid.close()
+    elif os.path.exists(filename+'.resample.json'):
+        os.remove(filename+'.resample.json')
+def output_file(scatter_file,binary=False,summary=False):
+    """Gets the output file path for the scatter file
+
+    Args
+        scatter_file: str scatter file path
+
+    Keyword Args
+        binary: bool flag for a binary scatangle file
+        summary: float summary histogram bin width for a summary file (takes precedence over binary)
+
+    Returns
+        str: output file path
+    """
+    if summary:
+        return scatter_file+'angle.summary'
+    if binary:
+        return scatter_file+'angle.bin'
+    return scatter_file+'angle'
+def get_resampled_angles(station_file,scatter_file,grid_sampling,resample,binary=False,threads=1,endian='=',summary=False,lookup=None):
+    """Runs the C++ executable on a resampled copy of the scatter file, and moves the output next to the scatter file
+
+    The resampled scatter file is written to a temporary directory, which is removed afterwards.
+
+    Args
+        station_file: str station file path
+        scatter_file: str scatter file path
+        grid_sampling: bool flag to output the sample probabilities
+        resample: dict of resampling options (method, nsamples and seed) for resample_scatter
+
+    Keyword Args
+        binary: bool flag to write a binary scatangle file instead of the text file
+        threads: int number of threads for the C++ executable to convert the samples on (0 to use all the cores)
+        endian: endian value for binary numbers
+        summary: float summary histogram bin width (degrees) to write a summary file instead of the samples [default is to write the samples]
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
+
+    Returns
+        int: return code of the C++ executable
+    """
+    import tempfile,shutil
+    samples,header=read_scatter(scatter_file,endian)
+    samples,parameters=resample_scatter(samples,grid_sampling=grid_sampling,**resample)
+    tmp_path=tempfile.mkdtemp(prefix='resample',dir=os.path.split(os.path.abspath(scatter_file))[0])
+    try:
+        resampled_file=os.path.join(tmp_path,os.path.split(scatter_file)[1])
+        write_scatter(resampled_file,samples,header,endian)
+        ret=get_angles(station_file,resampled_file,grid_sampling,binary,threads,summary,lookup)
+        if not ret:
+            output=output_file(scatter_file,binary,summary)
+            shutil.move(output_file(resampled_file,binary,summary),output)
+            write_resample_parameters(output,parameters)
+    finally:
+        shutil.rmtree(tmp_path,ignore_errors=True)
+    return ret
+def _read_phase_line(line):
+    """Gets the station name and phase from a NLLOC_OBS or hypocentre file PHASE section line
+
+    Args
+        line: str phase line (station, instrument, component, onset, phase, ...)
+
+    Returns
+        (str,str): tuple of the station name and phase, or None if the line is not a phase line
+    """
+    values=line.split()
+    if len(values)<5 or values[0].startswith('#'):
+        return None
+    return values[0],values[4]
+def read_hyp_picks(hyp_file,all_events=False):
+    """Reads the phase picks from the PHASE section of a NonLinLoc hypocentre file
+
+    Args
+        hyp_file: str hypocentre (.hyp) file path
+
+    Keyword Args
+        all_events: bool flag to read the picks for all the events in the file (e.g. a summary hypocentre file) [default is to read the first event]
+
+    Returns
+        list: list of (station, phase) tuples
+    """
+    picks=[]
+    in_phase=False
+    for line in open(hyp_file):
+        if line.startswith('END_PHASE'):
+            if not all_events:
+                break
+            in_phase=False
+        elif in_phase:
+            pick=_read_phase_line(line)
+            if pick:
+                picks.append(pick)
+        elif line.startswith('PHASE '):
+            in_phase=True
+    return picks
+def _read_obs_events(obs_file):
+    """Reads the phase lines for each event in a NLLOC_OBS observation file (events are separated by blank lines)"""
+    events=[]
+    lines=[]
+    for line in open(obs_file):
+        if not line.strip():
+            if lines:
+                events.append(lines)
+            lines=[]
+        elif _read_phase_line(line):
+            lines.append(line)
+    if lines:
+        events.append(lines)
+    return events
+def read_obs_picks(obs_file):
+    """Reads the phase picks for each event in a NLLOC_OBS observation file (events are separated by blank lines)
+
+    Args
+        obs_file: str observation file path
+
+    Returns
+        list: list of lists of (station, phase) tuples for each event
+    """
+    return [[_read_phase_line(line) for line in lines] for lines in _read_obs_events(obs_file)]
+def _pick_time(line):
+    """Gets the pick time (datetime) from a NLLOC_OBS phase line (date, hour minute and seconds), or None if it cannot be read"""
+    values=line.split()
+    try:
+        return datetime.datetime.strptime(values[6]+values[7].zfill(4),'%Y%m%d%H%M')+datetime.timedelta(seconds=float(values[8]))
+    except (IndexError,ValueError):
+        return None
+def origin_time(scatter_file):
+    """Gets the origin date and time from a NLLoc event scatter file name (root.YYYYMMDD.HHMMSS.gridN.loc.scat)
+
+    Args
+        scatter_file: str scatter file path
+
+    Returns
+        datetime.datetime: origin time (to the second), or None if the file name does not contain it
+    """
+    match=re.search(r'\.(\d{8})\.(\d{6})\.grid\d+\.loc\.scat$',os.path.split(scatter_file)[1])
+    if not match:
+        return None
+    try:
+        return datetime.datetime.strptime(match.group(1)+match.group(2),'%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+_OBS_EVENTS={}#Observation file events cache (by file path) for matching scatter files
+def match_obs_event(scatter_file,obs_file):
+    """Gets the picks for the event in the observation file that the scatter file was located from
+
+    If the observation file has a single event, that event is used, otherwise the event with the first pick closest after the origin time
+    in the scatter file name (see origin_time) is used. The origin time is truncated to the second, so picks up to a second before it are allowed.
+
+    Args
+        scatter_file: str scatter file path
+        obs_file: str NLLOC_OBS observation file path
+
+    Returns
+        list: list of (station, phase) tuples
+
+    Raises
+        ValueError: if the scatter file cannot be matched to an event
+    """
+    if obs_file not in _OBS_EVENTS:
+        _OBS_EVENTS[obs_file]=[(min([time for time in [_pick_time(line) for line in lines] if time is not None] or [None]),
+                                [_read_phase_line(line) for line in lines]) for lines in _read_obs_events(obs_file)]
+    events=_OBS_EVENTS[obs_file]
+    if len(events)==1:
+        return events[0][1]
+    origin=origin_time(scatter_file)
+    if origin is None:
+        raise ValueError('Observation file: "'+obs_file+'" has '+str(len(events))+' events, and there is no origin time in the scatter file name to match: "'+scatter_file+'"')
+    matches=[(first_pick-origin,picks) for first_pick,picks in events if first_pick is not None and first_pick>=origin-datetime.timedelta(seconds=1)]
+    if not matches:
+        raise ValueError('No event in observation file: "'+obs_file+'" with picks after the origin time of: "'+scatter_file+'"')
+    return min(matches,key=lambda match:match[0])[1]
+def is_summary_file(scatter_file):
+    """Checks if the scatter file is a NLLoc location summary scatter file (root.sum.gridN.loc.scat), with the samples for all the events"""
+    return re.search(r'\.sum\.grid\d+\.loc\.scat$',os.path.split(scatter_file)[1]) is not None
+def picked_stations(scatter_file,phase='P',obs_file=False):
+    """Gets the stations with picks for the phase for the event (see the module docstring)
+
+    The picks are read from the hypocentre file next to the scatter file, or from the matching event in the observation file if there is
+    no hypocentre file (see match_obs_event). For a location summary scatter file (see is_summary_file), the picks for all the events in the
+    summary hypocentre file (or observation file) are used.
+
+    Args
+        scatter_file: str scatter file path
+
+    Keyword Args
+        phase: str phase to use (i.e. P or S)
+        obs_file: str NLLOC_OBS observation file path to use if there is no hypocentre file
+
+    Returns
+        list: list of station names with picks for the phase
+
+    Raises
+        ValueError: if there is no hypocentre file and no observation file, or the scatter file cannot be matched to an observation file event
+    """
+    hyp_file=os.path.splitext(scatter_file)[0]+'.hyp'
+    summary=is_summary_file(scatter_file)
+    if os.path.exists(hyp_file):
+        picks=read_hyp_picks(hyp_file,summary)
+    elif obs_file and summary:
+        picks=[pick for event_picks in read_obs_picks(obs_file) for pick in event_picks]
+    elif obs_file:
+        picks=match_obs_event(scatter_file,obs_file)
+    else:
+        raise ValueError('No hypocentre file: "'+hyp_file+'" to read the picks from')
+    stations=[]
+    for station,pick_phase in picks:
+        if pick_phase.upper().startswith(phase.upper()) and station not in stations:
+            stations.append(station)
+    return stations
+def filter_stations(stations,names):
+    """Restricts the station list from get_stations to the station names
+
+    Args
+        stations: list of stations and angle file pairs (as returned by get_stations)
+        names: list of station names to keep
+
+    Returns
+        list: list of stations and angle file pairs for the station names
+    """
+    names=set(names)
+    return [station for station,name in zip(stations,parse_stations(stations)[0]) if name in names]
 def write_stations(stations,grid_root):
     """Writes station gile into grid file path as stations.txt file.
 
@@ -172,13 +660,687 @@ def write_stations(stations,grid_root):
     """
     open(os.path.split(grid_root)[0]+'/stations.txt','w').write(''.join(stations))
     return os.path.split(grid_root)[0]+'/stations.txt'    
-def get_angles(station_file,scatter_file,grid_sampling):
-    """Runs the C++ executable using an os.system call for the input station_file, scatter_file and grid_sampling values
+def get_angles(station_file,scatter_file,grid_sampling,binary=False,threads=1,summary=False,lookup=None):
+    """Runs the C++ executable using a subprocess call for the input station_file, scatter_file and grid_sampling values
+
+    Keyword Args
+        binary: bool flag to write a binary scatangle file instead of the text file
+        threads: int number of threads for the C++ executable to convert the samples on (0 to use all the cores)
+        summary: float summary histogram bin width (degrees) to write a summary file instead of the samples [default is to write the samples]
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
 
     Returns
-        int: output of the os.system call
+        int: return code of the C++ executable
     """
-    return os.system(EXECUTABLE+scatter_file+' '+station_file+' '+str(int(grid_sampling)))
+    args=[EXECUTABLE,scatter_file,station_file,str(int(grid_sampling))]
+    if summary:
+        args.extend(['summary','--bin_width',repr(float(summary))])
+    elif binary:
+        args.append('binary')
+    if threads!=1:
+        args.extend(['--threads',str(threads)])
+    if lookup is not None:
+        args.append('--cell_lookup')
+        if lookup>0:
+            args.extend(['--tolerance',repr(float(lookup))])
+    return subprocess.call(args)
+def parse_stations(stations):
+    """Parses the station list from get_stations into station names and angle file roots
+
+    Args
+        stations: list of stations and angle file pairs, separated by a ":" and ended by a ";" (as returned by get_stations)
+
+    Returns
+        (list,list): tuple of lists of station names and angle file roots
+    """
+    names=[]
+    angle_files=[]
+    for station in stations:
+        name,angle_file=station.rstrip().rstrip(';').split(':',1)
+        names.append(name)
+        angle_files.append(angle_file)
+    return names,angle_files
+def scatter_angles(samples,angle_files,endian='=',cache=None,lookup=None):
+    """Calculates the take-off angles for the scatter samples in-process using the GridLib angle grids
+
+    Each angle grid is memory mapped once, and the angles for all the samples are interpolated in a single operation per station.
+
+    Args
+        samples: numpy structured array of samples with x, y, z fields (e.g. from read_scatter)
+        angle_files: list of angle file roots (e.g. from parse_stations)
+
+    Keyword Args
+        endian: endian value for the grid buffer files (struct module format)
+        cache: GridLib.GridCache to get the angle grids from, otherwise the grids are memory mapped for each call
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
+
+    Returns
+        (numpy.array,numpy.array): tuple of azimuth and take-off angle arrays (samples x stations)
+    """
+    import numpy as np
+    try:
+        from .GridLib import AngleGrid
+    except:
+        from GridLib import AngleGrid
+    x=np.asarray(samples['x'],dtype=np.float64)
+    y=np.asarray(samples['y'],dtype=np.float64)
+    z=np.asarray(samples['z'],dtype=np.float64)
+    azimuth=np.empty((len(x),len(angle_files)))
+    takeoff=np.empty((len(x),len(angle_files)))
+    for i,angle_file in enumerate(angle_files):
+        grid=cache.get(angle_file) if cache is not None else AngleGrid(angle_file,endian)
+        azimuth[:,i],takeoff[:,i],quality=grid.angles(x,y,z,lookup is not None,lookup or 0.0)
+    return azimuth,takeoff
+def write_scatangle(filename,probability,names,azimuth,takeoff,grid_sampling=False,chunk_size=10000):
+    """Writes the take-off angle samples to a scatangle file (in the same format as saveAngles in GetAngles.cpp)
+
+    Args
+        filename: str output file name
+        probability: numpy array of sample probabilities
+        names: list of station names
+        azimuth: numpy array of azimuths (samples x stations)
+        takeoff: numpy array of take-off angles (samples x stations)
+
+    Keyword Args
+        grid_sampling: bool flag to output the sample probabilities, otherwise 1 is output for each sample
+        chunk_size: int number of samples to format at once
+    """
+    fid=open(filename,'w')
+    for start in range(0,len(azimuth),chunk_size):
+        lines=[]
+        for i in range(start,min(start+chunk_size,len(azimuth))):
+            if grid_sampling:
+                lines.append('%g\n'%probability[i])
+            else:
+                lines.append('1\n')
+            lines.extend([name+'\t%g\t%g\n'%(az,to) for name,az,to in zip(names,azimuth[i],takeoff[i])])
+            lines.append('\n')
+        fid.write(''.join(lines))
+    fid.close()
+def _scatangle_binary_header(names,nsamples,grid_sampling=False,metadata=None):
+    """Makes the binary scatangle file header, including the station names, metadata and padding to the sample records
+
+    Args
+        names: list of station names
+        nsamples: int number of samples
+
+    Keyword Args
+        grid_sampling: bool flag for whether the sample probabilities are output
+        metadata: dict of metadata to store in the file header
+
+    Returns
+        bytes: header bytes
+    """
+    encoded_names=[name.encode('ascii') for name in names]
+    name_width=max([1]+[len(name) for name in encoded_names])
+    metadata=json.dumps(metadata).encode('utf-8') if metadata else b''
+    header_size=struct.calcsize('='+SCATANGLE_HEADER_FORMAT)
+    data_offset=16*((header_size+len(names)*name_width+len(metadata)+15)//16)
+    header=struct.pack('='+SCATANGLE_HEADER_FORMAT,SCATANGLE_MAGIC,SCATANGLE_VERSION,len(names),nsamples,name_width,int(bool(grid_sampling)),len(metadata),data_offset)
+    header+=b''.join([name.ljust(name_width,b'\0') for name in encoded_names])+metadata
+    return header+b'\0'*(data_offset-len(header))
+def write_scatangle_binary(filename,probability,names,azimuth,takeoff,grid_sampling=False,metadata=None):
+    """Writes the take-off angle samples to a binary scatangle file (see the module docstring for the format)
+
+    Args
+        filename: str output file name
+        probability: numpy array of sample probabilities
+        names: list of station names
+        azimuth: numpy array of azimuths (samples x stations)
+        takeoff: numpy array of take-off angles (samples x stations)
+
+    Keyword Args
+        grid_sampling: bool flag to output the sample probabilities, otherwise 1 is output for each sample
+        metadata: dict of metadata to store in the file header
+    """
+    import numpy as np
+    records=np.empty((len(azimuth),1+2*len(names)),dtype='=f4')
+    records[:,0]=probability if grid_sampling else 1
+    records[:,1:1+len(names)]=azimuth
+    records[:,1+len(names):]=takeoff
+    fid=open(filename,'wb')
+    fid.write(_scatangle_binary_header(names,len(azimuth),grid_sampling,metadata))
+    records.tofile(fid)
+    fid.close()
+class AngleSummary(object):
+    """Streaming per station azimuth and take-off angle histograms and statistics (see the module docstring for the summary format)
+
+    The angles are added in chunks using update, and only the histograms and sums are kept, so the memory use does not depend on the number of samples.
+
+    Args
+        names: list of station names
+
+    Keyword Args
+        bin_width: float histogram bin width (degrees)
+        grid_sampling: bool flag to weight the samples by their probabilities, otherwise they are equally weighted
+    """
+    def __init__(self,names,bin_width=DEFAULT_BIN_WIDTH,grid_sampling=False):
+        import numpy as np
+        if not bin_width>0:
+            raise ValueError('Summary bin width must be positive')
+        self.names=list(names)
+        self.bin_width=float(bin_width)
+        self.grid_sampling=bool(grid_sampling)
+        self.azimuth_bins=int(np.ceil(360.0/self.bin_width))
+        self.takeoff_bins=int(np.ceil(180.0/self.bin_width))
+        self.nsamples=0
+        self.total_weight=0.0
+        self.histogram=np.zeros((len(self.names),self.azimuth_bins,self.takeoff_bins))
+        self.sum_cos=np.zeros(len(self.names))
+        self.sum_sin=np.zeros(len(self.names))
+        self.sum_takeoff=np.zeros(len(self.names))
+        self.sum_takeoff2=np.zeros(len(self.names))
+    def _bins(self,angles,nbins):
+        """Gets the bin indices for the angles, with angles outside the range put in the end bins"""
+        import numpy as np
+        return np.clip(np.floor(angles/self.bin_width),0,nbins-1).astype(np.int64)
+    def update(self,probability,azimuth,takeoff):
+        """Adds the angles for a chunk of samples to the summary
+
+        Args
+            probability: numpy array of sample probabilities
+            azimuth: numpy array of azimuths (samples x stations)
+            takeoff: numpy array of take-off angles (samples x stations)
+        """
+        import numpy as np
+        azimuth=np.asarray(azimuth,dtype=np.float64)
+        takeoff=np.asarray(takeoff,dtype=np.float64)
+        if not len(azimuth):
+            return
+        weights=np.asarray(probability,dtype=np.float64) if self.grid_sampling else np.ones(len(azimuth))
+        index=(np.arange(len(self.names))*self.azimuth_bins+self._bins(azimuth,self.azimuth_bins))*self.takeoff_bins+self._bins(takeoff,self.takeoff_bins)
+        self.histogram+=np.bincount(index.ravel(),np.repeat(weights,len(self.names)),self.histogram.size).reshape(self.histogram.shape)
+        radians=np.radians(azimuth)
+        self.sum_cos+=np.dot(weights,np.cos(radians))
+        self.sum_sin+=np.dot(weights,np.sin(radians))
+        self.sum_takeoff+=np.dot(weights,takeoff)
+        self.sum_takeoff2+=np.dot(weights,takeoff*takeoff)
+        self.total_weight+=float(weights.sum())
+        self.nsamples+=len(azimuth)
+    def to_dict(self):
+        """Gets the summary as a dictionary (in the summary file format)
+
+        Returns
+            dict: summary dictionary
+        """
+        import numpy as np
+        stations=[]
+        for i,name in enumerate(self.names):
+            station={'name':name,'azimuth_mean':None,'azimuth_resultant_length':None,'azimuth_circular_variance':None,
+                     'azimuth_circular_std':None,'takeoff_mean':None,'takeoff_std':None}
+            if self.total_weight>0:
+                resultant=float(np.hypot(self.sum_cos[i],self.sum_sin[i])/self.total_weight)
+                takeoff=float(self.sum_takeoff[i]/self.total_weight)
+                station.update({'azimuth_mean':float(np.mod(np.degrees(np.arctan2(self.sum_sin[i],self.sum_cos[i])),360.0)),
+                                'azimuth_resultant_length':resultant,'azimuth_circular_variance':1.0-resultant,
+                                'azimuth_circular_std':float(np.sqrt(max(0.0,-2.0*np.log(resultant)))) if resultant>0 else None,
+                                'takeoff_mean':takeoff,'takeoff_std':float(np.sqrt(max(0.0,self.sum_takeoff2[i]/self.total_weight-takeoff*takeoff)))})
+            station['histogram']=self.histogram[i].tolist()
+            stations.append(station)
+        return {'version':SUMMARY_VERSION,'nsamples':self.nsamples,'grid_sampling':self.grid_sampling,'total_weight':self.total_weight,
+                'bin_width':self.bin_width,'azimuth_bins':self.azimuth_bins,'takeoff_bins':self.takeoff_bins,'stations':stations}
+    def write(self,filename,metadata=None):
+        """Writes the summary file
+
+        Args
+            filename: str summary file path
+
+        Keyword Args
+            metadata: dict of extra values to add to the summary (e.g. the resampling parameters)
+        """
+        summary=self.to_dict()
+        summary.update(metadata or {})
+        fid=open(filename,'w')
+        json.dump(summary,fid)
+        fid.close()
+def read_scatangle_summary(filename):
+    """Reads a summary file
+
+    Args
+        filename: str summary file path
+
+    Returns
+        dict: summary dictionary (see the module docstring for the keys), with the station histograms as numpy arrays (azimuth bins x take-off bins)
+
+    Raises
+        ValueError: if the summary version is not supported
+    """
+    import numpy as np
+    summary=json.load(open(filename))
+    if summary.get('version')!=SUMMARY_VERSION:
+        raise ValueError('File: "'+filename+'" summary version is not supported')
+    for station in summary['stations']:
+        station['histogram']=np.array(station['histogram'],dtype=np.float64).reshape(summary['azimuth_bins'],summary['takeoff_bins'])
+    return summary
+def summarise_scatangle(filename,summary_file=False,bin_width=DEFAULT_BIN_WIDTH,chunk_size=10000):
+    """Summarises an existing text or binary scatangle file in a single streaming pass
+
+    The samples are weighted by their probabilities for binary files with the grid sampling flag set, and for text files if any of the probabilities are not 1.
+
+    Args
+        filename: str text or binary scatangle file path
+
+    Keyword Args
+        summary_file: str summary file path [default is filename with the .bin extension replaced by .summary]
+        bin_width: float histogram bin width (degrees)
+        chunk_size: int number of samples to summarise at once
+
+    Returns
+        str: summary file path
+    """
+    summary_file=summary_file or (filename[:-len('.bin')] if filename.endswith('.bin') else filename)+'.summary'
+    fid=open(filename,'rb')
+    magic=fid.read(len(SCATANGLE_MAGIC))
+    fid.close()
+    if magic==SCATANGLE_MAGIC:
+        probability,names,azimuth,takeoff,header=read_scatangle(filename)
+        summary=AngleSummary(names,bin_width,header['grid_sampling'])
+        for start in range(0,len(probability),chunk_size):
+            summary.update(probability[start:start+chunk_size],azimuth[start:start+chunk_size],takeoff[start:start+chunk_size])
+    else:
+        import numpy as np
+        summary=None
+        grid_sampling=False
+        for probability,names,azimuth,takeoff in iter_scatangle_chunks(filename,chunk_size):
+            if summary is None:
+                #Weighting by the probabilities is the same as equal weighting if they are all 1, so the flag is set after reading
+                summary=AngleSummary(names,bin_width,True)
+            grid_sampling=grid_sampling or bool(np.any(probability!=1))
+            summary.update(probability,azimuth,takeoff)
+        summary=summary or AngleSummary([],bin_width)
+        summary.grid_sampling=grid_sampling
+    summary.write(summary_file)
+    return summary_file
+def iter_scatangle(filename):
+    """Iterates over the samples in a text scatangle file without reading the whole file into memory
+
+    Args
+        filename: str scatangle file path
+
+    Returns
+        generator: generator of (probability, OrderedDict) tuples for each sample, where the OrderedDict maps the station names
+                    to (azimuth, take-off angle) tuples in file order.
+    """
+    probability=None
+    angles=collections.OrderedDict()
+    fid=open(filename)
+    try:
+        for line in fid:
+            values=line.split()
+            if not len(values):
+                if probability is not None:
+                    yield probability,angles
+                probability=None
+                angles=collections.OrderedDict()
+            elif probability is None:
+                probability=float(values[0])
+            else:
+                angles[values[0]]=(float(values[1]),float(values[2]))
+        if probability is not None:
+            yield probability,angles
+    finally:
+        fid.close()
+def iter_scatangle_chunks(filename,chunk_size=10000):
+    """Iterates over a text scatangle file in fixed size chunks of samples as numpy arrays
+
+    Only one chunk is held in memory at a time.
+
+    Args
+        filename: str scatangle file path
+
+    Keyword Args
+        chunk_size: int number of samples in each chunk
+
+    Returns
+        generator: generator of (probability, station names, azimuth, take-off angle) tuples for each chunk, where
+                    the azimuth and take-off angle arrays are samples x stations.
+
+    Raises
+        ValueError: if the stations are not the same for every sample
+    """
+    import numpy as np
+    names=None
+    probability=[]
+    azimuth=[]
+    takeoff=[]
+    for sample_probability,angles in iter_scatangle(filename):
+        if names is None:
+            names=list(angles.keys())
+        elif list(angles.keys())!=names:
+            raise ValueError('Scatangle file: "'+filename+'" stations are not the same for every sample')
+        probability.append(sample_probability)
+        values=list(angles.values())
+        azimuth.append([value[0] for value in values])
+        takeoff.append([value[1] for value in values])
+        if len(probability)>=chunk_size:
+            yield np.array(probability),names,np.array(azimuth),np.array(takeoff)
+            probability=[]
+            azimuth=[]
+            takeoff=[]
+    if len(probability):
+        yield np.array(probability),names,np.array(azimuth),np.array(takeoff)
+def convert_scatangle(filename,binary_file=False,chunk_size=10000):
+    """Converts a text scatangle file to a binary scatangle file in a single streaming pass
+
+    The grid_sampling flag is set in the binary file if any of the probabilities are not 1.
+
+    Args
+        filename: str text scatangle file path
+
+    Keyword Args
+        binary_file: str binary scatangle file path [default is filename+'.bin']
+        chunk_size: int number of samples to convert at once
+
+    Returns
+        str: binary scatangle file path
+    """
+    import numpy as np
+    binary_file=binary_file or filename+'.bin'
+    names=[]
+    nsamples=0
+    grid_sampling=False
+    fid=open(binary_file,'wb')
+    try:
+        for probability,names,azimuth,takeoff in iter_scatangle_chunks(filename,chunk_size):
+            if nsamples==0:
+                #Header is rewritten with the number of samples once the file has been read
+                fid.write(_scatangle_binary_header(names,0))
+            grid_sampling=grid_sampling or bool(np.any(probability!=1))
+            np.hstack((probability[:,np.newaxis],azimuth,takeoff)).astype('=f4').tofile(fid)
+            nsamples+=len(probability)
+        fid.seek(0)
+        fid.write(_scatangle_binary_header(names,nsamples,grid_sampling))
+    finally:
+        fid.close()
+    return binary_file
+def read_scatangle_header(filename):
+    """Reads the header of a binary scatangle file
+
+    Args
+        filename: str binary scatangle file path
+
+    Returns
+        dict: dictionary of the header values, station names, metadata and the byte order ('<' or '>')
+
+    Raises
+        ValueError: if the file is not a binary scatangle file or the version is not supported
+    """
+    fid=open(filename,'rb')
+    header_size=struct.calcsize('<'+SCATANGLE_HEADER_FORMAT)
+    data=fid.read(header_size)
+    if len(data)<header_size or data[:8]!=SCATANGLE_MAGIC:
+        fid.close()
+        raise ValueError('File: "'+filename+'" is not a binary scatangle file')
+    for endian in ['<','>']:
+        values=struct.unpack(endian+SCATANGLE_HEADER_FORMAT,data)
+        if values[1]==SCATANGLE_VERSION:
+            break
+    else:
+        fid.close()
+        raise ValueError('File: "'+filename+'" binary scatangle version is not supported')
+    magic,version,nstations,nsamples,name_width,flags,metadata_length,data_offset=values
+    names=fid.read(nstations*name_width)
+    metadata=fid.read(metadata_length)
+    fid.close()
+    return {'endian':endian,'version':version,'nstations':nstations,'nsamples':nsamples,'name_width':name_width,
+            'grid_sampling':bool(flags&1),'data_offset':data_offset,
+            'stations':[names[i*name_width:(i+1)*name_width].rstrip(b'\0').decode('ascii') for i in range(nstations)],
+            'metadata':json.loads(metadata.decode('utf-8')) if metadata_length else {}}
+def read_scatangle(filename):
+    """Memory maps a binary scatangle file
+
+    The sample records are not copied into memory, and the probability, azimuth and take-off angle arrays are views onto the memory mapped records.
+
+    Args
+        filename: str binary scatangle file path
+
+    Returns
+        (numpy.array,list,numpy.array,numpy.array,dict): tuple of the probabilities, station names, azimuths (samples x stations),
+                                                          take-off angles (samples x stations) and the header (see read_scatangle_header)
+    """
+    import numpy as np
+    header=read_scatangle_header(filename)
+    nstations=header['nstations']
+    if header['nsamples']==0:
+        records=np.zeros((0,1+2*nstations),dtype=header['endian']+'f4')
+    else:
+        records=np.memmap(filename,dtype=header['endian']+'f4',mode='r',offset=header['data_offset'],shape=(header['nsamples'],1+2*nstations))
+    return records[:,0],header['stations'],records[:,1:1+nstations],records[:,1+nstations:],header
+class Scat2AngleSession(object):
+    """In-process conversion of any number of scatter files for a set of stations
+
+    The stations are found and parsed once, and the angle grids are kept in a least recently used in-memory cache
+    (bounded by cache_size), so the start up cost is paid once per network rather than once per scatter file.
+
+    Keyword Args
+        grid_root: str grid file path (as in the control file)
+        phase: str phase to use (i.e. P or S)
+        stations: list of stations and angle file pairs (as returned by get_stations) [default is to use get_stations]
+        cache_size: float maximum size of the angle grid cache in MB
+        endian: endian value for binary numbers
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
+    """
+    def __init__(self,grid_root='',phase='P',stations=None,cache_size=DEFAULT_CACHE_SIZE,endian='=',lookup=None):
+        try:
+            from .GridLib import GridCache
+        except:
+            from GridLib import GridCache
+        if stations is None:
+            stations=get_stations(grid_root,phase)
+        self.stations=stations
+        self.names,self.angle_files=parse_stations(stations)
+        self.endian=endian
+        self.lookup=lookup
+        self.cache=GridCache(int(cache_size*1024**2),endian)
+    def angles(self,samples,names=None):
+        """Calculates the take-off angles for the samples
+
+        Args
+            samples: numpy structured array of samples with x, y, z fields (e.g. from read_scatter)
+
+        Keyword Args
+            names: list of the session station names to calculate the angles for [default is all the stations]
+
+        Returns
+            (numpy.array,numpy.array): tuple of azimuth and take-off angle arrays (samples x stations)
+        """
+        angle_files=self.angle_files
+        if names is not None:
+            angle_files=[self.angle_files[self.names.index(name)] for name in names]
+        return scatter_angles(samples,angle_files,self.endian,self.cache,self.lookup)
+    def process(self,scatter_file,grid_sampling=False,binary=False,resample=None,summary=False,chunk_size=100000,stations=None):
+        """Calculates the take-off angles for the scatter file and writes the scatangle file
+
+        Args
+            scatter_file: str scatter file path
+
+        Keyword Args
+            grid_sampling: bool flag to output the sample probabilities
+            binary: bool flag to write a binary scatangle file instead of the text file
+            resample: dict of resampling options (method, nsamples and seed) for resample_scatter [default is not to resample]
+            summary: float summary histogram bin width (degrees) to write a summary file instead of the samples [default is to write the samples]
+            chunk_size: int number of samples to calculate the angles for at once when writing a summary file
+            stations: list of station names to restrict the output to (e.g. from picked_stations) [default is all the stations]
+
+        Returns
+            str: scatangle file path
+        """
+        names=self.names
+        if stations is not None:
+            stations=set(stations)
+            names=[name for name in self.names if name in stations]
+        samples,header=read_scatter(scatter_file,self.endian)
+        parameters=None
+        if resample:
+            samples,parameters=resample_scatter(samples,grid_sampling=grid_sampling,**resample)
+        if summary:
+            output=output_file(scatter_file,summary=summary)
+            angle_summary=AngleSummary(names,summary,grid_sampling)
+            for start in range(0,len(samples),chunk_size):
+                chunk=samples[start:start+chunk_size]
+                azimuth,takeoff=self.angles(chunk,names)
+                angle_summary.update(chunk['p'],azimuth,takeoff)
+            angle_summary.write(output,{'resample':parameters} if parameters else None)
+            write_resample_parameters(output,parameters)
+            return output
+        azimuth,takeoff=self.angles(samples,names)
+        if binary:
+            output=scatter_file+'angle.bin'
+            write_scatangle_binary(output,samples['p'],names,azimuth,takeoff,grid_sampling,{'resample':parameters} if parameters else None)
+        else:
+            output=scatter_file+'angle'
+            write_scatangle(output,samples['p'],names,azimuth,takeoff,grid_sampling)
+        write_resample_parameters(output,parameters)
+        return output
+_SESSIONS={}#Sessions for each set of stations in this process
+def get_session(stations,cache_size=DEFAULT_CACHE_SIZE,endian='=',lookup=None):
+    """Gets the Scat2AngleSession for the stations, creating it the first time it is used in this process
+
+    Args
+        stations: list of stations and angle file pairs (as returned by get_stations)
+
+    Keyword Args
+        cache_size: float maximum size of the angle grid cache in MB
+        endian: endian value for binary numbers
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
+
+    Returns
+        Scat2AngleSession: session for the stations
+    """
+    key=(tuple(stations),cache_size,endian,lookup)
+    if key not in _SESSIONS:
+        _SESSIONS[key]=Scat2AngleSession(stations=stations,cache_size=cache_size,endian=endian,lookup=lookup)
+    return _SESSIONS[key]
+def get_angles_in_process(stations,scatter_file,grid_sampling,endian='=',binary=False,resample=None,summary=False,lookup=None):
+    """Calculates the take-off angles for the scatter_file in-process and writes the scatangle file, without running the C++ executable
+
+    Args
+        stations: list of stations and angle file pairs (as returned by get_stations)
+        scatter_file: str scatter file path
+        grid_sampling: bool flag to output the sample probabilities
+
+    Keyword Args
+        endian: endian value for binary numbers
+        binary: bool flag to write a binary scatangle file instead of the text file
+        resample: dict of resampling options (method, nsamples and seed) for resample_scatter [default is not to resample]
+        summary: float summary histogram bin width (degrees) to write a summary file instead of the samples [default is to write the samples]
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
+
+    Returns
+        str: scatangle file path
+    """
+    return Scat2AngleSession(stations=stations,endian=endian,lookup=lookup).process(scatter_file,grid_sampling,binary,resample,summary)
+def _convert_scatter_file(args):
+    """Converts a single scatter file to angles, catching any errors so that a failure does not stop a batch
+
+    Args
+        args: tuple of stations, station file, scatter file, grid_sampling flag, in_process flag, binary flag, cache size (MB), number of threads,
+                resampling options, summary bin width, cell lookup tolerance and pick options
+
+    Returns
+        (str,int,str): tuple of the scatter file, return code and error message (or the reason it was skipped if the return code is 0)
+    """
+    stations,station_file,scatter_file,grid_sampling,in_process,binary,cache_size,threads,resample,summary,lookup,picks=args
+    event_station_file=False
+    try:
+        names=None
+        if picks:
+            names=picked_stations(scatter_file,**picks)
+            if not filter_stations(stations,names):
+                return scatter_file,0,'Skipped, no stations with '+picks.get('phase','P')+' picks and angle grids'
+        if in_process:
+            get_session(stations,cache_size,lookup=lookup).process(scatter_file,grid_sampling,binary,resample,summary,stations=names)
+            return scatter_file,0,''
+        if names is not None:
+            #Station file for the event next to the scatter file
+            event_station_file=scatter_file+'.stations'
+            open(event_station_file,'w').write(''.join(filter_stations(stations,names)))
+            station_file=event_station_file
+        if resample:
+            ret=get_resampled_angles(station_file,scatter_file,grid_sampling,resample,binary,threads,summary=summary,lookup=lookup)
+        else:
+            ret=get_angles(station_file,scatter_file,grid_sampling,binary,threads,summary,lookup)
+        if ret:
+            return scatter_file,ret,EXECUTABLE+' exited with return code '+str(ret)
+        return scatter_file,0,''
+    except Exception as e:
+        return scatter_file,1,e.__class__.__name__+': '+str(e)
+    finally:
+        if event_station_file and os.path.exists(event_station_file):
+            os.remove(event_station_file)
+def run_scatter_files(stations,station_file,scatter_files,grid_sampling,in_process=False,workers=1,queue_size=False,binary=False,cache_size=DEFAULT_CACHE_SIZE,threads=1,resample=None,summary=False,lookup=None,picks=None):
+    """Converts the scatter files to angles, optionally in parallel using a process pool
+
+    At most queue_size files are queued on the pool at once, so that very long lists of scatter files are not all submitted up front.
+    Failures are reported as they occur, and do not stop the remaining files being converted.
+
+    Args
+        stations: list of stations and angle file pairs (as returned by get_stations)
+        station_file: str station file path (as returned by write_stations)
+        scatter_files: list of scatter file paths
+        grid_sampling: bool flag to output the sample probabilities
+
+    Keyword Args
+        in_process: bool flag to calculate the angles in-process rather than using the C++ executable
+        workers: int number of worker processes
+        queue_size: int maximum number of files queued on the pool [default is 2*workers]
+        binary: bool flag to write binary scatangle files instead of text files
+        cache_size: float maximum size of the in-process angle grid cache in MB (for each worker process)
+        threads: int number of threads for the C++ executable to convert the samples on (0 to use all the cores)
+        resample: dict of resampling options (method, nsamples and seed) for resample_scatter [default is not to resample]
+        summary: float summary histogram bin width (degrees) to write summary files instead of the samples [default is to write the samples]
+        lookup: float location rounding tolerance (km) to use the grid cell lookup with (0 for exact results) [default is to look up each sample]
+        picks: dict of pick options (phase and obs_file) for picked_stations to restrict each event to the stations with picks [default is to use all the stations]
+
+    Returns
+        list: list of (scatter file, return code, error message) tuples in the order of scatter_files (with the reason in the message for skipped files)
+    """
+    jobs=((stations,station_file,scatter_file,grid_sampling,in_process,binary,cache_size,threads,resample,summary,lookup,picks) for scatter_file in scatter_files)
+    results=[]
+    def report(result):
+        if result[1]:
+            print ('Failed to convert '+result[0]+': '+result[2])
+        elif result[2]:
+            print (result[0]+': '+result[2])
+        results.append(result)
+    if workers<=1:
+        for job in jobs:
+            report(_convert_scatter_file(job))
+        return results
+    queue_size=queue_size or 2*workers
+    pool=multiprocessing.Pool(workers)
+    pending=collections.deque()
+    try:
+        for job in jobs:
+            if len(pending)>=queue_size:
+                report(pending.popleft().get())
+            pending.append(pool.apply_async(_convert_scatter_file,(job,)))
+        while len(pending):
+            report(pending.popleft().get())
+    finally:
+        pool.close()
+        pool.join()
+    return results
+def get_flag_value(flags,default=None,type=str):
+    """Gets the value following a command line flag
+
+    Args
+        flags: list of flag names e.g. ['-w','--workers']
+
+    Keyword Args
+        default: default value if the flag is not set
+        type: type to convert the value to
+
+    Returns
+        value of the flag
+    """
+    for i,arg in enumerate(sys.argv):
+        if arg in flags and i+1<len(sys.argv):
+            return type(sys.argv[i+1])
+        for flag in flags:
+            if flag.startswith('--') and arg.startswith(flag+'='):
+                return type(arg.split('=',1)[1])
+    return default
 def print_help():
     """Prints command line help message.
     """
@@ -188,11 +1350,14 @@ def __run__():
 
     Uses command line arguments to obtain files and runs the C++ executable for each scatter file.
     For a list of the command line options, use the '-h' flag.
+
+    Returns
+        int: 0 if all the scatter files were converted, otherwise 1
     """
-    if len(sys.argv)!=2:
+    if len(sys.argv)<2:
         print ('Requires a control file.')
         print ('For help use -h flag.')
-        return
+        return 1
     if '-h' in sys.argv or '--help' in sys.argv:
         print_help()
         return
@@ -201,7 +1366,37 @@ def __run__():
         stations=get_stations(grid_root,phase)
         station_file=write_stations(stations,grid_root)
         scatter_files=get_scatter(scatter_root)
-        for scatter_file in scatter_files:
-            get_angles(station_file,scatter_file,grid_sampling)        
+        in_process='--in-process' in sys.argv or '-i' in sys.argv
+        workers=get_flag_value(['-w','--workers'],1,int)
+        binary='--binary' in sys.argv or '-b' in sys.argv
+        cache_size=get_flag_value(['-c','--cache_size'],DEFAULT_CACHE_SIZE,float)
+        threads=get_flag_value(['-t','--threads'],1,int)
+        resample=None
+        method=get_flag_value(['-r','--resample'])
+        if method:
+            if method not in RESAMPLE_METHODS:
+                print ('Resampling method: '+method+' is not one of '+', '.join(RESAMPLE_METHODS))
+                return 1
+            resample={'method':method,'nsamples':get_flag_value(['-n','--resample_samples'],DEFAULT_RESAMPLE_SAMPLES,int),
+                      'seed':get_flag_value(['--seed'],None,int)}
+        summary=False
+        if '--summary' in sys.argv or '-s' in sys.argv:
+            summary=get_flag_value(['--bin_width'],DEFAULT_BIN_WIDTH,float)
+            if not summary>0:
+                print ('Summary bin width must be positive')
+                return 1
+        lookup=get_flag_value(['--tolerance'],None,float)
+        if lookup is None and ('--cell_lookup' in sys.argv or '-l' in sys.argv):
+            lookup=0.0
+        picks=None
+        obs_file=get_flag_value(['--obs'])
+        if obs_file or '--picks' in sys.argv or '-p' in sys.argv:
+            picks={'phase':phase,'obs_file':obs_file}
+        results=run_scatter_files(stations,station_file,scatter_files,grid_sampling,in_process,workers,binary=binary,cache_size=cache_size,threads=threads,
+                                  resample=resample,summary=summary,lookup=lookup,picks=picks)
+        failed=[result[0] for result in results if result[1]]
+        skipped=[result[0] for result in results if not result[1] and result[2]]
+        print ('Converted '+str(len(results)-len(failed)-len(skipped))+' of '+str(len(results))+' scatter files'+(' ('+str(len(skipped))+' skipped)' if skipped else ''))
+        return int(len(failed)>0)
 if __name__=="__main__":
-    __run__()
\ No newline at end of file
+    sys.exit(__run__())
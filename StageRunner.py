@@ -0,0 +1,343 @@
+#!/usr/bin/python
+"""StageRunner
+***********************
+
+Runs the NonLinLoc programs (or any other commands) as asyncio subprocesses, streaming the output rather than buffering it all in memory.
+
+The stdout and stderr output of each stage is written, as it is produced, to a rotating log file (with the size of each log file limited
+to max_bytes and backup_count old log files kept), and the last tail_lines lines are kept in memory in a bounded buffer.
+Independent stages can be run concurrently (limited by max_concurrent), and the return code and timing of each stage are returned
+as a StageResult. On unix systems, each program is run through a minimal wrapper (StageUsage.py, which only imports os and sys) that records
+its resource usage (CPU time, peak RSS and bytes read and written), so the usage of each stage is exact rather than sampled. The peak RSS
+includes the wrapper's footprint before running the program (recorded as wrapper_rss, see StageUsage.py), so it is an upper bound for
+programs smaller than the wrapper::
+
+    >>import StageRunner
+    >>results=StageRunner.run_stages([['Grid2Time','run/nlloc_control_grid2time_P.in'],['Grid2Time','run/nlloc_control_grid2time_S.in']],
+                                     ['log/grid2time_P.log','log/grid2time_S.log'])
+    >>results[0].returncode,results[0].elapsed,results[0].output,results[0].usage
+
+The results can be collected, along with in-process stages, in a RunReport, which can be written as JSON and CSV files and calls an optional
+hook function with each stage record (e.g. to send them to a metrics system)::
+
+    >>report=StageRunner.RunReport(hook=print)
+    >>with report.stage('setup'):
+    ...     setup()
+    >>report.add_results(results)
+    >>report.write('run_report')
+
+"""
+import asyncio,collections,os,time,json,sys,tempfile,contextlib,csv,threading
+try:
+    import resource
+except ImportError:
+    resource=None
+try:
+    from .StageUsage import _read_proc_io
+except:
+    from StageUsage import _read_proc_io
+DEFAULT_TAIL_LINES=100
+DEFAULT_MAX_BYTES=10*1024**2
+DEFAULT_BACKUP_COUNT=3
+_USAGE=hasattr(os,'wait4')#Record the resource usage of each program
+_USAGE_WRAPPER=os.path.join(os.path.dirname(os.path.abspath(__file__)),'StageUsage.py')
+REPORT_FIELDS=['stage','command','returncode','start','end','wall_time','cpu_time','user_time','system_time','max_rss','wrapper_rss','read_bytes','write_bytes','log_file']
+class RotatingLog(object):
+    """Log file that is rotated when it reaches a maximum size (log.1, log.2 etc.)
+
+    Args
+        filename: str log file path
+
+    Keyword Args
+        max_bytes: int maximum size of each log file in bytes (0 for no rotation)
+        backup_count: int number of old log files to keep
+    """
+    def __init__(self,filename,max_bytes=DEFAULT_MAX_BYTES,backup_count=DEFAULT_BACKUP_COUNT):
+        self.filename=filename
+        self.max_bytes=max_bytes
+        self.backup_count=backup_count
+        if os.path.split(filename)[0]:
+            try:
+                os.makedirs(os.path.split(filename)[0])
+            except OSError:
+                pass
+        self._fid=open(filename,'wb')
+        self._size=0
+    def _rotate(self):
+        self._fid.close()
+        for i in range(self.backup_count-1,0,-1):
+            if os.path.exists(self.filename+'.'+str(i)):
+                os.replace(self.filename+'.'+str(i),self.filename+'.'+str(i+1))
+        if self.backup_count>0:
+            os.replace(self.filename,self.filename+'.1')
+        self._fid=open(self.filename,'wb')
+        self._size=0
+    def write(self,data):
+        """Writes the data (bytes) to the log file, rotating it if necessary"""
+        if self.max_bytes and self._size and self._size+len(data)>self.max_bytes:
+            self._rotate()
+        self._fid.write(data)
+        self._size+=len(data)
+    def close(self):
+        self._fid.close()
+class StageResult(object):
+    """Result of running a stage
+
+    Args
+        args: list of command arguments
+
+    Keyword Args
+        log_file: str log file path (or None)
+        tail_lines: int number of output lines to keep
+
+    Attributes
+        returncode: int return code of the process (127 if it could not be started)
+        start: float start time (seconds since the epoch)
+        end: float end time (seconds since the epoch)
+        tail: collections.deque of the last tail_lines lines of output
+        usage: dict of the resource usage of the process (user_time, system_time, cpu_time in seconds, max_rss, wrapper_rss (the
+                usage wrapper footprint included in max_rss), read_bytes and write_bytes (all reads and writes), disk_read_bytes and
+                disk_write_bytes (storage reads and writes) in bytes), empty if it could not be recorded
+    """
+    def __init__(self,args,log_file=None,tail_lines=DEFAULT_TAIL_LINES):
+        self.args=list(args)
+        self.name=os.path.split(self.args[0])[1]
+        self.log_file=log_file
+        self.returncode=None
+        self.start=None
+        self.end=None
+        self.tail=collections.deque(maxlen=tail_lines)
+        self.usage={}
+    @property
+    def elapsed(self):
+        """Wall clock time taken in seconds"""
+        if self.start is None or self.end is None:
+            return None
+        return self.end-self.start
+    @property
+    def output(self):
+        """Last lines of the output"""
+        return ''.join(self.tail)
+    def __repr__(self):
+        return 'StageResult('+' '.join(self.args)+', returncode='+str(self.returncode)+', elapsed='+str(self.elapsed)+')'
+async def _read_stream(stream,log,result,lock):
+    """Reads the output stream in blocks, writing it to the log and keeping the last lines in the result tail"""
+    partial=''
+    while True:
+        data=await stream.read(65536)
+        if not data:
+            break
+        async with lock:
+            if log is not None:
+                log.write(data)
+        lines=(partial+data.decode('utf-8','replace')).split('\n')
+        partial=lines.pop()
+        result.tail.extend([line+'\n' for line in lines])
+    if partial:
+        result.tail.append(partial+'\n')
+async def run_stage_async(args,log_file=None,tail_lines=DEFAULT_TAIL_LINES,max_bytes=DEFAULT_MAX_BYTES,backup_count=DEFAULT_BACKUP_COUNT,semaphore=None):
+    """Runs a stage as an asyncio subprocess, streaming the output to the log file and tail buffer
+
+    Args
+        args: list of command arguments
+
+    Keyword Args
+        log_file: str log file path (or None for no log file)
+        tail_lines: int number of output lines to keep in the result
+        max_bytes: int maximum size of each log file in bytes
+        backup_count: int number of old log files to keep
+        semaphore: asyncio.Semaphore to limit the number of concurrent stages
+
+    Returns
+        StageResult: stage result
+    """
+    result=StageResult(args,log_file,tail_lines)
+    if semaphore is None:
+        semaphore=asyncio.Semaphore(1)
+    async with semaphore:
+        log=None
+        if log_file:
+            log=RotatingLog(log_file,max_bytes,backup_count)
+        command=result.args
+        usage_file=None
+        if _USAGE:
+            fid,usage_file=tempfile.mkstemp(suffix='.json')
+            os.close(fid)
+            command=[sys.executable,'-S','-E',_USAGE_WRAPPER,usage_file]+result.args
+        result.start=time.time()
+        try:
+            process=await asyncio.create_subprocess_exec(*command,stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            result.returncode=127
+            result.tail.append('Could not run '+result.name+': '+str(e)+'\n')
+            if log is not None:
+                log.write(result.tail[-1].encode('utf-8'))
+        else:
+            lock=asyncio.Lock()
+            await asyncio.gather(_read_stream(process.stdout,log,result,lock),_read_stream(process.stderr,log,result,lock))
+            result.returncode=await process.wait()
+        result.end=time.time()
+        if log is not None:
+            log.close()
+        if usage_file:
+            try:
+                result.usage=json.load(open(usage_file))
+            except ValueError:
+                pass
+            os.remove(usage_file)
+    return result
+async def _run_stages(commands,log_files,max_concurrent,**kwargs):
+    semaphore=asyncio.Semaphore(max(1,max_concurrent or len(commands)))
+    return await asyncio.gather(*[run_stage_async(args,log_file,semaphore=semaphore,**kwargs) for args,log_file in zip(commands,log_files)])
+def run_stages(commands,log_files=None,max_concurrent=None,tail_lines=DEFAULT_TAIL_LINES,max_bytes=DEFAULT_MAX_BYTES,backup_count=DEFAULT_BACKUP_COUNT):
+    """Runs the stages concurrently
+
+    Args
+        commands: list of command argument lists
+
+    Keyword Args
+        log_files: list of log file paths for each command (or None for no log files)
+        max_concurrent: int maximum number of stages to run at once (default is to run all the stages at once)
+        tail_lines: int number of output lines to keep in each result
+        max_bytes: int maximum size of each log file in bytes
+        backup_count: int number of old log files to keep
+
+    Returns
+        list: list of StageResult objects in the same order as the commands
+    """
+    if not len(commands):
+        return []
+    if log_files is None:
+        log_files=[None for args in commands]
+    return list(asyncio.run(_run_stages(commands,log_files,max_concurrent,tail_lines=tail_lines,max_bytes=max_bytes,backup_count=backup_count)))
+def run_stage(args,log_file=None,**kwargs):
+    """Runs a single stage (see run_stages)
+
+    Args
+        args: list of command arguments
+
+    Keyword Args
+        log_file: str log file path (or None for no log file)
+
+    Returns
+        StageResult: stage result
+    """
+    return run_stages([args],[log_file],**kwargs)[0]
+def _self_usage():
+    """Gets the resource usage of the current process (CPU time, peak RSS and I/O counters)"""
+    usage={}
+    if resource is not None:
+        self_usage=resource.getrusage(resource.RUSAGE_SELF)
+        usage['user_time']=self_usage.ru_utime
+        usage['system_time']=self_usage.ru_stime
+        usage['max_rss']=self_usage.ru_maxrss if sys.platform=='darwin' else self_usage.ru_maxrss*1024
+    io=_read_proc_io('self')
+    usage['read_bytes']=io.get('rchar')
+    usage['write_bytes']=io.get('wchar')
+    return usage
+def stage_record(result,stage=None):
+    """Converts a StageResult into a report record
+
+    Args
+        result: StageResult stage result
+
+    Keyword Args
+        stage: str stage name (defaults to the program name)
+
+    Returns
+        dict: report record with the REPORT_FIELDS keys
+    """
+    record=dict([(field,None) for field in REPORT_FIELDS])
+    record.update({'stage':stage or result.name,'command':' '.join(result.args),'returncode':result.returncode,'start':result.start,'end':result.end,
+                   'wall_time':result.elapsed,'log_file':result.log_file})
+    for field in ['cpu_time','user_time','system_time','max_rss','wrapper_rss','read_bytes','write_bytes']:
+        record[field]=result.usage.get(field)
+    return record
+class RunReport(object):
+    """Report of the wall time, CPU time, peak RSS and bytes read and written for each stage of a run
+
+    Keyword Args
+        hook: function called with each stage record (dict with the REPORT_FIELDS keys) as it is added
+
+    Attributes
+        records: list of stage records
+    """
+    def __init__(self,hook=None):
+        self.hook=hook
+        self.records=[]
+        self.start=time.time()
+        self._lock=threading.Lock()
+        self._active=[]
+    def add(self,record):
+        """Adds a stage record to the report, calling the hook function"""
+        self.records.append(record)
+        if self.hook:
+            self.hook(record)
+    def add_results(self,results):
+        """Adds the StageResults to the report"""
+        for result in results:
+            self.add(stage_record(result))
+    @contextlib.contextmanager
+    def stage(self,name):
+        """Context manager to record an in-process stage
+
+        The CPU time and bytes read and written are the differences in the usage of the current process, and the peak RSS is
+        the peak RSS of the current process at the end of the stage. These are process-wide, so they include any work done
+        by other threads during the stage. If in-process stages overlap (e.g. when running models concurrently in threads), the
+        differences would be counted for each of the overlapping stages, so they are not recorded (None) for those stages.
+
+        Args
+            name: str stage name
+        """
+        #Mutable flag for whether the stage overlaps any other in-process stage
+        overlapped=[False]
+        with self._lock:
+            for other in self._active:
+                other[0]=True
+            overlapped[0]=bool(self._active)
+            self._active.append(overlapped)
+        start_usage=_self_usage()
+        start=time.time()
+        try:
+            yield
+        finally:
+            end=time.time()
+            end_usage=_self_usage()
+            with self._lock:
+                self._active.remove(overlapped)
+            record=dict([(field,None) for field in REPORT_FIELDS])
+            record.update({'stage':name,'start':start,'end':end,'wall_time':end-start,'max_rss':end_usage.get('max_rss')})
+            for field in ['user_time','system_time','read_bytes','write_bytes']:
+                if not overlapped[0] and end_usage.get(field) is not None and start_usage.get(field) is not None:
+                    record[field]=end_usage[field]-start_usage[field]
+            if record['user_time'] is not None:
+                record['cpu_time']=record['user_time']+record['system_time']
+            self.add(record)
+    def summary(self):
+        """Gets the totals for the run
+
+        Returns
+            dict: dictionary of the total wall time, CPU time, bytes read and written, and the overall peak RSS
+        """
+        return {'wall_time':time.time()-self.start,
+                'cpu_time':sum([record['cpu_time'] or 0 for record in self.records]),
+                'max_rss':max([0]+[record['max_rss'] or 0 for record in self.records]),
+                'read_bytes':sum([record['read_bytes'] or 0 for record in self.records]),
+                'write_bytes':sum([record['write_bytes'] or 0 for record in self.records])}
+    def write(self,root):
+        """Writes the report as JSON (root.json, with the stage records and summary) and CSV (root.csv, with the stage records)
+
+        The records are sorted by the stage start times.
+
+        Args
+            root: str report file root
+        """
+        records=sorted(self.records,key=lambda record:record['start'] or 0)
+        fid=open(root+'.json','w')
+        json.dump({'stages':records,'summary':self.summary()},fid,indent=1)
+        fid.close()
+        fid=open(root+'.csv','w')
+        writer=csv.DictWriter(fid,REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+        fid.close()
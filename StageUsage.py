@@ -0,0 +1,104 @@
+#!/usr/bin/python
+"""StageUsage
+***********************
+
+Minimal wrapper used by StageRunner to run a program and record its resource usage (CPU time, peak RSS and bytes read and written).
+It only imports os and sys, and is run with the -S and -E interpreter flags, so that it starts quickly and adds as little as possible
+to the recorded peak RSS::
+
+    $~ python -S -E StageUsage.py usage_file program [args ...]
+
+The program is run in a forked child process, which is waited for without reaping it, so the I/O counters can be read from /proc,
+and then reaped using os.wait4 to get the CPU time and peak RSS. The usage is written to the usage file as JSON, and the wrapper exits
+with the return code of the program (127 if it could not be run).
+
+The peak RSS (ru_maxrss) of the child process includes its footprint before it runs the program (the part of the wrapper's memory copied
+when forking). This footprint (a few MB) is read by the child from /proc just before running the program, and is recorded as wrapper_rss,
+so a max_rss within about 1 MB of wrapper_rss means that the peak RSS of the program is no more than that, while a larger max_rss is the
+peak RSS of the program.
+"""
+import os,sys
+def _read_proc_io(pid):
+    """Reads the I/O counters for the process from /proc (Linux only), returning an empty dict if they are not available"""
+    io={}
+    try:
+        for line in open('/proc/'+str(pid)+'/io'):
+            key,value=line.split(':')
+            io[key.strip()]=int(value)
+    except (OSError,ValueError):
+        pass
+    return io
+def _peak_resident_bytes():
+    """Gets the peak RSS of the current process (VmHWM) from /proc (Linux only), returning an empty string if it is not available"""
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return str(int(line.split()[1])*1024)
+    except (OSError,ValueError,IndexError):
+        pass
+    return ''
+def _find_program(program):
+    """Finds the program on the path (as os.execvp), so the child process only needs to call os.execv"""
+    if os.path.split(program)[0]:
+        return program
+    for path in os.environ.get('PATH',os.defpath).split(os.pathsep):
+        filename=os.path.join(path,program)
+        if os.path.isfile(filename) and os.access(filename,os.X_OK):
+            return filename
+    return program
+def _json(usage):
+    """Converts the usage dict (of numbers or None) to JSON, without importing json"""
+    return '{'+', '.join(['"'+key+'": '+('null' if value is None else repr(value)) for key,value in sorted(usage.items())])+'}'
+def run_with_usage(args,usage_file):
+    """Runs the command and writes its resource usage to the usage file as JSON
+
+    Args
+        args: list of command arguments
+        usage_file: str usage file path
+
+    Returns
+        int: return code of the command (127 if it could not be run)
+    """
+    program=_find_program(args[0])
+    #The pipe is closed when the program is run, as it is not inheritable
+    read_fd,write_fd=os.pipe()
+    pid=os.fork()
+    if pid==0:
+        os.close(read_fd)
+        os.write(write_fd,_peak_resident_bytes().encode('ascii'))
+        try:
+            os.execv(program,args)
+        except OSError as e:
+            sys.stderr.write('Could not run '+os.path.split(args[0])[1]+': '+str(e)+'\n')
+            sys.stderr.flush()
+        os._exit(127)
+    os.close(write_fd)
+    wrapper_rss=b''
+    data=os.read(read_fd,64)
+    while data:
+        wrapper_rss+=data
+        data=os.read(read_fd,64)
+    os.close(read_fd)
+    wrapper_rss=int(wrapper_rss) if wrapper_rss else None
+    io={}
+    try:
+        os.waitid(os.P_PID,pid,os.WEXITED|os.WNOWAIT)
+        io=_read_proc_io(pid)
+    except (AttributeError,OSError):
+        pass
+    pid,status,usage=os.wait4(pid,0)
+    #ru_maxrss is in kB on linux and bytes on mac
+    max_rss=usage.ru_maxrss if sys.platform=='darwin' else usage.ru_maxrss*1024
+    fid=open(usage_file,'w')
+    fid.write(_json({'user_time':usage.ru_utime,'system_time':usage.ru_stime,'cpu_time':usage.ru_utime+usage.ru_stime,'max_rss':max_rss,
+                     'wrapper_rss':wrapper_rss,'read_bytes':io.get('rchar'),'write_bytes':io.get('wchar'),
+                     'disk_read_bytes':io.get('read_bytes',usage.ru_inblock*512),'disk_write_bytes':io.get('write_bytes',usage.ru_oublock*512)}))
+    fid.close()
+    if os.WIFSIGNALED(status):
+        return 128+os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+if __name__=="__main__":
+    if len(sys.argv)<3:
+        sys.stderr.write('Usage: StageUsage.py usage_file program [args ...]\n')
+        sys.exit(2)
+    sys.exit(run_with_usage(sys.argv[2:],sys.argv[1]))
@@ -11,6 +11,11 @@ To compile the executable, it is necesary to compile some other components into
 
 This uses Scat2Angle to convert XYZ coordinates into a location file, and then evaluates the take-off angles.
 
+Many points can be converted in a single pass using the -b or --batch flag with a file of points (one x, y, z or latitude, longitude, depth point per line),
+which calculates the angles in-process (requires numpy) and writes a comma separated table of the azimuth and take-off angle for each station to
+the file set by the -o or --output flag (or prints it). From within python use get_angles_batch, or angles_at, which returns a structured array
+without writing any files and can be called concurrently from multiple threads.
+
 Command line flags
 *********************************
 To obtain a list of the command line flags use the -h flag::
@@ -47,6 +52,23 @@ To run from within python, (assuming the module is on your PYTHONPATH)::
     >>XYZ2Angle.__run__()
 
 This will run with the default options, although these can be customized - see the XYZ2Angle.__run__ docstrings.
+
+XYZ2Time
+*********************************
+XYZ2Angle also provides XYZ2Time, which interpolates the P and S travel times for all the stations from the Grid2Time time grids (grid*.phase.station.time.hdr/.buf files,
+with the grid path set by the -g flag, defaulting to ./time/) for x, y, z or latitude, longitude, depth points.
+It uses the same command line flags as XYZ2Angle, but the times are calculated in-process (requires numpy), and both the P and S times
+are calculated unless the phase is set using the -p flag::
+
+    $~ XYZ2Time -x -g ./time/ 1.0 2.0 5.0
+    $~ XYZ2Time -x -g ./time/ -b points.csv -o times.csv
+
+From within python use times_at, which memory maps the time grids once (including 2D grids, evaluated at the epicentral distance),
+and returns the interpolated travel times for a batch of points for all the stations::
+
+    >>import XYZ2Angle
+    >>times=XYZ2Angle.times_at(points,'./time/')
+    >>times['P'] # N x stations array of P travel times
  
 """
 try:
@@ -55,13 +77,18 @@ try:
 except:
     _ARGPARSE=False
 try:
-    from .Scat2Angle import write_stations, get_stations
+    from .Scat2Angle import write_stations, get_stations, Scat2AngleSession
     from .Scat2Angle import get_angles as get_scat_angles
 except:
-    from Scat2Angle import write_stations, get_stations
+    from Scat2Angle import write_stations, get_stations, Scat2AngleSession
     from Scat2Angle import get_angles as get_scat_angles
 
-import struct,shutil,os,glob,textwrap
+import struct,shutil,os,glob,textwrap,sys,threading
+_SESSIONS={}#Cached Scat2AngleSessions for angles_at
+_SESSIONS_LOCK=threading.Lock()
+_TIME_GRIDS={}#Cached time grids for times_at
+_PROJECTIONS={}#Cached Lambert projections for latlon_xyz and xyz_latlon
+_HEADERS={}#Cached grid header transform parameters
 def make_scatter_file(x,y,z,endian='='):
     """Make the scatter file for the x y z coordinates
 
@@ -101,18 +128,254 @@ def get_angles(x,y,z,grid_path='./grid/',endian='=',phase='P'):
     """
     station_file=write_stations(get_stations(grid_path,phase),grid_path)
     scatter_file=make_scatter_file(x,y,z,endian)
-    get_scat_angles(station_file,scatter_file)
+    get_scat_angles(station_file,scatter_file,False)
     os.remove('xyz.scat')
     shutil.move('xyz.scatangle','xyz.angle')
+def read_points(filename):
+    """Reads points from a comma or whitespace separated file, with one point per line
+
+    Lines starting with # are ignored.
+
+    Args
+        filename: str points file name
+
+    Returns
+        numpy.array: N x 3 array of points
+    """
+    import numpy as np
+    delimiter=None
+    for line in open(filename):
+        if line.strip() and not line.lstrip().startswith('#'):
+            if ',' in line:
+                delimiter=','
+            break
+    return np.loadtxt(filename,delimiter=delimiter,usecols=(0,1,2),ndmin=2)
+def get_angles_batch(points,grid_path='./grid/',phase='P',latlon=False,endian='='):
+    """Calculates the take-off angles and azimuths for many points in a single pass
+
+    The angles are calculated in-process (using a Scat2AngleSession), so no files are written and the executable is not needed.
+
+    Args
+        points: N x 3 array of x, y, z coordinates in km (or latitude, longitude, depth if latlon is set)
+
+    Keyword Args
+        grid_path: str path to grid files for angle calculation
+        phase: str phase to calculate angles for
+        latlon: bool flag for points in latitude, longitude and depth (converted using the grid header Lambert transform)
+        endian: endian value
+
+    Returns
+        (list,numpy.array,numpy.array,numpy.array): tuple of station names, N x 3 array of x, y, z coordinates,
+                                                     and N x stations arrays of azimuths and take-off angles
+    """
+    import numpy as np
+    points=np.array(points,dtype=np.float64,ndmin=2)
+    if latlon:
+        x,y,z=latlon_xyz(points[:,0],points[:,1],points[:,2],*get_grid_transform(grid_path))
+        points=np.column_stack((x,y,z))
+    session=Scat2AngleSession(grid_path,phase,endian=endian)
+    azimuth,takeoff=session.angles({'x':points[:,0],'y':points[:,1],'z':points[:,2]})
+    return session.names,points,azimuth,takeoff
+def _get_session(grid_path,phase,endian):
+    """Gets the cached Scat2AngleSession for the grid path, phase and endian value, creating it if necessary (thread-safe)"""
+    key=(grid_path,phase,endian)
+    with _SESSIONS_LOCK:
+        if key not in _SESSIONS:
+            _SESSIONS[key]=Scat2AngleSession(grid_path,phase,endian=endian)
+        return _SESSIONS[key]
+def clear_sessions():
+    """Clears the cached stations and grids used by angles_at and times_at (e.g. if the grid files have changed)"""
+    with _SESSIONS_LOCK:
+        _SESSIONS.clear()
+        _TIME_GRIDS.clear()
+        _HEADERS.clear()
+def angles_at(points,grid_path='./grid/',phase='P',endian='='):
+    """Calculates the take-off angles and azimuths for x, y, z points
+
+    This is a pure function - no files are written and the current directory is not used, so it can be called concurrently
+    from multiple threads. The stations and angle grids for each grid_path and phase are cached in memory between calls
+    (use clear_sessions to reset them).
+
+    Args
+        points: N x 3 array of x, y, z coordinates in km (or a single x, y, z point)
+
+    Keyword Args
+        grid_path: str path to grid files for angle calculation
+        phase: str phase to calculate angles for
+        endian: endian value
+
+    Returns
+        numpy.array: N x stations structured array with station, azimuth and takeoff fields
+    """
+    import numpy as np
+    points=np.array(points,dtype=np.float64,ndmin=2)
+    session=_get_session(grid_path,phase,endian)
+    azimuth,takeoff=session.angles({'x':points[:,0],'y':points[:,1],'z':points[:,2]})
+    width=max([1]+[len(name) for name in session.names])
+    result=np.empty(azimuth.shape,dtype=[('station','U'+str(width)),('azimuth',np.float64),('takeoff',np.float64)])
+    result['station']=session.names
+    result['azimuth']=azimuth
+    result['takeoff']=takeoff
+    return result
+def get_time_grids(time_path='./time/',phase='P'):
+    """Gets the time grid files for each station
+
+    Reads the list of time header files at::
+
+        time_path*.phase.*.time.hdr
+
+    Args
+        time_path: str path to time grid files
+
+    Keyword Args
+        phase: str phase to use (i.e. P or S)
+
+    Returns
+        dict: dictionary of time grid file roots (without the .hdr extension) with the station names as keys
+    """
+    time_grids={}
+    for file in glob.glob(time_path+'*.'+phase+'.*.time.hdr'):
+        time_grids[file.split('.time.hdr')[0].split('.')[-1]]=file.split('.hdr')[0]
+    return time_grids
+def _get_time_grids(time_path,phases,endian):
+    """Gets the cached station names, time grid files and grid cache for the time path and phases, creating them if necessary (thread-safe)"""
+    try:
+        from .GridLib import GridCache,TimeGrid
+    except:
+        from GridLib import GridCache,TimeGrid
+    key=(time_path,tuple(phases),endian)
+    with _SESSIONS_LOCK:
+        if key not in _TIME_GRIDS:
+            time_grids=dict([(phase,get_time_grids(time_path,phase)) for phase in phases])
+            names=sorted(set([name for phase in phases for name in time_grids[phase]]))
+            _TIME_GRIDS[key]=(names,time_grids,GridCache(endian=endian,grid_class=TimeGrid))
+        return _TIME_GRIDS[key]
+def times_at(points,time_path='./time/',phases=('P','S'),endian='='):
+    """Calculates the travel times for x, y, z points
+
+    The time grids are memory mapped and cached in memory between calls (use clear_sessions to reset them),
+    and the times are interpolated for all the points in a single operation per station and phase. As for angles_at,
+    no files are written, and it can be called concurrently from multiple threads.
+
+    Args
+        points: N x 3 array of x, y, z coordinates in km (or a single x, y, z point)
+
+    Keyword Args
+        time_path: str path to time grid files
+        phases: list of phases to calculate times for
+        endian: endian value
+
+    Returns
+        numpy.array: N x stations structured array with station and phase (travel time in seconds) fields. Times are NaN if
+                        there is no grid for the station and phase or if the point is outside the grid.
+    """
+    import numpy as np
+    points=np.array(points,dtype=np.float64,ndmin=2)
+    names,time_grids,cache=_get_time_grids(time_path,phases,endian)
+    width=max([1]+[len(name) for name in names])
+    result=np.empty((len(points),len(names)),dtype=[('station','U'+str(width))]+[(phase,np.float64) for phase in phases])
+    result['station']=names
+    for phase in phases:
+        result[phase]=np.nan
+        for i,name in enumerate(names):
+            if name in time_grids[phase]:
+                times=cache.get(time_grids[phase][name]).times(points[:,0],points[:,1],points[:,2])
+                result[phase][:,i]=np.where(times<0.0,np.nan,times)
+    return result
+def write_times_table(filename,points,times,phases=('P','S')):
+    """Writes a comma separated table of the travel times for each point
+
+    Each row has the x, y, z coordinates followed by the travel time for each station and phase.
+
+    Args
+        filename: str output file name (or open file object)
+        points: N x 3 array of x, y, z coordinates
+        times: N x stations structured array of travel times (from times_at)
+
+    Keyword Args
+        phases: list of phases to write
+    """
+    import numpy as np
+    columns=['X','Y','Z']
+    table=[np.array(points,dtype=np.float64,ndmin=2)]
+    for i,name in enumerate(times['station'][0] if len(times) else []):
+        for phase in phases:
+            columns.append(name+'_'+phase)
+            table.append(times[phase][:,i:i+1])
+    np.savetxt(filename,np.hstack(table),fmt='%g',delimiter=',',header=','.join(columns),comments='')
+def write_angles_table(filename,names,points,azimuth,takeoff):
+    """Writes a comma separated table of the take-off angles and azimuths for each point
+
+    Each row has the x, y, z coordinates followed by the azimuth and take-off angle for each station.
+
+    Args
+        filename: str output file name (or open file object)
+        names: list of station names
+        points: N x 3 array of x, y, z coordinates
+        azimuth: N x stations array of azimuths
+        takeoff: N x stations array of take-off angles
+    """
+    import numpy as np
+    columns=['X','Y','Z']
+    for name in names:
+        columns.extend([name+'_azimuth',name+'_takeoff'])
+    table=np.empty((len(points),3+2*len(names)))
+    table[:,:3]=points
+    table[:,3::2]=azimuth
+    table[:,4::2]=takeoff
+    np.savetxt(filename,table,fmt='%g',delimiter=',',header=','.join(columns),comments='')
+def get_projection(latitude_0,longitude_0,latitude_1,latitude_2):
+    """Gets the Lambert projection and projected origin for the transform parameters
+
+    The projections are cached, so each projection is only constructed once.
+
+    Args
+        latitude_0: float latitude of origin in degrees
+        longitude_0: float longitude of origin in degrees 
+        latitude_1: float latitude of first standard parallel in degrees 
+        latitude_2: float latitude of second standard parallel in degrees 
+
+    Returns
+        (pyproj.Proj,float,float): tuple of the projection and the projected x and y coordinates of the origin in m
+    """
+    key=(float(latitude_0),float(longitude_0),float(latitude_1),float(latitude_2))
+    with _SESSIONS_LOCK:
+        if key not in _PROJECTIONS:
+            from pyproj import Proj
+            p=Proj('+proj=lcc +lat_0='+str(key[0])+' +lon_0='+str(key[1])+' +lat_1='+str(key[2])+' +lat_2='+str(key[3]),ellps='WGS84')
+            [x_0,y_0]=p(key[1],key[0])
+            _PROJECTIONS[key]=(p,x_0,y_0)
+        return _PROJECTIONS[key]
+def get_grid_transform(grid_path):
+    """Gets the Lambert transform parameters from the first header file in the grid path
+
+    The parameters are cached for each grid path, and only re-read if the header file has been modified.
+
+    Args
+        grid_path: str path to grid files
+
+    Returns
+        (float,float,float,float): tuple of floats for latitude and longitude of the origin and
+                                     the latitiudes of the first and second standard parallels
+    """
+    with _SESSIONS_LOCK:
+        cached=_HEADERS.get(grid_path)
+    if cached is None or not os.path.exists(cached[0]) or os.path.getmtime(cached[0])!=cached[1]:
+        header_file=glob.glob(grid_path+'*.hdr')[0]
+        cached=(header_file,os.path.getmtime(header_file),parse_header_file(header_file))
+        with _SESSIONS_LOCK:
+            _HEADERS[grid_path]=cached
+    return cached[2]
 def latlon_xyz(latitude,longitude,depth,latitude_0,longitude_0,latitude_1,latitude_2):
     """Converts latitude and longitude into x y z
 
-    Uses pyproj abd lambert projection to convert the coordinates using a given origin.
+    Uses pyproj abd lambert projection to convert the coordinates using a given origin. The projection is cached (see get_projection),
+    and numpy arrays of coordinates are converted in a single call.
 
     Args
-        latitude: float latitude in degrees
-        longitude: float longitude in degrees
-        depth: float depth in km
+        latitude: float or numpy array latitude in degrees
+        longitude: float or numpy array longitude in degrees
+        depth: float or numpy array depth in km
         latitude_0: float latitude of origin in degrees
         longitude_0: float longitude of origin in degrees 
         latitude_1: float latitude of first standard parallel in degrees 
@@ -121,30 +384,87 @@ def latlon_xyz(latitude,longitude,depth,latitude_0,longitude_0,latitude_1,latitu
     Returns
         (float,float,float): tuple of x, y, z coordinates in km from latitude_0 and longitude_0 origin
     """
-    from pyproj import Proj
-    p=Proj('+proj=lcc +lat_0='+str(latitude_0)+' +lon_0='+str(longitude_0)+' +lat_1='+str(latitude_1)+' +lat_2='+str(latitude_2),ellps='WGS84')
-    [x_0,y_0]=p(float(longitude_0),float(latitude_0))
+    p,x_0,y_0=get_projection(latitude_0,longitude_0,latitude_1,latitude_2)
     [x,y]=p(longitude,latitude)
     return (x-x_0)/1000.,(y-y_0)/1000.,depth
+def xyz_latlon(x,y,z,latitude_0,longitude_0,latitude_1,latitude_2):
+    """Converts x y z into latitude and longitude (the inverse of latlon_xyz)
+
+    Args
+        x: float or numpy array x coordinate in km from latitude_0 and longitude_0 origin
+        y: float or numpy array y coordinate in km from latitude_0 and longitude_0 origin
+        z: float or numpy array z coordinate (depth) in km
+        latitude_0: float latitude of origin in degrees
+        longitude_0: float longitude of origin in degrees 
+        latitude_1: float latitude of first standard parallel in degrees 
+        latitude_2: float latitude of second standard parallel in degrees 
+
+    Returns
+        (float,float,float): tuple of latitude, longitude in degrees and depth in km
+    """
+    p,x_0,y_0=get_projection(latitude_0,longitude_0,latitude_1,latitude_2)
+    [longitude,latitude]=p(x*1000.+x_0,y*1000.+y_0,inverse=True)
+    return latitude,longitude,z
 def __run__():
     """Main function for running XYZ2Angle from command line.
 
     For command line options, use the '-h' flag.
+
+    Returns
+        int: 0 if the angles were calculated, otherwise 1
     """
     options=__parser__()
     if os.path.isdir(options['grid_path']):
         options['grid_path']=options['grid_path'].rstrip(os.path.sep)+os.path.sep
+    if options['batch']:
+        names,points,azimuth,takeoff=get_angles_batch(read_points(options['batch']),options['grid_path'],options['phase'],not options['xyz'],options['endian'])
+        write_angles_table(options['output'] or sys.stdout,names,points,azimuth,takeoff)
+        return 0
+    if options['X'] is None or options['Y'] is None or options['Z'] is None:
+        print ('Requires X, Y and Z coordinates or a batch file (-b flag).')
+        print ('For help use -h flag.')
+        return 1
     if not options['xyz']:
-        header_file=glob.glob(options['grid_path']+'*.hdr')[0]
-        lat0,lon0,lat1,lat2=parse_header_file(header_file)
-        [options['X'],options['Y'],options['Z']]=latlon_xyz(options['X'],options['Y'],options['Z'],lat0,lon0,lat1,lat2)
+        [options['X'],options['Y'],options['Z']]=latlon_xyz(options['X'],options['Y'],options['Z'],*get_grid_transform(options['grid_path']))
     get_angles(options['X'],options['Y'],options['Z'],options['grid_path'],options['endian'],options['phase'])
     output=open('xyz.angle').readlines()
     print ('Results for Location:\nX:'+str(options['X'])+' km  Y:'+str(options['Y'])+' km  Z:'+str(options['Z'])+' km\n')
     print (''.join(output[1:]))
+    return 0
 def time():
-    raise NotImplementedError()
-    # print ('To use XYZ2Time')
+    """Main function for running XYZ2Time from command line.
+
+    For command line options, use the '-h' flag.
+
+    Returns
+        int: 0 if the travel times were calculated, otherwise 1
+    """
+    options=__parser__(prog='XYZ2Time')
+    if os.path.isdir(options['grid_path']):
+        options['grid_path']=options['grid_path'].rstrip(os.path.sep)+os.path.sep
+    phases=[options['phase']] if options['phase'] else ['P','S']
+    if options['batch']:
+        points=read_points(options['batch'])
+    elif options['X'] is None or options['Y'] is None or options['Z'] is None:
+        print ('Requires X, Y and Z coordinates or a batch file (-b flag).')
+        print ('For help use -h flag.')
+        return 1
+    else:
+        points=[[options['X'],options['Y'],options['Z']]]
+    import numpy as np
+    points=np.array(points,dtype=np.float64,ndmin=2)
+    if not options['xyz']:
+        x,y,z=latlon_xyz(points[:,0],points[:,1],points[:,2],*get_grid_transform(options['grid_path']))
+        points=np.column_stack((x,y,z))
+    times=times_at(points,options['grid_path'],phases,options['endian'])
+    if options['batch']:
+        write_times_table(options['output'] or sys.stdout,points,times,phases)
+        return 0
+    print ('Results for Location:\nX:'+str(points[0,0])+' km  Y:'+str(points[0,1])+' km  Z:'+str(points[0,2])+' km\n')
+    print ('STA '+' '.join(phases))
+    for row in times[0]:
+        print (' '.join([row['station']]+['%g'%row[phase] for phase in phases]))
+    return 0
 def parse_header_file(filename):
     """Parses hdr file for grid origin and parallels (Lambert transform)
 
@@ -155,23 +475,33 @@ def parse_header_file(filename):
         (float,float,float,float): tuple of floats for latitude and longitude of the origin and
                                      the latitiudes of the first and second standard parallels
     """
-    lines=open(filename).readlines()
-    latitude_0=lines[2].split()[5]
-    longitude_0=lines[2].split()[7]
-    latitude_1=lines[2].split()[9]
-    latitude_2=lines[2].split()[11]
-    return latitude_0,longitude_0,latitude_1,latitude_2
-def __parser__(input_args=False):
-    """Command line parser for XYZ2Angle
+    fid=open(filename)
+    fid.readline()
+    fid.readline()
+    transform=fid.readline().split()
+    fid.close()
+    return float(transform[5]),float(transform[7]),float(transform[9]),float(transform[11])
+def __parser__(input_args=False,prog='XYZ2Angle'):
+    """Command line parser for XYZ2Angle (and XYZ2Time)
 
     Keyword Args
         input_args: list of input arguments (defaults to sys.argv)
+        prog: str program name (XYZ2Angle or XYZ2Time)
 
     Returns
         dict: dictionary of selected command line options.
     """
     description="""XYZ2Angle - Wrapper to convert lat/lon/depth or XYZ coordinates to angles using NLLoc by David Pugh (Bullard Laboratories, Department of Earth Sciences, University of Cambridge) 
     """
+    grid_path='./'
+    phase='P'
+    table='angles'
+    if prog=='XYZ2Time':
+        description="""XYZ2Time - Convert lat/lon/depth or XYZ coordinates to travel times using the NLLoc time grids by David Pugh (Bullard Laboratories, Department of Earth Sciences, University of Cambridge) 
+    """
+        grid_path='./time/'
+        phase=None
+        table='times'
     optparsedescription="""Arguments are set as below, syntax is -gTest or --gridpath=Test
     """
     argparsedescription="""Arguments are set as below, syntax is -gTest or -g Test
@@ -231,14 +561,16 @@ def __parser__(input_args=False):
 
                 # return a single string
                 return self._join_parts(parts)
-        parser=argparse.ArgumentParser(prog='XYZ2Angle',description=description+argparsedescription,formatter_class=IndentedHelpFormatterWithNL)
-        parser.add_argument('X',type=float,help="Latitude in degrees/X coordinate in km (-x flag required)")
-        parser.add_argument('Y',type=float,help="Longitude in degrees/Y coordinate in km (-x flag required)")
-        parser.add_argument('Z',type=float,help="Depth in km/Z coordinate in km (-x flag required)")
-        parser.add_argument("-g","--gridpath","--grid_path",help='Grid files path use for the location,defaults to  current directory',dest='grid_path',default='./')
+        parser=argparse.ArgumentParser(prog=prog,description=description+argparsedescription,formatter_class=IndentedHelpFormatterWithNL)
+        parser.add_argument('X',type=float,help="Latitude in degrees/X coordinate in km (-x flag required)",nargs="?")
+        parser.add_argument('Y',type=float,help="Longitude in degrees/Y coordinate in km (-x flag required)",nargs="?")
+        parser.add_argument('Z',type=float,help="Depth in km/Z coordinate in km (-x flag required)",nargs="?")
+        parser.add_argument("-g","--gridpath","--grid_path",help='Grid files path use for the location,defaults to '+grid_path,dest='grid_path',default=grid_path)
         parser.add_argument("-x","--xyz",help='Using XYZ coordinates in km relative to geographic origin',action='store_true',dest='xyz',default=False)
         parser.add_argument("-e","--endian",help='Endian value to use',choices=['=','<','>','@','!'],dest='endian',default='=')
-        parser.add_argument("-p","--phase",help="Set grid phase to use e.g. P or S",dest='phase',default='P')
+        parser.add_argument("-p","--phase",help="Set grid phase to use e.g. P or S"+(", defaults to both P and S" if phase is None else ""),dest='phase',default=phase)
+        parser.add_argument("-b","--batch",help='Batch file of points (comma or whitespace separated, one point per line) to calculate the '+table+' for in a single pass, instead of the X Y Z arguments',dest='batch',default=False)
+        parser.add_argument("-o","--output",help='Output file for the batch '+table+' table (comma separated), defaults to printing the table',dest='output',default=False)
         if input_args:
             options=parser.parse_args(input_args)
         else:
@@ -305,14 +637,16 @@ def __parser__(input_args=False):
                 elif opts[-1] != "\n":
                   result.append("\n")
                 return "".join(result)
-        parser=optparse.OptionParser(prog='XYZ2Angle',description=description+optparsedescription,formatter_class=IndentedHelpFormatterWithNL)
+        parser=optparse.OptionParser(prog=prog,description=description+optparsedescription,formatter_class=IndentedHelpFormatterWithNL)
         parser.add_option('X',type=float,help="Latitude in degrees/X coordinate in km (-x flag required)")
         parser.add_option('Y',type=float,help="Longitude in degrees/Y coordinate in km (-x flag required)")
         parser.add_option('Z',type=float,help="Depth in km/Z coordinate in km (-x flag required)")
-        parser.add_option("-g","--gridpath","--grid_path",help='Grid files path use for the location,defaults to  current directory',dest='grid_path',default=False)
+        parser.add_option("-g","--gridpath","--grid_path",help='Grid files path use for the location,defaults to '+grid_path,dest='grid_path',default=grid_path)
         parser.add_option("-x","--xyz",help='Using XYZ coordinates in km relative to geographic origin',action='store_true',dest='XYZ',default=False)
         parser.add_option("-e","--endian",help='Endian value to use',choices=['=','<','>','@','!'],dest='endian',default='=')
-        parser.add_option("-p","--phase",help="Set grid  phase to use e.g. P or S",dest='phase',default='P')
+        parser.add_option("-p","--phase",help="Set grid  phase to use e.g. P or S"+(", defaults to both P and S" if phase is None else ""),dest='phase',default=phase)
+        parser.add_option("-b","--batch",help='Batch file of points (comma or whitespace separated, one point per line) to calculate the '+table+' for in a single pass, instead of the X Y Z arguments',dest='batch',default=False)
+        parser.add_option("-o","--output",help='Output file for the batch '+table+' table (comma separated), defaults to printing the table',dest='output',default=False)
         if input_args and len(input_args):
             (options,args)=parser.parse_args(input_args)
         else:
@@ -320,5 +654,4 @@ def __parser__(input_args=False):
         options=vars(options)        
     return options        
 if __name__=="__main__":
-    __run__()
-
+    sys.exit(__run__())
@@ -98,6 +98,88 @@ Which will then be changed to:
 
 Note that the single control file is changed to one for each program
 
+Program output
+*********************************
+
+The NonLinLoc programs are run as asyncio subprocesses (see StageRunner.py), with the output streamed to rotating log files in ./log
+(e.g. ./log/NLLoc.nlloc_control_nlloc.log), and the last lines of the output printed when each program finishes, along with the return code and run time.
+The stage functions (Vel2Grid, Grid2Time, NLLoc and Scat2Angle) return StageResult objects with the return code, timing and output tail,
+and run_pyNLLoc returns the list of results for all the stages (__run__ returns the exit status, 1 if any stage failed, otherwise 0).
+If Vel2Grid or Grid2Time fails, the later stages are not run, and the outputs of any failed NLLoc event shards are not merged.
+
+Run report
+*********************************
+
+The wall time, CPU time, peak RSS and bytes read and written for each stage (folder setup, control file checks, and each NonLinLoc program run)
+are recorded and written to ./pyNLLoc_report.json (with the totals for the run) and ./pyNLLoc_report.csv in the target directory.
+The peak RSS of each program is at least the footprint of the usage wrapper it is run through (recorded as wrapper_rss, a few MB, see
+StageUsage.py), so it is only exact for programs larger than that.
+The CPU time and bytes read and written for the in-process stages (setup and control file checks) are for the whole pyNLLoc process, so they
+are not recorded for stages that overlap when running models concurrently (-w).
+When running from within python, a hook function can be passed to __run__, which is called with the record (dict) for each stage as it finishes,
+e.g. to send the records to a metrics system::
+
+    >>pyNLLoc.__run__(hook=print)
+
+Running Grid2Time in parallel
+*********************************
+
+The Grid2Time P and S runs are run concurrently, with the number of simultaneous Grid2Time processes set by the flag:
+
+    * -p, --processes (default 2)
+
+The station list (GTSRCE lines, including those in INCLUDEd station files) can also be split into a number of shards for each phase, using the flag:
+
+    * -s, --shards, --time_shards
+
+Each shard has its own control file (./run/nlloc_control_grid2time_P.shard0.in etc.), and all the shards write to the same ./time/grid root.
+
+Running multiple models in parallel
+*********************************
+
+When running with multiple models (-m flag), the models can be run concurrently using the flag:
+
+    * -w, --model_workers (default 0, runs the models one after the other in the target directory)
+
+Each model is run in its own work tree in ./sweep (e.g. ./sweep/model1/run, ./sweep/model1/model, ./sweep/model1/time and ./sweep/model1/loc),
+using copies of the control files in ./run with the model, time and loc paths changed, so the models do not overwrite each other's files.
+The location files from all the models are listed in ./loc/models_index.csv
+
+Running NLLoc in parallel
+*********************************
+
+The events in the observation file can be located by several NLLoc processes at once using the flag:
+
+    * -e, --event_shards (default 1)
+
+The observation file is split on the event boundaries (blank lines) into that many shards (in ./obs/shards), and NLLoc is run for each shard
+concurrently, with the output for each shard in ./loc/shards. The location files are then moved into ./loc, with the summary files merged,
+so the output is the same as running a single NLLoc process.
+
+Incremental relocation
+*********************************
+
+Using the flag:
+
+    * -i, --incremental
+
+only the events in the observation file that are new or have changed since the last run are located. Each event is fingerprinted (a hash of its
+observation lines), and the fingerprints of the located events are kept in a manifest file next to the location files (e.g. ./loc/obs.manifest.json),
+with the output file root of each event (matched using the picks in the event hypocentre files) and a hash of the grid and NLLoc control inputs.
+If the control inputs change, all the events are relocated. The new event files are moved into ./loc, the location files of events that have
+changed or been removed from the observation file are deleted, and the summary hypocentre and scatter files are rebuilt from the current events.
+
+Caching the model and time grids
+*********************************
+
+The Vel2Grid and Grid2Time outputs can be cached between runs using the flag:
+
+    * -c, --grid_cache (path to the cache directory)
+
+The grids are stored in the cache under a hash of the Vel2Grid and Grid2Time control file lines that change the grids, including the contents of the
+INCLUDEd model and station files (but not the output paths, or any NLLoc lines if a single nlloc_control.in file is used). If the grids for the same inputs are already in the cache, Vel2Grid and Grid2Time are not run, and the cached grids are
+hard linked (or symbolically linked if a hard link is not possible) into the ./model and ./time folders.
+
 Running on a cluster
 *********************************
 
@@ -105,7 +187,8 @@ It is also possible to run this code on a cluster using qsub and pyqsub. This ca
 
     * -q, --qsub, --pbs
 
-This runs using a set of default parameters, however it is also possible to adjust these parameters using commandline flags (use -h flag for help and usage)
+This runs using a set of default parameters, however it is also possible to adjust these parameters using commandline flags (use -h flag with -q for help and usage).
+pyqsub is only imported when the -q flag is given, so it is not needed to run pyNLLoc locally.
 
 
 
@@ -152,8 +235,8 @@ try:
     _ARGPARSE=True
 except:
     _ARGPARSE=False
-import optparse,os,glob,stat,sys,shutil,subprocess,textwrap
-import pyqsub#python module for cluster job submission using qsub.
+import optparse,os,glob,stat,sys,shutil,subprocess,textwrap,hashlib,fnmatch,struct,json,contextlib
+from multiprocessing.pool import ThreadPool
 def is_path(string):
     if type(string)==list:
         for i,x in enumerate(string):
@@ -206,11 +289,13 @@ def _make_folders(target='.'):
     except OSError:
         pass
     #Move files
-    Data=[]
+    fobs=open('obs'+os.path.sep+'obs.out','w')
     for data_file in glob.glob('*.out'):
-        Data.extend(open(data_file).readlines())
-        Data.append('\n')
-    open('obs'+os.path.sep+'obs.out','w').write(''.join(Data))
+        fdata=open(data_file)
+        shutil.copyfileobj(fdata,fobs)
+        fdata.close()
+        fobs.write('\n')
+    fobs.close()
     controlFiles=glob.glob('*.in')
     controlFiles.extend(glob.glob('*.vel'))
     controlFiles.extend(glob.glob('*.mod'))
@@ -300,10 +385,10 @@ def _check_control_files(CWD,options=False,model_name=False):
         control_file='run/nlloc_control.in'
     else:
         raise ValueError('Missing control File - NLLoc')
-    control=_read_control_file('run/nlloc_control_nlloc.in')
+    control=_read_control_file(control_file)
     for i,line in enumerate(control):
         if 'LOCSIG' in line:
-            control[i]="LOCSIG "+obsFile.split('.')[0]
+            control[i]="LOCSIG "+obsFile.split('.')[0]+'\n'
         if 'LOCFILES' in line:
             if model_name:
                 control[i]='LOCFILES '+CWD+'/obs/'+obsFile+' NLLOC_OBS '+CWD+'/time/grid '+CWD+'/loc/'+obsFile.split('.')[0]+'.'+os.path.splitext(os.path.split(model_name)[1])[0]+' 0\n'
@@ -349,95 +434,938 @@ def _read_control_file(filename):
     control=fcontrol.readlines()
     fcontrol.close()
     return control
+def _shard_control_file(control_file,shards=1):
+    """Splits the stations in a Grid2Time control file into shards, writing a control file for each shard
+
+    The GTSRCE lines in the control file and any INCLUDEd files are split between the shards. Every INCLUDEd file
+    (not just the station files) is inlined into each shard control file, replacing the INCLUDE line.
 
-def _run_nlloc(options=False):
+    Args
+        control_file: str control file path
+
+    Keyword Args
+        shards: int number of shards
+
+    Returns
+        list: list of shard control file paths (the control file if it is not split)
+    """
+    if shards<=1:
+        return [control_file]
+    control=[]
+    stations=[]
+    for line in _read_control_file(control_file):
+        lines=[line]
+        if line.split() and line.split()[0]=='INCLUDE':
+            lines=_read_control_file(line.split()[1])
+            if lines:
+                lines[-1]=lines[-1].rstrip('\n')+'\n'
+        for included_line in lines:
+            if included_line.split() and included_line.split()[0]=='GTSRCE':
+                stations.append(included_line)
+            else:
+                control.append(included_line)
+    if len(stations)<=1:
+        return [control_file]
+    control_files=[]
+    for i in range(min(shards,len(stations))):
+        shard_file=os.path.splitext(control_file)[0]+'.shard'+str(i)+'.in'
+        _write_control_file(control+stations[i::shards],shard_file)
+        control_files.append(shard_file)
+    return control_files
+
+def _report_stage(report,name):
+    """Gets a context manager to record an in-process stage in the report (or a null context manager if there is no report)"""
+    if report is None:
+        return contextlib.nullcontext()
+    return report.stage(name)
+def _run_nlloc(options=False,report=None):
     """Runs the NonLinLoc programs in the target directory. Needs to be preceded by a call to _setup.
 
     Keyword Args
         options: dict of command line options
+        report: RunReport to record the stages in
+
+    Returns
+        list: list of StageResult objects for the programs run
     """
     if options and options['models']:
         #Loop over models
         models=glob.glob(os.path.splitext(options['models'])[0]+'*.mod')
+        if options.get('model_workers',0):
+            results=[]
+            for model_name,work,error,model_results in _run_models(models,options,report):
+                results.extend(model_results)
+            return results
+        results=[]
         for model in models:
             print ('Runing model: '+model)
-            _check_control_files('.',options,model_name=model)
+            with _report_stage(report,'control'):
+                _check_control_files('.',options,model_name=model)
             options['models']=False
-            _run_nlloc(options)
+            results.extend(_run_nlloc(options,report))
+        return results
+    else:
+        return _run_programs('run',options,report)
+def _run_programs(run_path='run',options=False,report=None):
+    """Runs the NonLinLoc programs using the control files in the run path
+
+    Keyword Args
+        run_path: str path to the control files
+        options: dict of command line options
+        report: RunReport to record the stages in
+
+    Returns
+        list: list of StageResult objects for the programs run
+    """
+    results=[]
+    def add_results(stage_results):
+        results.extend(stage_results)
+        if report is not None:
+            report.add_results(stage_results)
+    grid_cache=False
+    if options:
+        grid_cache=options.get('grid_cache',False)
+    if grid_cache:
+        key=_grid_cache_key(run_path)
+    if grid_cache and _link_cached_grids(grid_cache,key,run_path):
+        print ('Using cached grids: '+os.path.join(grid_cache,key))
     else:
-        Vel2Grid("run/nlloc_control_vel2grid.in")
-        Grid2Time("run/nlloc_control_grid2time_P.in")
-        Grid2Time("run/nlloc_control_grid2time_S.in")
-        NLLoc("run/nlloc_control_nlloc.in")
-        if options and not options['NoScatter']:
-            Scat2Angle("run/nlloc_control_scat2angle.in")
+        _unlink_grids(run_path)
+        add_results([Vel2Grid(run_path+"/nlloc_control_vel2grid.in")])
+        if results[-1].returncode:
+            print ('Vel2Grid failed, not running Grid2Time, NLLoc or Scat2Angle')
+            return results
+        shards=1
+        processes=2
+        if options:
+            shards=options.get('shards',1) or 1
+            processes=options.get('processes',2) or 2
+        control_files=_shard_control_file(run_path+"/nlloc_control_grid2time_P.in",shards)
+        control_files.extend(_shard_control_file(run_path+"/nlloc_control_grid2time_S.in",shards))
+        add_results(Grid2Times(control_files,processes))
+        if any([result.returncode for result in results]):
+            print ('Grid2Time failed, not running NLLoc or Scat2Angle')
+            return results
+        if grid_cache:
+            _store_cached_grids(grid_cache,key,run_path)
+    event_shards=1
+    if options:
+        event_shards=options.get('event_shards',1) or 1
+    if options and options.get('incremental',False):
+        add_results(NLLocIncremental(run_path+"/nlloc_control_nlloc.in",_grid_cache_key(run_path),event_shards))
+    elif event_shards>1:
+        add_results(NLLocShards(run_path+"/nlloc_control_nlloc.in",event_shards))
+    else:
+        add_results([NLLoc(run_path+"/nlloc_control_nlloc.in")])
+    if options and not options['NoScatter']:
+        add_results([Scat2Angle(run_path+"/nlloc_control_scat2angle.in")])
+    return results
+def _grid_roots(run_path='run'):
+    """Gets the output grid file roots from the Vel2Grid and Grid2Time control files
+
+    Keyword Args
+        run_path: str path to the control files
+
+    Returns
+        list: list of (cache folder name, output file root, file pattern) tuples
+    """
+    roots=[]
+    for line in _read_control_file(run_path+'/nlloc_control_vel2grid.in'):
+        if line.split() and line.split()[0]=='VGOUT':
+            roots.append(('model',line.split()[1],'.*'))
+    for phase in ['P','S']:
+        for line in _read_control_file(run_path+'/nlloc_control_grid2time_'+phase+'.in'):
+            if line.split() and line.split()[0]=='GTFILES':
+                roots.append(('time',line.split()[2],'.'+line.split()[3]+'.*'))
+    return roots
+def _grid_cache_key(run_path='run'):
+    """Calculates the cache key for the Vel2Grid and Grid2Time outputs
+
+    The key is a hash of the control file lines that change the grids (CONTROL, TRANS, VGTYPE, VGGRID, the velocity
+    model lines, the GTFILES phase and flags, GTMODE, GTSRCE and GT_PLFD), with the contents of any INCLUDEd files
+    (e.g. the model and station files). Other lines (e.g. the output paths, or the NLLoc LOC lines in the control
+    files split from a single nlloc_control.in file) are not included, so the same inputs in different target
+    directories have the same key.
+
+    Keyword Args
+        run_path: str path to the control files
+
+    Returns
+        str: hexadecimal hash of the control inputs
+    """
+    keywords=['CONTROL','TRANS','VGTYPE','VGGRID','LAYER','VERTEX','EDGE','POLYGON2','2DTO3DTRANS','GTFILES','GTMODE','GTSRCE','GT_PLFD','INCLUDE']
+    key=hashlib.sha1()
+    for control_file in ['nlloc_control_vel2grid.in','nlloc_control_grid2time_P.in','nlloc_control_grid2time_S.in']:
+        key.update(control_file.encode('utf-8'))
+        for line in _read_control_file(run_path+'/'+control_file):
+            words=line.split()
+            if not words or words[0] not in keywords:
+                continue
+            if words[0]=='GTFILES':
+                words=words[:1]+words[3:]
+            elif words[0]=='INCLUDE':
+                included=open(words[1],'rb')
+                for block in iter(lambda:included.read(1024**2),b''):
+                    key.update(block)
+                included.close()
+                words=words[:1]
+            key.update((' '.join(words)+'\n').encode('utf-8'))
+    return key.hexdigest()
+def _link_file(source,destination):
+    """Hard links the source file to the destination (or symbolically links it if a hard link is not possible), replacing any existing file"""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source,destination)
+    except (OSError,AttributeError):
+        os.symlink(os.path.abspath(source),destination)
+def _unlink_grids(run_path='run'):
+    """Removes any linked (e.g. from the grid cache) model and time grids, so they are not overwritten in place
+
+    Keyword Args
+        run_path: str path to the control files
+    """
+    for folder,root,pattern in _grid_roots(run_path):
+        for grid_file in glob.glob(root+pattern):
+            if os.path.islink(grid_file) or os.stat(grid_file).st_nlink>1:
+                os.remove(grid_file)
+def _link_cached_grids(grid_cache,key,run_path='run'):
+    """Links the cached grids into the model and time folders
+
+    Args
+        grid_cache: str grid cache directory
+        key: str cache key (from _grid_cache_key)
+
+    Keyword Args
+        run_path: str path to the control files
+
+    Returns
+        bool: True if the grids were in the cache, otherwise False
+    """
+    cache_path=os.path.join(grid_cache,key)
+    if not os.path.isdir(cache_path):
+        return False
+    for folder,root,pattern in _grid_roots(run_path):
+        for cached_file in glob.glob(os.path.join(cache_path,folder,'*')):
+            suffix=os.path.split(cached_file)[1]
+            if fnmatch.fnmatch(suffix,pattern):
+                _link_file(cached_file,root+suffix)
+    return True
+def _store_cached_grids(grid_cache,key,run_path='run'):
+    """Stores the model and time grids in the grid cache
+
+    The grids are linked (or copied if they cannot be hard linked) into a temporary folder, which is then renamed to the cache key,
+    so incomplete cache entries are not used.
+
+    Args
+        grid_cache: str grid cache directory
+        key: str cache key (from _grid_cache_key)
+
+    Keyword Args
+        run_path: str path to the control files
+    """
+    cache_path=os.path.join(grid_cache,key)
+    if os.path.isdir(cache_path):
+        return
+    tmp_path=cache_path+'.tmp'+str(os.getpid())
+    for folder,root,pattern in _grid_roots(run_path):
+        try:
+            os.makedirs(os.path.join(tmp_path,folder))
+        except OSError:
+            pass
+        for grid_file in glob.glob(root+pattern):
+            destination=os.path.join(tmp_path,folder,grid_file[len(root):])
+            try:
+                os.link(grid_file,destination)
+            except (OSError,AttributeError):
+                shutil.copy2(grid_file,destination)
+    try:
+        os.rename(tmp_path,cache_path)
+    except OSError:
+        #Stored by another run
+        shutil.rmtree(tmp_path,ignore_errors=True)
+def _make_model_tree(CWD,model_name,options=False):
+    """Makes an isolated work tree for a model, with the control files from the run directory changed to use the work tree paths
+
+    The work tree is in ./sweep/model (where model is the model file name without the extension), with run, model, time and loc folders.
+    The control files in ./run must have been checked (see _check_control_files) before calling this.
+
+    Args
+        CWD: str current directory path
+        model_name: str model file path
+
+    Keyword Args
+        options: dict command line parser options
+
+    Returns
+        str: work tree path
+    """
+    model=os.path.splitext(os.path.split(model_name)[1])[0]
+    work=CWD+os.path.sep+'sweep'+os.path.sep+model
+    for folder in ['run','model','time','loc']:
+        try:
+            os.makedirs(work+os.path.sep+folder)
+        except OSError:
+            pass
+    obsFile=glob.glob('obs/*.out')[0].split('/')[1]
+    loc_root=work+'/loc/'+obsFile.split('.')[0]+'.'+model
+    #Vel2Grid
+    control=_read_control_file('run/nlloc_control_vel2grid.in')
+    for i,line in enumerate(control):
+        if 'VGOUT' in line:
+            control[i]="VGOUT "+work+'/model/velocity\n'
+        if 'INCLUDE' in line:
+            control[i]='INCLUDE '+os.path.abspath(model_name)+'\n'
+    _write_control_file(control,work+'/run/nlloc_control_vel2grid.in')
+    #Grid2Time
+    for phase in ['P','S']:
+        control=_read_control_file('run/nlloc_control_grid2time_'+phase+'.in')
+        for i,line in enumerate(control):
+            if 'GTFILES' in line:
+                control[i]="GTFILES "+work+'/model/velocity '+work+'/time/grid '+phase+' 0\n'
+        _write_control_file(control,work+'/run/nlloc_control_grid2time_'+phase+'.in')
+    #NLLoc
+    control=_read_control_file('run/nlloc_control_nlloc.in')
+    for i,line in enumerate(control):
+        if 'LOCFILES' in line:
+            control[i]='LOCFILES '+CWD+'/obs/'+obsFile+' NLLOC_OBS '+work+'/time/grid '+loc_root+' 0\n'
+    _write_control_file(control,work+'/run/nlloc_control_nlloc.in')
+    #Scat2Angle
+    if options and not options['NoScatter']:
+        _write_control_file([work+'/time/grid\n',loc_root+'\n'],work+'/run/nlloc_control_scat2angle.in')
+    return work
+def _run_model(args):
+    """Runs the NonLinLoc programs in a model work tree
+
+    Args
+        args: tuple of model file path, work tree path, command line options and RunReport (or None)
+
+    Returns
+        (str,str,str,list): tuple of model file path, work tree path, error message (empty if no errors) and list of StageResult objects
+    """
+    model_name,work,options,report=args
+    print ('Runing model: '+model_name)
+    try:
+        results=_run_programs(work+os.path.sep+'run',options,report)
+    except Exception as e:
+        return model_name,work,str(e),[]
+    failed=[result.name for result in results if result.returncode]
+    if len(failed):
+        return model_name,work,', '.join(failed)+' returned non-zero exit status',results
+    return model_name,work,'',results
+def _run_models(models,options,report=None):
+    """Runs the NonLinLoc programs for each model concurrently, in isolated work trees
+
+    The number of models run at once is set by the model_workers option. Each model is run in a worker thread, which
+    starts the NonLinLoc programs as asyncio subprocesses (this needs the Python 3.8 or later child watcher). The location
+    files for all the models are listed in loc/models_index.csv
+
+    Args
+        models: list of model file paths
+        options: dict of command line options
+
+    Keyword Args
+        report: RunReport to record the stages in
+
+    Returns
+        list: list of (model file path, work tree path, error message, list of StageResult objects) tuples
+    """
+    CWD=os.getcwd()
+    args=[(model,_make_model_tree(CWD,model,options),options,report) for model in models]
+    pool=ThreadPool(max(1,min(options.get('model_workers',1),len(args))))
+    try:
+        results=pool.map(_run_model,args)
+    finally:
+        pool.close()
+        pool.join()
+    index=['model,work_dir,loc_file\n']
+    for model_name,work,error,model_results in results:
+        if error:
+            print ('Model: '+model_name+' failed: '+error)
+        for loc_file in sorted(glob.glob(work+os.path.sep+'loc'+os.path.sep+'*')):
+            index.append(','.join([model_name,work,loc_file])+'\n')
+    open('loc'+os.path.sep+'models_index.csv','w').write(''.join(index))
+    return results
+def _log_file(program,control_file):
+    """Gets the log file path for running a program with a control file
+
+    The log files are in the log folder next to the control file folder (e.g. ./log for ./run).
+
+    Args
+        program: str program name
+        control_file: str control file path
+
+    Returns
+        str: log file path
+    """
+    run_path=os.path.split(os.path.abspath(control_file))[0]
+    return os.path.join(os.path.split(run_path)[0],'log',program+'.'+os.path.splitext(os.path.split(control_file)[1])[0]+'.log')
+def _run_program(program,control_files,processes=None):
+    """Runs a NonLinLoc program concurrently for each control file
+
+    The output is streamed to the log files (see _log_file), and the end of the output is printed when each program finishes.
+
+    Args
+        program: str program name
+        control_files: list of control file paths
+
+    Keyword Args
+        processes: int maximum number of processes to run at once (default is to run them all at once)
+
+    Returns
+        list: list of StageResult objects
+    """
+    try:
+        from .StageRunner import run_stages
+    except:
+        from StageRunner import run_stages
+    results=run_stages([[program,control_file] for control_file in control_files],[_log_file(program,control_file) for control_file in control_files],processes)
+    for control_file,result in zip(control_files,results):
+        print (program+' '+control_file+' (return code: '+str(result.returncode)+', time: '+'%.1f'%result.elapsed+' s, log: '+result.log_file+')\n\n'+result.output)
+    return results
 def Vel2Grid(control_file="run/nlloc_control_vel2grid.in"):
     """Run Vel2Grid
 
     Args
         control_file: str control file path
+
+    Returns
+        StageResult: result with the return code, timing and output tail
     """
-    process=subprocess.Popen(['Vel2Grid',control_file],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    out,err=process.communicate()
-    print ('Vel2Grid\n\n'+out+str(err))
+    return _run_program('Vel2Grid',[control_file])[0]
 def Grid2Time(control_file="run/nlloc_control_grid2time.in"):
     """Run Grid2Time
 
     Args
         control_file: str control file path
+
+    Returns
+        StageResult: result with the return code, timing and output tail
     """
-    process=subprocess.Popen(['Grid2Time',control_file],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    out,err=process.communicate()
-    print ('Grid2Time\n\n'+out+str(err))
+    return _run_program('Grid2Time',[control_file])[0]
+def Grid2Times(control_files,processes=2):
+    """Run Grid2Time concurrently for several control files (e.g. the P and S phases or station shards)
+
+    Args
+        control_files: list of control file paths
+
+    Keyword Args
+        processes: int maximum number of Grid2Time processes to run at once
+
+    Returns
+        list: list of StageResult objects
+    """
+    return _run_program('Grid2Time',control_files,processes)
 def NLLoc(control_file="run/nlloc_control_nlloc.in"):
     """Run NLLoc
 
     Args
         control_file: str control file path
+
+    Returns
+        StageResult: result with the return code, timing and output tail
+    """
+    return _run_program('NLLoc',[control_file])[0]
+def _shard_obs_file(obs_file,shards,shard_path):
+    """Splits the observation file into shards on the event boundaries (blank lines)
+
+    The events are split into contiguous blocks, so the events in the shards are in the same order as the observation file.
+
+    Args
+        obs_file: str observation file path
+        shards: int number of shards
+        shard_path: str path for the shard observation files
+
+    Returns
+        list: list of shard observation file paths
+    """
+    #Count events
+    n_events=0
+    in_event=False
+    for line in open(obs_file):
+        if line.strip() and not in_event:
+            n_events+=1
+        in_event=bool(line.strip())
+    shards=max(1,min(shards,n_events))
+    try:
+        os.makedirs(shard_path)
+    except OSError:
+        pass
+    root=os.path.join(shard_path,os.path.splitext(os.path.split(obs_file)[1])[0])
+    shard_files=[root+'.shard'+str(i)+'.out' for i in range(shards)]
+    fid=open(shard_files[0],'w')
+    shard=0
+    event=0
+    in_event=False
+    for line in open(obs_file):
+        if line.strip() and not in_event:
+            #New event
+            if event>=(shard+1)*n_events/float(shards):
+                fid.close()
+                shard+=1
+                fid=open(shard_files[shard],'w')
+            event+=1
+        in_event=bool(line.strip())
+        fid.write(line)
+    fid.close()
+    return shard_files
+def _merge_scatter_files(scatter_files,filename):
+    """Merges NonLinLoc scatter files, adding the number of samples in the header
+
+    Args
+        scatter_files: list of scatter file paths
+        filename: str merged scatter file path
+    """
+    n_samples=0
+    header=None
+    for scatter_file in scatter_files:
+        fid=open(scatter_file,'rb')
+        file_header=fid.read(16)
+        fid.close()
+        if header is None:
+            header=file_header
+        n_samples+=struct.unpack('i',file_header[:4])[0]
+    fid=open(filename,'wb')
+    fid.write(struct.pack('i',n_samples)+header[4:])
+    for scatter_file in scatter_files:
+        shard_fid=open(scatter_file,'rb')
+        shard_fid.seek(16)
+        shutil.copyfileobj(shard_fid,fid)
+        shard_fid.close()
+    fid.close()
+def _move_hyp_file(source,destination,shard_root,loc_root,append=False):
+    """Moves (or appends) a hypocentre file, changing the shard output root in the NLLOC header lines to the location output root
+
+    Args
+        source: str shard hypocentre file path
+        destination: str hypocentre file path
+        shard_root: str shard output file root
+        loc_root: str location output file root
+
+    Keyword Args
+        append: bool flag to append to the destination file
+    """
+    fid=open(destination,'a' if append else 'w')
+    for line in open(source):
+        if line.startswith('NLLOC '):
+            line=line.replace('"'+shard_root,'"'+loc_root,1)
+        fid.write(line)
+    fid.close()
+    os.remove(source)
+def _merge_loc_shards(shard_roots,loc_root):
+    """Merges the NLLoc output files from the shards into the location output root
+
+    The event location files are moved into the location folder (removing any existing angle scatter files for replaced scatter files).
+    The summary (.sum.) hypocentre and scatter files are concatenated in shard order, while the other summary files are taken from
+    the first shard and the last event (last.*) files from the last shard. The shard output roots in the hypocentre file NLLOC lines
+    are changed to the location output root, as the shard folders are removed.
+
+    Args
+        shard_roots: list of shard output file roots
+        loc_root: str location output file root
+
+    """
+    loc_path=os.path.split(loc_root)[0]
+    summary_files={}
+    last_files={}
+    for shard_root in shard_roots:
+        shard_path=os.path.split(shard_root)[0]
+        for shard_file in sorted(glob.glob(os.path.join(shard_path,'*'))):
+            name=os.path.split(shard_file)[1]
+            if '.sum.' in name:
+                summary_files.setdefault(name,[]).append((shard_root,shard_file))
+            elif name.startswith('last.'):
+                last_files[name]=(shard_root,shard_file)
+            elif name.endswith('.hyp'):
+                _move_hyp_file(shard_file,os.path.join(loc_path,name),shard_root,loc_root)
+            else:
+                if name.endswith('.scat'):
+                    for angle_file in [name+'angle',name+'angle.bin']:
+                        if os.path.exists(os.path.join(loc_path,angle_file)):
+                            os.remove(os.path.join(loc_path,angle_file))
+                shutil.move(shard_file,os.path.join(loc_path,name))
+    for name,shard_files in summary_files.items():
+        if name.endswith('.hyp'):
+            for i,(shard_root,shard_file) in enumerate(shard_files):
+                _move_hyp_file(shard_file,os.path.join(loc_path,name),shard_root,loc_root,append=i>0)
+        elif name.endswith('.scat'):
+            _merge_scatter_files([shard_file for shard_root,shard_file in shard_files],os.path.join(loc_path,name))
+        else:
+            shutil.move(shard_files[0][1],os.path.join(loc_path,name))
+    for name,(shard_root,shard_file) in last_files.items():
+        if name.endswith('.hyp'):
+            _move_hyp_file(shard_file,os.path.join(loc_path,name),shard_root,loc_root)
+        else:
+            shutil.move(shard_file,os.path.join(loc_path,name))
+    for shard_root in shard_roots:
+        shutil.rmtree(os.path.split(shard_root)[0],ignore_errors=True)
+    try:
+        os.rmdir(os.path.join(loc_path,'shards'))
+    except OSError:
+        pass
+def NLLocShards(control_file="run/nlloc_control_nlloc.in",shards=2):
+    """Run NLLoc concurrently over shards of the observation file
+
+    The observation file (from the LOCFILES line in the control file) is split into shards on the event boundaries (see _shard_obs_file),
+    with a control file for each shard, and the shard outputs are merged into the location output root (see _merge_loc_shards).
+    The outputs of any failed shards are not merged, and are left in the shard folders.
+
+    Args
+        control_file: str control file path
+
+    Keyword Args
+        shards: int number of shards (and NLLoc processes)
+
+    Returns
+        list: list of StageResult objects
+
+    Raises
+        ValueError: if there is no LOCFILES line in the control file
+    """
+    control=_read_control_file(control_file)
+    locfiles=False
+    for i,line in enumerate(control):
+        if line.split() and line.split()[0]=='LOCFILES':
+            locfiles=line.split()
+            locfiles_index=i
+    if not locfiles:
+        raise ValueError('Missing LOCFILES line in control file: '+control_file)
+    obs_file=locfiles[1]
+    loc_root=locfiles[4]
+    obs_files=_shard_obs_file(obs_file,shards,os.path.join(os.path.split(obs_file)[0],'shards'))
+    control_files=[]
+    shard_roots=[]
+    for i,shard_obs_file in enumerate(obs_files):
+        shard_root=os.path.join(os.path.split(loc_root)[0],'shards',str(i),os.path.split(loc_root)[1])
+        try:
+            os.makedirs(os.path.split(shard_root)[0])
+        except OSError:
+            pass
+        control[locfiles_index]=' '.join(locfiles[:1]+[shard_obs_file]+locfiles[2:4]+[shard_root]+locfiles[5:])+'\n'
+        shard_control_file=os.path.splitext(control_file)[0]+'.shard'+str(i)+'.in'
+        _write_control_file(control,shard_control_file)
+        control_files.append(shard_control_file)
+        shard_roots.append(shard_root)
+    results=_run_program('NLLoc',control_files)
+    for shard_root,result in zip(shard_roots,results):
+        if result.returncode:
+            print ('NLLoc shard failed, not merging the outputs in: '+os.path.split(shard_root)[0])
+    _merge_loc_shards([shard_root for shard_root,result in zip(shard_roots,results) if not result.returncode],loc_root)
+    return results
+def _iter_events(obs_file):
+    """Iterates over the events (separated by blank lines) in an observation file
+
+    Args
+        obs_file: str observation file path
+
+    Returns
+        generator: generator of lists of the observation lines for each event
+    """
+    event=[]
+    for line in open(obs_file):
+        if line.strip():
+            event.append(line)
+        elif event:
+            yield event
+            event=[]
+    if event:
+        yield event
+def _event_fingerprint(event):
+    """Calculates the fingerprint (hash of the observation lines, ignoring whitespace at the start and end of the lines) of an event
+
+    Args
+        event: list of the observation lines for the event
+
+    Returns
+        str: hexadecimal hash of the event observations
+    """
+    return hashlib.sha1(''.join([line.strip()+'\n' for line in event]).encode('utf-8')).hexdigest()
+def _pick_keys(lines):
+    """Gets the picks from NLLOC_OBS observation lines (or the lines in a hypocentre file PHASE section)
+
+    Args
+        lines: list of observation lines
+
+    Returns
+        set: set of (station, phase, date, hour minute, seconds) tuples, with the seconds rounded to 1 ms
+    """
+    keys=set()
+    for line in lines:
+        words=line.split()
+        if len(words)<9 or words[0].startswith('#'):
+            continue
+        try:
+            keys.add((words[0],words[4],words[6],words[7],round(float(words[8]),3)))
+        except ValueError:
+            pass
+    return keys
+def _read_hyp_phases(hyp_file):
+    """Reads the lines in the PHASE section of a NonLinLoc hypocentre file (only the first event in the file is read)"""
+    lines=[]
+    in_phase=False
+    for line in open(hyp_file):
+        if line.startswith('END_PHASE'):
+            break
+        if in_phase:
+            lines.append(line)
+        elif line.startswith('PHASE '):
+            in_phase=True
+    return lines
+def _match_event_roots(root,events):
+    """Matches the event hypocentre files for a NLLoc output root to the events they were located from, using the picks
+
+    Each hypocentre file is matched to the event with the most picks in common.
+
+    Args
+        root: str NLLoc output file root
+        events: dict of event fingerprints and observation lines
+
+    Returns
+        dict: dict of event fingerprints and event output file roots (e.g. root.date.time.grid0.loc)
+    """
+    pick_events={}
+    for fingerprint,event in events.items():
+        for key in _pick_keys(event):
+            pick_events.setdefault(key,[]).append(fingerprint)
+    roots={}
+    for hyp_file in sorted(glob.glob(root+'.*.hyp')):
+        if '.sum.' in os.path.split(hyp_file)[1]:
+            continue
+        matches={}
+        for key in _pick_keys(_read_hyp_phases(hyp_file)):
+            for fingerprint in pick_events.get(key,[]):
+                matches[fingerprint]=matches.get(fingerprint,0)+1
+        if matches:
+            roots[max(sorted(matches),key=lambda fingerprint:matches[fingerprint])]=hyp_file[:-len('.hyp')]
+    return roots
+def _write_loc_summary(loc_root,event_roots):
+    """Writes the summary hypocentre and scatter files (loc_root.sum.grid0.loc.hyp/.scat) from the event location files
+
+    Any angle scatter files for the summary scatter file are removed, so that they are recalculated.
+
+    Args
+        loc_root: str location output file root
+        event_roots: list of event output file roots (e.g. loc_root.date.time.grid0.loc), in summary order
+    """
+    summary_root=loc_root+'.sum.grid0.loc'
+    fid=open(summary_root+'.hyp','w')
+    for event_root in event_roots:
+        if os.path.exists(event_root+'.hyp'):
+            event_fid=open(event_root+'.hyp')
+            shutil.copyfileobj(event_fid,fid)
+            event_fid.close()
+    fid.close()
+    scatter_files=[event_root+'.scat' for event_root in event_roots if os.path.exists(event_root+'.scat')]
+    for summary_file in [summary_root+'.scat',summary_root+'.scatangle',summary_root+'.scatangle.bin']:
+        if os.path.exists(summary_file):
+            os.remove(summary_file)
+    if scatter_files:
+        _merge_scatter_files(scatter_files,summary_root+'.scat')
+def NLLocIncremental(control_file="run/nlloc_control_nlloc.in",grid_key='',shards=1):
+    """Run NLLoc for the new or changed events in the observation file
+
+    The fingerprints of the located events are kept in a manifest (loc_root.manifest.json) with the output file root of each event
+    (see _match_event_roots) and a hash of the grid key and the control file, so only events that have not been located with the
+    current grids and control are located. The new events are located to a temporary output root, and the outputs are merged into
+    the location output root (see _merge_loc_shards). The location files of changed or removed events are deleted, and the summary
+    hypocentre and scatter files are rebuilt from the current events (see _write_loc_summary). If the manifest cannot be read
+    (e.g. it is truncated), all the events are located.
+
+    Args
+        control_file: str control file path
+
+    Keyword Args
+        grid_key: str key for the grids used (e.g. from _grid_cache_key)
+        shards: int number of shards (and NLLoc processes) to use
+
+    Returns
+        list: list of StageResult objects
+
+    Raises
+        ValueError: if there is no LOCFILES line in the control file
     """
-    process=subprocess.Popen(['NLLoc',control_file],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    out,err=process.communicate()
-    print ('NLLoc\n\n'+out+str(err))
+    results=[]
+    control=_read_control_file(control_file)
+    context=hashlib.sha1(grid_key.encode('utf-8'))
+    locfiles=False
+    for i,line in enumerate(control):
+        if line.split() and line.split()[0]=='LOCFILES':
+            locfiles=line.split()
+            locfiles_index=i
+        else:
+            context.update(line.encode('utf-8'))
+    if not locfiles:
+        raise ValueError('Missing LOCFILES line in control file: '+control_file)
+    context=context.hexdigest()
+    obs_file=locfiles[1]
+    loc_root=locfiles[4]
+    manifest_file=loc_root+'.manifest.json'
+    previous={}
+    located={}
+    if os.path.exists(manifest_file):
+        fid=open(manifest_file)
+        try:
+            manifest=json.load(fid)
+        except ValueError:
+            #Truncated or corrupt manifest, so locate all the events
+            manifest={}
+        fid.close()
+        if isinstance(manifest,dict) and isinstance(manifest.get('events'),dict):
+            previous=manifest['events']
+            if manifest.get('context')==context:
+                located=dict(previous)
+    #Write new events
+    obs_path=os.path.join(os.path.split(obs_file)[0],'incremental')
+    try:
+        os.makedirs(obs_path)
+    except OSError:
+        pass
+    new_obs_file=os.path.join(obs_path,os.path.split(obs_file)[1])
+    fid=open(new_obs_file,'w')
+    current=[]
+    new={}
+    for event in _iter_events(obs_file):
+        fingerprint=_event_fingerprint(event)
+        current.append(fingerprint)
+        if fingerprint not in located and fingerprint not in new:
+            new[fingerprint]=event
+            fid.write(''.join(event)+'\n')
+    fid.close()
+    print ('NLLoc: '+str(len(new))+' new or changed events of '+str(len(current)))
+    #Delete the location files of the changed or removed events
+    current_roots=set([located[fingerprint] for fingerprint in current if fingerprint in located])
+    stale_roots=set([event_root for fingerprint,event_root in previous.items() if event_root and event_root not in current_roots])
+    for event_root in stale_roots:
+        for loc_file in glob.glob(event_root+'.*'):
+            os.remove(loc_file)
+    if len(new):
+        new_root=os.path.join(os.path.split(loc_root)[0],'incremental',os.path.split(loc_root)[1])
+        try:
+            os.makedirs(os.path.split(new_root)[0])
+        except OSError:
+            pass
+        control[locfiles_index]=' '.join(locfiles[:1]+[new_obs_file]+locfiles[2:4]+[new_root]+locfiles[5:])+'\n'
+        new_control_file=os.path.splitext(control_file)[0]+'.incremental.in'
+        _write_control_file(control,new_control_file)
+        if shards>1:
+            results=NLLocShards(new_control_file,shards)
+        else:
+            results=[NLLoc(new_control_file)]
+        failed=any([result.returncode for result in results])
+        if shards>1 or not failed:
+            #Only the successful shards are merged into the new root
+            event_roots=_match_event_roots(new_root,new)
+            _merge_loc_shards([new_root],loc_root)
+            for fingerprint in new:
+                if event_roots.get(fingerprint):
+                    located[fingerprint]=loc_root+event_roots[fingerprint][len(new_root):]
+                elif not failed:
+                    located[fingerprint]=None
+    #Only keep the current events in the manifest
+    events=dict([(fingerprint,located[fingerprint]) for fingerprint in current if fingerprint in located])
+    if len(new) or stale_roots or events!=previous:
+        event_roots=[]
+        for fingerprint in current:
+            if events.get(fingerprint) and events[fingerprint] not in event_roots:
+                event_roots.append(events[fingerprint])
+        _write_loc_summary(loc_root,event_roots)
+    fid=open(manifest_file+'.tmp','w')
+    json.dump({'context':context,'events':events},fid)
+    fid.close()
+    os.rename(manifest_file+'.tmp',manifest_file)
+    return results
 def Scat2Angle(control_file="run/nlloc_control_scat2angle.in"):
     """Run Scat2Angle
 
     Args
         control_file: str control file path
+
+    Returns
+        StageResult: result with the return code, timing and output tail
     """
-    process=subprocess.Popen(['Scat2Angle',control_file],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    out,err=process.communicate()
-    print ('Scat2Angle\n\n'+out+str(err))
+    return _run_program('Scat2Angle',[control_file])[0]
     
-def _setup(target='.',options=False):   
+def _setup(target='.',options=False,report=None):   
     """Sets up the NonLinLoc directory structure and control files in the target directory. Needs to be called before _run_nlloc.
 
     Keyword Args
         target: str target file directory
         options: dict command line options
+        report: RunReport to record the stages in
     """
     os.chdir(target)
     CWD=os.getcwd()
-    _make_folders(target)
-    _check_control_files(CWD,options)   
-def __run__(target='.',input_args=False):
+    with _report_stage(report,'setup'):
+        _make_folders(target)
+    with _report_stage(report,'control'):
+        _check_control_files(CWD,options)   
+def __run__(target='.',input_args=False,hook=None):
     """Main code for running pyNLLoc
 
     Args
         target - str target directory [default ='.']
         input_args - list of command line flags [default=False] for more information on the command line flags use -h as a flag.
+        hook - function called with the run report record (dict) for each stage [default=None]
+
+    Returns
+        int: exit status (1 if any of the NonLinLoc programs failed, otherwise 0)
+    """
+    return int(any([result.returncode for result in run_pyNLLoc(target,input_args,hook)]))
+def run_pyNLLoc(target='.',input_args=False,hook=None):
+    """Runs pyNLLoc (as __run__), returning the results for the NonLinLoc programs run
+
+    Args
+        target - str target directory [default ='.']
+        input_args - list of command line flags [default=False] for more information on the command line flags use -h as a flag.
+        hook - function called with the run report record (dict) for each stage [default=None]
+
+    Returns
+        list: list of StageResult objects for the programs run (empty if the job is submitted using qsub)
     """
     options,optionsMap=_parser(input_args)
     if options['qsub']:
+        pyqsub=_import_pyqsub(['-q'])
         optionsMap['DataPath']=optionsMap['DATAPATH']
-        return pyqsub.submit(options,optionsMap,__name__)
+        pyqsub.submit(options,optionsMap,__name__)
+        return []
     else:
-        for key in options.keys():
+        for key in list(options.keys()):
             if 'qsub' in key:
                 options.pop(key)
-        _setup(options['DataPath'],options)
-        _run_nlloc(options)
+        try:
+            from .StageRunner import RunReport
+        except:
+            from StageRunner import RunReport
+        report=RunReport(hook)
+        try:
+            _setup(options['DataPath'],options,report)
+            return _run_nlloc(options,report)
+        finally:
+            report.write('pyNLLoc_report')
+            summary=report.summary()
+            print ('pyNLLoc run: wall time: '+'%.1f'%summary['wall_time']+' s, CPU time: '+'%.1f'%summary['cpu_time']+' s, peak RSS: '+'%.1f'%(summary['max_rss']/1024.**2)+' MB')
+
+
+def _import_pyqsub(input_args=False):
+    """Imports pyqsub if the job is to be submitted using qsub (-q, --qsub or --pbs in the command line arguments)
 
+    Keyword Args
+        input_args: list of command line arguments [default is to use sys.argv]
+
+    Returns
+        module: pyqsub module, or None if the job is not to be submitted using qsub
 
+    Raises
+        ImportError: if pyqsub cannot be imported
+    """
+    args=input_args if input_args else sys.argv[1:]
+    if not len([arg for arg in args if arg in ['-q','--qsub','--pbs']]):
+        return None
+    try:
+        import pyqsub#python module for cluster job submission using qsub.
+    except ImportError as e:
+        raise ImportError('pyqsub is required to submit the job using qsub: '+str(e))
+    return pyqsub
 def _parser(input_args=False):
     """Command line parser for pyNLLoc
 
@@ -455,6 +1383,7 @@ def _parser(input_args=False):
     default_pmem=4
     default_walltime="24:00:00"
     default_queue='batch' 
+    pyqsub=_import_pyqsub(input_args)
     optionsMap={}   
     if _ARGPARSE:
         class IndentedHelpFormatterWithNL(argparse.RawDescriptionHelpFormatter):
@@ -516,8 +1445,17 @@ def _parser(input_args=False):
         parser.add_argument("-d","--datapath","--data_path",help='Target Path use for the location, optional but must be specified either as a positional argument or as an optional argument (see -d below) If not specified defaults to all current directory',type=is_path,dest='DATAPATH',default=False)
         parser.add_argument("-n","--noscatter","--no_scatter",help='Do not run scatter to angles conversion',action='store_true',dest='NoScatter',default=False)
         parser.add_argument("-m","--models_path","--multiple_models_path",help='Run inversion with multiple models. Model file endings are .mod. [default=False]',dest='models',default=False)
+        parser.add_argument("-w","--model_workers",help='Number of models to run concurrently when running with multiple models, each in its own work tree in ./sweep. If 0, the models are run one after the other in the target directory. [default=0]',type=int,dest='model_workers',default=0)
+        parser.add_argument("-i","--incremental",help='Only locate events that are new or have changed since the last run (using the manifest of located events in the loc folder)',action='store_true',dest='incremental',default=False)
+        parser.add_argument("-e","--event_shards",help='Number of shards to split the observation file events into, running an NLLoc process for each shard concurrently. [default=1]',type=int,dest='event_shards',default=1)
+        parser.add_argument("-c","--grid_cache",help='Directory to cache the Vel2Grid and Grid2Time grids in, so they are not recalculated if the model, stations and grid control lines have not changed. [default=False]',dest='grid_cache',default=False)
+        parser.add_argument("-p","--processes",help='Maximum number of Grid2Time processes to run at once (the P and S phases and any station shards are run concurrently). [default=2]',type=int,dest='processes',default=2)
+        parser.add_argument("-s","--shards","--time_shards",help='Number of shards to split the stations into for each Grid2Time phase. [default=1]',type=int,dest='shards',default=1)
         group=parser.add_argument_group('Cluster',description="\nCommands for using pyNLLoc on a cluster environment using qsub/PBS")
-        group=pyqsub.parser_group(module_name='pyNLLoc',group=group,default_nodes=default_nodes,default_ppn=default_ppn,default_pmem=default_pmem,default_walltime=default_walltime,default_queue=default_queue) 
+        if pyqsub:
+            group=pyqsub.parser_group(module_name='pyNLLoc',group=group,default_nodes=default_nodes,default_ppn=default_ppn,default_pmem=default_pmem,default_walltime=default_walltime,default_queue=default_queue) 
+        else:
+            group.add_argument("-q","--qsub","--pbs",help='Submit the job to the cluster using qsub (requires pyqsub, use -h with -q for the other cluster options)',action='store_true',dest='qsub',default=False)
         for option in parser._actions:
             if len(option.option_strings):
                 i=0
@@ -603,8 +1541,17 @@ def _parser(input_args=False):
         parser.add_option("-d","--datapath","--data_path",help='Target Path use for the location, optional but must be specified either as a positional argument or as an optional argument (see -d below) If not specified defaults to all current directory',dest='DATAPATH',default=False)
         parser.add_option("-n","--noscatter","--no_scatter",help='Do not run scatter to angles conversion',action='store_true',dest='NoScatter',default=False)
         parser.add_option("-m","--models_path","--multiple_models_path",help='Run inversion with multiple models. Model file endings are .mod. [default=False]',dest='models',default=False)
+        parser.add_option("-w","--model_workers",help='Number of models to run concurrently when running with multiple models, each in its own work tree in ./sweep. If 0, the models are run one after the other in the target directory. [default=0]',type=int,dest='model_workers',default=0)
+        parser.add_option("-i","--incremental",help='Only locate events that are new or have changed since the last run (using the manifest of located events in the loc folder)',action='store_true',dest='incremental',default=False)
+        parser.add_option("-e","--event_shards",help='Number of shards to split the observation file events into, running an NLLoc process for each shard concurrently. [default=1]',type=int,dest='event_shards',default=1)
+        parser.add_option("-c","--grid_cache",help='Directory to cache the Vel2Grid and Grid2Time grids in, so they are not recalculated if the model, stations and grid control lines have not changed. [default=False]',dest='grid_cache',default=False)
+        parser.add_option("-p","--processes",help='Maximum number of Grid2Time processes to run at once (the P and S phases and any station shards are run concurrently). [default=2]',type=int,dest='processes',default=2)
+        parser.add_option("-s","--shards","--time_shards",help='Number of shards to split the stations into for each Grid2Time phase. [default=1]',type=int,dest='shards',default=1)
         group=optparse.OptionGroup(parser,'Cluster',description="\nCommands for using pyNLLoc on a cluster environment using qsub/PBS")
-        group=pyqsub.parser_group(module_name='pyNLLoc',group=group,default_nodes=default_nodes,default_ppn=default_ppn,default_pmem=default_pmem,default_walltime=default_walltime,default_queue=default_queue) 
+        if pyqsub:
+            group=pyqsub.parser_group(module_name='pyNLLoc',group=group,default_nodes=default_nodes,default_ppn=default_ppn,default_pmem=default_pmem,default_walltime=default_walltime,default_queue=default_queue) 
+        else:
+            group.add_option("-q","--qsub","--pbs",help='Submit the job to the cluster using qsub (requires pyqsub, use -h with -q for the other cluster options)',action='store_true',dest='qsub',default=False)
         parser.add_option_group(group)    
         for option in parser.option_list:
             optionsMap[option.dest]=option.get_opt_string()
@@ -631,6 +1578,12 @@ def _parser(input_args=False):
             options['DataPath']=is_path(options['DataPath'])
         except ValueError:
             parser.error("Data file: \""+options['DataPath']+"\" does not exist")
+    if options['grid_cache']:
+        options['grid_cache']=os.path.abspath(options['grid_cache'])
+        try:
+            os.makedirs(options['grid_cache'])
+        except OSError:
+            pass
     if options['models']:
         if os.path.isdir(os.path.abspath(os.path.split(options['models'])[0])):
             options['models']=os.path.abspath(os.path.split(options['models'])[0])+os.path.sep+os.path.split(options['models'])[1]
@@ -656,4 +1609,4 @@ def _parser(input_args=False):
             walltime=60.*60.*int(options['qsub_walltime'].split(':')[0])+60.*int(options['qsub_walltime'].split(':')[1])+int(options['qsub_walltime'].split(':')[2])
     return options,optionsMap
 if __name__=='__main__':
-    __run__()
+    sys.exit(__run__())
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+"""check_orchestration
+***********************
+
+Checks of the pyNLLoc orchestration (__core__), using the stub NonLinLoc programs in stub_nlloc.py and the synthetic projects from
+run_orchestration.py, so NonLinLoc does not need to be installed. The checks are:
+
+    ============  ======================================================================================================
+    Check         Description
+    ============  ======================================================================================================
+    grid_cache    Two target directories with the same inputs have the same grid cache key, and the second run uses the
+                  cached grids (Vel2Grid and Grid2Time are not run), with separate control files and with a single
+                  nlloc_control.in file (with a different LOCSEARCH line in the second directory)
+    loc_roots     The NLLOC lines in the location hypocentre files point to the location output root (and the scatter files
+                  exist) after running NLLoc over event shards (-e) and incrementally (-i)
+    incremental   After changing a pick in one event and removing another, an incremental run (-i) only locates the changed
+                  event, deletes the location files of the changed and removed events, and rebuilds the summary files,
+                  and a truncated manifest is ignored (all the events are located again)
+    failures      A failed Grid2Time run stops the pipeline before NLLoc and gives exit status 1, and the outputs of a failed
+                  NLLoc event shard are not merged
+    ============  ======================================================================================================
+
+The checks are run from the command line::
+
+    $~ python check_orchestration.py [check ...]
+
+and the exit status is the number of failed checks.
+"""
+import os,sys,glob,struct,json,shutil,tempfile,traceback
+BENCHMARK_PATH=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(BENCHMARK_PATH))
+sys.path.insert(0,BENCHMARK_PATH)
+import __core__
+from run_orchestration import make_stubs,make_project,_quiet
+def _pyNLLoc(target,flags=[],fail=''):
+    """Runs pyNLLoc on the target directory, returning to the current directory afterwards
+
+    Args
+        target: str target directory
+
+    Keyword Args
+        flags: list of pyNLLoc command line flags
+        fail: str stub programs to fail (see stub_nlloc.py), otherwise any failed programs raise a RuntimeError
+
+    Returns
+        list: list of StageResult objects for the programs run
+    """
+    cwd=os.getcwd()
+    os.environ['PYNLLOC_STUB_FAIL']=fail
+    try:
+        with _quiet():
+            results=__core__.run_pyNLLoc(input_args=[target,'-p','1']+flags)
+    finally:
+        os.environ.pop('PYNLLOC_STUB_FAIL')
+        os.chdir(cwd)
+    failed=[result.name for result in results if result.returncode]
+    if failed and not fail:
+        raise RuntimeError('Stub program(s) failed: '+', '.join(failed))
+    return results
+def _single_control_file(target,search):
+    """Replaces the control files in the target directory with a single nlloc_control.in file, with the given LOCSEARCH line"""
+    control=[]
+    for name in ['nlloc_control_vel2grid.in','nlloc_control_grid2time.in','nlloc_control_nlloc.in']:
+        for line in open(os.path.join(target,name)):
+            if line.startswith('LOCSEARCH '):
+                line='LOCSEARCH '+search+'\n'
+            elif line.startswith('INCLUDE '):
+                #The INCLUDE lines are only updated for Vel2Grid and Grid2Time
+                line='INCLUDE '+os.path.join(target,'run',line.split()[1])+'\n'
+            if line not in control:
+                control.append(line)
+        os.remove(os.path.join(target,name))
+    open(os.path.join(target,'nlloc_control.in'),'w').write(''.join(control))
+    return target
+def check_grid_cache(work_path):
+    """Checks that the grid cache is used for a second target directory with the same inputs, with separate control files
+    and with a single control file (with a different LOCSEARCH line)"""
+    for mode,searches in [('separate',[]),('single',['OCT 10 10 10 0.01 10000 1000','OCT 20 20 20 0.01 20000 2000'])]:
+        cache=os.path.join(work_path,mode,'cache')
+        keys=[]
+        programs=[]
+        for i,name in enumerate(['first','second']):
+            target=make_project(os.path.join(work_path,mode,name),events=2,stations=2)
+            if searches:
+                _single_control_file(target,searches[i])
+            programs.append([result.name for result in _pyNLLoc(target,['-c',cache])])
+            keys.append(__core__._grid_cache_key(os.path.join(target,'run')))
+        assert keys[0]==keys[1],mode+': grid cache keys differ: '+', '.join(keys)
+        assert 'Vel2Grid' in programs[0] and 'Grid2Time' in programs[0],mode+': first run did not calculate the grids: '+', '.join(programs[0])
+        assert 'Vel2Grid' not in programs[1] and 'Grid2Time' not in programs[1],mode+': second run did not use the cached grids: '+', '.join(programs[1])
+        assert os.listdir(cache)==[keys[0]],mode+': unexpected grid cache entries: '+', '.join(os.listdir(cache))
+def _check_hyp_roots(target):
+    """Checks that the NLLOC lines in the location hypocentre files have scatter files in the loc folder, returning the number of NLLOC lines"""
+    n_nlloc=0
+    for hyp_file in glob.glob(os.path.join(target,'loc','*.hyp')):
+        for line in open(hyp_file):
+            if line.startswith('NLLOC '):
+                n_nlloc+=1
+                root=line.split('"')[1]
+                assert os.path.split(os.path.join(target,root))[0]==os.path.join(target,'loc'),hyp_file+' NLLOC root is not in the loc folder: '+root
+                assert os.path.exists(os.path.join(target,root+'.scat')),hyp_file+' NLLOC root has no scatter file: '+root
+    return n_nlloc
+def check_loc_roots(work_path):
+    """Checks the location hypocentre file NLLOC roots after merging the event shards and incremental runs"""
+    for name,flags in [('shards',['-e','2']),('incremental',['-e','2','-i'])]:
+        target=make_project(os.path.join(work_path,name),events=4,stations=2)
+        _pyNLLoc(target,flags+['-n'])
+        assert _check_hyp_roots(target)>=8,name+': missing NLLOC lines'
+def check_incremental(work_path):
+    """Checks the incremental location outputs after changing and removing events"""
+    target=make_project(work_path,events=4,stations=2)
+    _pyNLLoc(target,['-i','-n'])
+    events=''.join(open(os.path.join(target,'events.out')).readlines()).split('\n\n')
+    #Change the first pick of the first event (the stub output root is from the first pick date and time) and remove the last event
+    lines=events[0].split('\n')
+    lines[0]=lines[0].replace(' 0000 ',' 2359 ').replace(' 1.0000 ',' 1.2500 ')
+    events[0]='\n'.join(lines)
+    removed=events.pop(3)
+    open(os.path.join(target,'events.out'),'w').write('\n\n'.join(events))
+    results=_pyNLLoc(target,['-i','-n'])
+    assert len([result for result in results if result.name=='NLLoc'])==1,'NLLoc not run for the changed event'
+    manifest=json.load(open(os.path.join(target,'loc','obs.manifest.json')))
+    assert len(manifest['events'])==3,'Manifest has '+str(len(manifest['events']))+' events'
+    event_files=[name for name in os.listdir(os.path.join(target,'loc')) if name.endswith('.hyp') and '.sum.' not in name and name!='last.hyp']
+    assert len(event_files)==3,'Location folder has '+str(len(event_files))+' event hypocentre files: '+', '.join(event_files)
+    for event_root in manifest['events'].values():
+        assert os.path.exists(os.path.join(target,event_root+'.scat')),'No scatter file for the manifest event root: '+event_root
+    summary=open(os.path.join(target,'loc','obs.sum.grid0.loc.hyp')).read()
+    assert summary.count('NLLOC ')==3,'Summary hypocentre file has '+str(summary.count('NLLOC '))+' events'
+    assert ' 1.2500 ' in summary and removed.split()[6] not in summary,'Summary hypocentre file has stale events'
+    assert _check_hyp_roots(target)==7,'Unexpected NLLOC lines'
+    n_samples=struct.unpack('i',open(os.path.join(target,'loc','obs.sum.grid0.loc.scat'),'rb').read(4))[0]
+    assert n_samples==3*int(os.environ['PYNLLOC_STUB_SAMPLES']),'Summary scatter file has '+str(n_samples)+' samples'
+    #Truncate the manifest, so all the events are located again
+    manifest_file=os.path.join(target,'loc','obs.manifest.json')
+    manifest=open(manifest_file).read()
+    open(manifest_file,'w').write(manifest[:len(manifest)//2])
+    results=_pyNLLoc(target,['-i','-n'])
+    assert len([result for result in results if result.name=='NLLoc'])==1,'NLLoc not run after truncating the manifest'
+    assert len(json.load(open(manifest_file))['events'])==3,'Manifest not rewritten after truncating it'
+    assert _check_hyp_roots(target)==7,'Unexpected NLLOC lines after truncating the manifest'
+def check_failures(work_path):
+    """Checks that failed grid stages stop the pipeline and failed event shards are not merged"""
+    target=make_project(os.path.join(work_path,'grid2time'),events=2,stations=2)
+    results=_pyNLLoc(target,fail='Grid2Time')
+    assert 'Grid2Time' in [result.name for result in results],'Grid2Time not run'
+    assert 'NLLoc' not in [result.name for result in results],'NLLoc run after Grid2Time failed'
+    cwd=os.getcwd()
+    os.environ['PYNLLOC_STUB_FAIL']='Grid2Time'
+    try:
+        with _quiet():
+            status=__core__.__run__(input_args=[target,'-p','1'])
+    finally:
+        os.environ.pop('PYNLLOC_STUB_FAIL')
+        os.chdir(cwd)
+    assert status==1,'Exit status is '+repr(status)+' for a failed run'
+    target=make_project(os.path.join(work_path,'shards'),events=4,stations=2)
+    results=_pyNLLoc(target,['-e','2','-n'],fail='NLLoc:shard1')
+    assert [result.returncode for result in results if result.name=='NLLoc']==[0,1],'Unexpected NLLoc return codes'
+    summary=open(os.path.join(target,'loc','obs.sum.grid0.loc.hyp')).read()
+    assert summary.count('NLLOC ')==2,'Summary hypocentre file has '+str(summary.count('NLLOC '))+' events'
+    assert _check_hyp_roots(target)==5,'Unexpected NLLOC lines'
+CHECKS={'grid_cache':check_grid_cache,'loc_roots':check_loc_roots,'incremental':check_incremental,'failures':check_failures}
+def __run__(input_args=False):
+    """Runs the checks from the command line
+
+    Keyword Args
+        input_args: list of checks to run [default is to use sys.argv, or all the checks if none are given]
+
+    Returns
+        int: number of failed checks
+    """
+    if input_args is False:
+        input_args=sys.argv[1:]
+    names=input_args or sorted(CHECKS)
+    for name in names:
+        if name not in CHECKS:
+            print ('Unknown check: '+name)
+            return 1
+    os.environ['PYNLLOC_STUB_GRID_BYTES']='1024'
+    os.environ['PYNLLOC_STUB_SAMPLES']='10'
+    for variable in ['PYNLLOC_STUB_PROGRAM_DELAY','PYNLLOC_STUB_STATION_DELAY','PYNLLOC_STUB_EVENT_DELAY']:
+        os.environ[variable]='0'
+    work_path=tempfile.mkdtemp(prefix='pyNLLoc_check')
+    path=os.environ.get('PATH','')
+    os.environ['PATH']=make_stubs(os.path.join(work_path,'bin'))+os.pathsep+path
+    failed=0
+    try:
+        for name in names:
+            try:
+                CHECKS[name](os.path.join(work_path,name))
+                print (name+': passed')
+            except Exception:
+                failed+=1
+                print (name+': FAILED')
+                traceback.print_exc()
+    finally:
+        os.environ['PATH']=path
+        shutil.rmtree(work_path,ignore_errors=True)
+    return failed
+if __name__=="__main__":
+    sys.exit(__run__())
@@ -0,0 +1,281 @@
+#!/usr/bin/python
+"""check_scat2angle
+***********************
+
+Checks of the in-process scatter to angle conversion (Scat2Angle and GridLib), using the synthetic grids and scatter files from synthetic.py,
+so NonLinLoc does not need to be installed. The checks are:
+
+    ============  ======================================================================================================
+    Check         Description
+    ============  ======================================================================================================
+    resample      Resampling is deterministic for a fixed seed, the resampled weights are conserved (p x nsamples is the
+                  sum of the input weights), and the resampling parameters file is written and removed
+    binary        The scatter files and binary scatangle files round trip (including non-native byte order), and the
+                  text and binary scatangle files (written directly or converted from the text file) have the same angles
+    summary       The summaries of the text and binary scatangle files, the in-process summary, and (if GetNLLOCScatterAngles
+                  is found) the C++ scatangle file and summary agree, and the summary grid_sampling flag is set from the data
+    lookup        angles_at and times_at give the synthetic (straight ray) angles and times at the grid nodes, and the
+                  grid cell lookup gives the same angles as the default lookup
+    picks         The stations with picks (-p and --obs) are used for each event scatter file, and the stations picked in any
+                  event are used for the location summary scatter file (with a multi-event summary hypocentre file)
+    ============  ======================================================================================================
+
+The checks are run from the command line::
+
+    $~ python check_scat2angle.py [check ...]
+
+and the exit status is the number of failed checks. The C++ comparisons in the summary check are skipped if GetNLLOCScatterAngles (built
+using make_angles.sh or the makefile) is not found on the path or in the pyNLLoc source directory.
+"""
+import os,sys,json,shutil,tempfile,traceback
+BENCHMARK_PATH=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(BENCHMARK_PATH))
+sys.path.insert(0,BENCHMARK_PATH)
+import numpy as np
+import synthetic
+import Scat2Angle,XYZ2Angle
+from run_benchmarks import find_executable,_quiet
+STATIONS=4
+NODES=21
+SAMPLES=5000
+def _make_event(work_path):
+    """Makes the synthetic grids and scatter file, returning the grid file root and scatter file path"""
+    grid_root=synthetic.make_grids(os.path.join(work_path,'time'),STATIONS,NODES,phases=('P','S'))
+    scatter_file=synthetic.make_scatter_file(os.path.join(work_path,'loc','event.scat'),SAMPLES)
+    return grid_root,scatter_file
+def check_resample(work_path):
+    """Checks that resampling is deterministic for a fixed seed and conserves the weights"""
+    samples=synthetic.make_samples(SAMPLES)
+    nsamples=SAMPLES//10
+    for method in Scat2Angle.RESAMPLE_METHODS:
+        for grid_sampling in [False,True]:
+            name=method+(' (grid sampling)' if grid_sampling else '')
+            resampled,parameters=Scat2Angle.resample_scatter(samples,method,nsamples,grid_sampling,seed=5)
+            repeated,repeated_parameters=Scat2Angle.resample_scatter(samples,method,nsamples,grid_sampling,seed=5)
+            assert np.array_equal(resampled,repeated),name+': resampled samples differ for the same seed'
+            assert parameters==repeated_parameters,name+': resampling parameters differ for the same seed'
+            assert parameters['output_samples']==len(resampled)==nsamples,name+': '+str(len(resampled))+' resampled samples'
+            #Resampling with the recorded random seed gives the same samples
+            random_seed,random_parameters=Scat2Angle.resample_scatter(samples,method,nsamples,grid_sampling)
+            assert np.array_equal(random_seed,Scat2Angle.resample_scatter(samples,method,nsamples,grid_sampling,random_parameters['seed'])[0]),name+': recorded seed does not reproduce the samples'
+            if method=='decimate':
+                assert np.array_equal(resampled['p'],samples['p'][(np.arange(nsamples)*SAMPLES)//nsamples]),name+': decimated probabilities changed'
+                continue
+            weights=np.asarray(samples['p'],dtype=np.float64) if grid_sampling else np.ones(SAMPLES)
+            assert np.allclose(resampled['p'].astype(np.float64)*len(resampled),weights.sum(),rtol=1e-6),name+': resampled weights are not conserved'
+            other=Scat2Angle.resample_scatter(samples,method,nsamples,grid_sampling,seed=6)[0]
+            assert not np.array_equal(resampled,other),name+': resampled samples are the same for different seeds'
+    #Fewer samples than requested are not resampled
+    assert len(Scat2Angle.resample_scatter(samples[:10],'systematic',nsamples,seed=5)[0])==10,'Samples resampled when there are fewer than nsamples'
+    if not os.path.exists(work_path):
+        os.makedirs(work_path)
+    filename=os.path.join(work_path,'event.scatangle')
+    Scat2Angle.write_resample_parameters(filename,parameters)
+    assert json.load(open(filename+'.resample.json'))==parameters,'Resampling parameters file does not match the parameters'
+    Scat2Angle.write_resample_parameters(filename)
+    assert not os.path.exists(filename+'.resample.json'),'Resampling parameters file not removed'
+def _text_angles(filename):
+    """Reads the probabilities, station names and angles from a text scatangle file"""
+    probability,names,azimuth,takeoff=[],None,[],[]
+    for chunk_probability,names,chunk_azimuth,chunk_takeoff in Scat2Angle.iter_scatangle_chunks(filename):
+        probability.append(chunk_probability)
+        azimuth.append(chunk_azimuth)
+        takeoff.append(chunk_takeoff)
+    return np.concatenate(probability),names,np.concatenate(azimuth),np.concatenate(takeoff)
+def _assert_angles(first,second,atol,message):
+    """Asserts that the probabilities, station names and angles of two scatangle files agree (azimuths compared on the circle)"""
+    assert list(first[1])==list(second[1]),message+': stations differ'
+    assert np.allclose(first[0],second[0],rtol=1e-5),message+': probabilities differ'
+    azimuth_difference=np.abs(np.mod(np.asarray(first[2],dtype=np.float64)-np.asarray(second[2],dtype=np.float64)+180.0,360.0)-180.0)
+    assert azimuth_difference.max()<=atol,message+': azimuths differ by up to '+str(azimuth_difference.max())
+    assert np.allclose(first[3],second[3],rtol=0,atol=atol),message+': take-off angles differ'
+def check_binary(work_path):
+    """Checks the scatter file and binary scatangle file round trips"""
+    grid_root,scatter_file=_make_event(work_path)
+    samples=synthetic.make_samples(SAMPLES)
+    for endian in ['<','>']:
+        filename=os.path.join(work_path,'endian'+endian+'.scat')
+        Scat2Angle.write_scatter(filename,samples,endian=endian)
+        read,header=Scat2Angle.read_scatter(filename,endian)
+        assert int(header['nsamples'])==SAMPLES,endian+': header has '+str(header['nsamples'])+' samples'
+        for field in ['x','y','z','p']:
+            assert np.array_equal(read[field],samples[field]),endian+': scatter file '+field+' values differ'
+        try:
+            Scat2Angle.read_scatter(filename,'>' if endian=='<' else '<')
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(endian+': scatter file read with the wrong endian value')
+    session=Scat2Angle.Scat2AngleSession(grid_root)
+    text=_text_angles(session.process(scatter_file,grid_sampling=True))
+    binary_file=session.process(scatter_file,grid_sampling=True,binary=True)
+    probability,names,azimuth,takeoff,header=Scat2Angle.read_scatangle(binary_file)
+    assert header['grid_sampling'] and header['nsamples']==SAMPLES,'Binary scatangle header does not match'
+    #The text file is written with 6 significant figures
+    _assert_angles(text,(probability,names,azimuth,takeoff),1e-3,'Text and binary scatangle files')
+    converted=Scat2Angle.read_scatangle(Scat2Angle.convert_scatangle(scatter_file+'angle',os.path.join(work_path,'converted.scatangle.bin')))
+    assert converted[4]['grid_sampling'],'Converted binary scatangle file grid_sampling flag not set'
+    _assert_angles(text,converted[:4],1e-4,'Text and converted binary scatangle files')
+    filename=os.path.join(work_path,'metadata.scatangle.bin')
+    metadata={'resample':{'method':'systematic','seed':5}}
+    Scat2Angle.write_scatangle_binary(filename,probability,names,azimuth,takeoff,False,metadata)
+    written=Scat2Angle.read_scatangle(filename)
+    assert written[4]['metadata']==metadata and not written[4]['grid_sampling'],'Binary scatangle header metadata does not match'
+    assert np.all(written[0]==1),'Binary scatangle probabilities not 1 without grid sampling'
+    _assert_angles((written[0],)+written[1:4],(np.ones(SAMPLES),names,azimuth,takeoff),0,'Written binary scatangle file')
+def _assert_summaries(first,second,message):
+    """Asserts that two summaries agree, allowing for samples moving between histogram bins due to rounding"""
+    assert first['nsamples']==second['nsamples'],message+': number of samples differ'
+    assert first['grid_sampling']==second['grid_sampling'],message+': grid_sampling flags differ'
+    assert np.isclose(first['total_weight'],second['total_weight'],rtol=1e-5),message+': total weights differ'
+    for station,other in zip(first['stations'],second['stations']):
+        assert station['name']==other['name'],message+': stations differ'
+        for key in ['azimuth_mean','takeoff_mean','takeoff_std']:
+            assert np.isclose(station[key],other[key],rtol=0,atol=1e-2),message+': '+station['name']+' '+key+' differs'
+        moved=np.abs(np.asarray(station['histogram'])-np.asarray(other['histogram'])).sum()
+        assert moved<=1e-3*first['total_weight'],message+': '+station['name']+' histograms differ by '+str(moved)
+def check_summary(work_path):
+    """Checks that the text, binary, in-process and C++ summaries agree"""
+    grid_root,scatter_file=_make_event(work_path)
+    session=Scat2Angle.Scat2AngleSession(grid_root)
+    executable=find_executable()
+    for grid_sampling in [False,True]:
+        name='grid sampling' if grid_sampling else 'equal weights'
+        text_file=session.process(scatter_file,grid_sampling=grid_sampling)
+        binary_file=session.process(scatter_file,grid_sampling=grid_sampling,binary=True)
+        summary=Scat2Angle.read_scatangle_summary(session.process(scatter_file,grid_sampling=grid_sampling,summary=Scat2Angle.DEFAULT_BIN_WIDTH))
+        assert summary['grid_sampling']==grid_sampling,name+': in-process summary grid_sampling flag is not set from the data'
+        text_summary=Scat2Angle.read_scatangle_summary(Scat2Angle.summarise_scatangle(text_file,os.path.join(work_path,'text.summary')))
+        binary_summary=Scat2Angle.read_scatangle_summary(Scat2Angle.summarise_scatangle(binary_file,os.path.join(work_path,'binary.summary')))
+        _assert_summaries(summary,text_summary,name+': in-process and text summaries')
+        _assert_summaries(summary,binary_summary,name+': in-process and binary summaries')
+        if not executable:
+            continue
+        executable_name=Scat2Angle.EXECUTABLE
+        Scat2Angle.EXECUTABLE=executable
+        station_file=Scat2Angle.write_stations(Scat2Angle.get_stations(grid_root),grid_root)
+        try:
+            with _quiet():
+                assert not Scat2Angle.get_angles(station_file,scatter_file,grid_sampling),name+': '+executable+' failed'
+                cpp_text=_text_angles(scatter_file+'angle')
+                assert not Scat2Angle.get_angles(station_file,scatter_file,grid_sampling,summary=Scat2Angle.DEFAULT_BIN_WIDTH),name+': '+executable+' failed'
+        finally:
+            Scat2Angle.EXECUTABLE=executable_name
+        _assert_angles(_text_angles(text_file),cpp_text,0.2,name+': in-process and C++ scatangle files')
+        cpp_summary=Scat2Angle.read_scatangle_summary(scatter_file+'angle.summary')
+        _assert_summaries(summary,cpp_summary,name+': in-process and C++ summaries')
+        _assert_summaries(text_summary,Scat2Angle.read_scatangle_summary(Scat2Angle.summarise_scatangle(scatter_file+'angle',os.path.join(work_path,'cpp.summary'))),
+                          name+': text and C++ text summaries')
+    if not executable:
+        print ('summary: '+Scat2Angle.EXECUTABLE+' not found, skipping the C++ comparisons')
+def check_lookup(work_path):
+    """Checks the angles_at and times_at values at the grid nodes against the synthetic values"""
+    grid_root=synthetic.make_grids(os.path.join(work_path,'time'),STATIONS,NODES,phases=('P','S'))
+    grid_path=os.path.dirname(grid_root)+os.path.sep
+    origin,spacing,x,y,z=synthetic._grid_nodes(NODES,20.0)
+    #Interior nodes, away from the grid edges
+    x,y,z=np.meshgrid(x[1:-1:3],y[1:-1:3],z[1:-1:3],indexing='ij')
+    points=np.column_stack((x.ravel(),y.ravel(),z.ravel()))
+    XYZ2Angle.clear_sessions()
+    try:
+        angles=XYZ2Angle.angles_at(points,grid_path)
+        times=XYZ2Angle.times_at(points,grid_path)
+    finally:
+        XYZ2Angle.clear_sessions()
+    names=synthetic.station_names(STATIONS)
+    #The angles_at stations are in the grid file order
+    assert sorted(angles['station'][0])==names and list(times['station'][0])==names,'Stations differ'
+    for name,location in zip(names,synthetic.station_locations(STATIONS,20.0)):
+        i=list(angles['station'][0]).index(name)
+        j=names.index(name)
+        xtmp=location[0]-points[:,0]
+        ytmp=location[1]-points[:,1]
+        horizontal=np.sqrt(xtmp*xtmp+ytmp*ytmp)
+        vertical=points[:,2]-location[2]
+        azimuth=np.mod(np.degrees(np.arctan2(xtmp,ytmp)),360.0)
+        takeoff=180.0-np.degrees(np.arctan2(horizontal,vertical))
+        distance=np.sqrt(horizontal*horizontal+vertical*vertical)
+        #Angles are stored to 0.1 degrees in the grids
+        _assert_angles((np.ones(len(points)),[name],angles['azimuth'][:,i:i+1],angles['takeoff'][:,i:i+1]),
+                       (np.ones(len(points)),[name],azimuth[:,np.newaxis],takeoff[:,np.newaxis]),0.1,name+' angles_at')
+        for phase in ['P','S']:
+            assert np.allclose(times[phase][:,j],distance/synthetic.VELOCITY[phase],rtol=1e-5,atol=1e-5),name+' '+phase+' times_at values differ'
+    samples=synthetic.make_samples(SAMPLES)
+    default=Scat2Angle.Scat2AngleSession(grid_root).angles(samples)
+    cells=Scat2Angle.Scat2AngleSession(grid_root,lookup=0.0).angles(samples)
+    assert np.array_equal(default[0],cells[0]) and np.array_equal(default[1],cells[1]),'Grid cell lookup angles differ from the default lookup'
+def _phase_lines(picks,date,hourmin):
+    """Gets the NLLOC_OBS phase lines for the (station, phase) picks"""
+    return ''.join([station+' ?    ?    ? '+phase+'      ? '+date+' '+hourmin+'  1.0000 GAU  2.00e-02 -1.00e+00 -1.00e+00 -1.00e+00\n' for station,phase in picks])
+def check_picks(work_path):
+    """Checks the picked stations for the event and location summary scatter files, from the hypocentre files and the observation file"""
+    grid_root=synthetic.make_grids(os.path.join(work_path,'time'),STATIONS,NODES)
+    stations=Scat2Angle.get_stations(grid_root)
+    station_file=Scat2Angle.write_stations(stations,grid_root)
+    loc_root=os.path.join(work_path,'loc','obs')
+    events=[('20150101','0000',[('S0000','P'),('S0001','S')]),('20150102','0100',[('S0002','P'),('S0000','P')])]
+    expected={}
+    hyps={}
+    for date,hourmin,picks in events:
+        event_root=loc_root+'.'+date+'.'+hourmin+'00.grid0.loc'
+        synthetic.make_scatter_file(event_root+'.scat',100)
+        hyps[event_root+'.hyp']=('NLLOC "'+event_root+'" "LOCATED" "Location completed."\nPHASE ID Ins Cmp On Pha  FM Date     HrMn   Sec     Err  ErrMag\n'+
+                                 _phase_lines(picks,date,hourmin)+'END_PHASE\nEND_NLLOC\n\n')
+        expected[event_root+'.scat']=sorted([station for station,phase in picks if phase=='P'])
+    #The summary hypocentre file has all the events, and the stations picked in the first event alone would miss S0002
+    synthetic.make_scatter_file(loc_root+'.sum.grid0.loc.scat',100)
+    hyps[loc_root+'.sum.grid0.loc.hyp']=''.join([hyps[hyp_file] for hyp_file in sorted(hyps)])
+    expected[loc_root+'.sum.grid0.loc.scat']=['S0000','S0002']
+    obs_file=os.path.join(work_path,'obs.out')
+    open(obs_file,'w').write('\n'.join([_phase_lines(picks,date,hourmin) for date,hourmin,picks in events]))
+    for source in ['hyp','obs']:
+        for hyp_file,hyp in hyps.items():
+            if source=='hyp':
+                open(hyp_file,'w').write(hyp)
+            else:
+                os.remove(hyp_file)
+        for scatter_file in expected:
+            if os.path.exists(scatter_file+'angle'):
+                os.remove(scatter_file+'angle')
+        picks={'phase':'P','obs_file':obs_file if source=='obs' else False}
+        for scatter_file,names in expected.items():
+            assert sorted(Scat2Angle.picked_stations(scatter_file,**picks))==names,source+': '+os.path.split(scatter_file)[1]+' picked stations are '+', '.join(Scat2Angle.picked_stations(scatter_file,**picks))
+        with _quiet():
+            results=Scat2Angle.run_scatter_files(stations,station_file,sorted(expected),False,in_process=True,picks=picks)
+        assert not any([result[1] or result[2] for result in results]),source+': scatter files not converted'
+        for scatter_file,names in expected.items():
+            written=sorted(_text_angles(scatter_file+'angle')[1])
+            assert written==names,source+': '+os.path.split(scatter_file)[1]+' scatangle file stations are '+', '.join(written)
+CHECKS={'resample':check_resample,'binary':check_binary,'summary':check_summary,'lookup':check_lookup,'picks':check_picks}
+def __run__(input_args=False):
+    """Runs the checks from the command line
+
+    Keyword Args
+        input_args: list of checks to run [default is to use sys.argv, or all the checks if none are given]
+
+    Returns
+        int: number of failed checks
+    """
+    if input_args is False:
+        input_args=sys.argv[1:]
+    names=input_args or sorted(CHECKS)
+    for name in names:
+        if name not in CHECKS:
+            print ('Unknown check: '+name)
+            return 1
+    work_path=tempfile.mkdtemp(prefix='pyNLLoc_check')
+    failed=0
+    try:
+        for name in names:
+            try:
+                CHECKS[name](os.path.join(work_path,name))
+                print (name+': passed')
+            except Exception:
+                failed+=1
+                print (name+': FAILED')
+                traceback.print_exc()
+    finally:
+        shutil.rmtree(work_path,ignore_errors=True)
+    return failed
+if __name__=="__main__":
+    sys.exit(__run__())
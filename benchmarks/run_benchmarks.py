@@ -0,0 +1,289 @@
+#!/usr/bin/python
+"""run_benchmarks
+***********************
+
+Benchmarks for the scatter to angle conversion and the grid lookups, using synthetic grids and scatter files (see synthetic.py).
+
+The benchmarks are run for 3D and 2D grids, and the throughput is reported as samples x stations per second:
+
+    ==============================  ==================================================================================
+    Benchmark                       Description
+    ==============================  ==================================================================================
+    GetNLLOCScatterAngles           C++ executable run on a scatter file (Scat2Angle.get_angles)
+    GetNLLOCScatterAngles_threads   C++ executable run on a scatter file using all the cores (--threads 0)
+    GetNLLOCScatterAngles_cells     C++ executable run on a scatter file using the grid cell lookup (--cell_lookup)
+    Scat2Angle                      Scat2Angle.__run__ using the C++ executable
+    Scat2Angle_in_process           Scat2Angle.__run__ using the in-process (GridLib) angles (-i flag)
+    Scat2AngleSession               In-process angles for the scatter samples with the angle grids cached
+    Scat2AngleSession_cells         In-process angles for the scatter samples using the grid cell lookup
+    XYZ2Angle                       XYZ2Angle.get_angles for a single point (using the C++ executable)
+    XYZ2Angle_batch                 XYZ2Angle.get_angles_batch for a batch of points
+    angles_at                       XYZ2Angle.angles_at for a batch of points (cached session)
+    times_at                        XYZ2Angle.times_at for a batch of points for the P and S time grids (cached grids)
+    ==============================  ==================================================================================
+
+Each benchmark is repeated and the fastest time is used. The benchmarks using the C++ executable are skipped if GetNLLOCScatterAngles
+(built using make_angles.sh or the makefile) is not found on the path or in the pyNLLoc source directory. No other NonLinLoc programs are needed.
+
+The results can be saved as a JSON baseline, and compared against a baseline, where any benchmark with a throughput more than the tolerance
+below the baseline is reported as a regression (with a non-zero exit code)::
+
+    $~ python benchmarks/run_benchmarks.py -o benchmarks/baseline.json
+    $~ python benchmarks/run_benchmarks.py -b benchmarks/baseline.json -t 0.2
+
+The baseline is only comparable for the same machine and benchmark configuration (stations, nodes, samples and points), so
+the configuration and platform are stored with the results.
+"""
+import os,sys,shutil,tempfile,timeit,json,platform,contextlib,argparse,datetime
+BENCHMARK_PATH=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(BENCHMARK_PATH))
+import numpy as np
+import synthetic
+import Scat2Angle,XYZ2Angle
+DEFAULT_TOLERANCE=0.2#Fractional drop in throughput reported as a regression
+@contextlib.contextmanager
+def _quiet():
+    """Redirects the stdout file descriptor (including any subprocess output) to devnull"""
+    sys.stdout.flush()
+    stdout=os.dup(1)
+    devnull=os.open(os.devnull,os.O_WRONLY)
+    os.dup2(devnull,1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout,1)
+        os.close(stdout)
+        os.close(devnull)
+def _time(function,repeat):
+    """Gets the fastest run time of the function
+
+    Args
+        function: function to time (called without arguments)
+        repeat: int number of times to run the function
+
+    Returns
+        float: fastest run time (s)
+    """
+    times=[]
+    for i in range(repeat):
+        start=timeit.default_timer()
+        with _quiet():
+            function()
+        times.append(timeit.default_timer()-start)
+    return min(times)
+def find_executable(executable=False):
+    """Finds the GetNLLOCScatterAngles executable
+
+    Keyword Args
+        executable: str executable path [default is to look on the path and in the pyNLLoc source directory]
+
+    Returns
+        str: absolute executable path, or False if it is not found
+    """
+    if executable:
+        return os.path.abspath(executable) if os.path.exists(executable) else False
+    for path in os.environ.get('PATH','').split(os.pathsep)+[os.path.dirname(BENCHMARK_PATH)]:
+        candidate=os.path.join(path,Scat2Angle.EXECUTABLE)
+        if os.path.isfile(candidate) and os.access(candidate,os.X_OK):
+            return os.path.abspath(candidate)
+    return False
+def _remove_scatangle(scatter_file):
+    """Removes the scatangle output so that the scatter file is converted again"""
+    for filename in [scatter_file+'angle',scatter_file+'angle.bin']:
+        if os.path.exists(filename):
+            os.remove(filename)
+def _run_scat2angle(control_file,scatter_file,flags=[]):
+    """Runs Scat2Angle.__run__ for the control file with the command line flags"""
+    _remove_scatangle(scatter_file)
+    argv=sys.argv
+    sys.argv=['Scat2Angle',control_file]+flags
+    try:
+        if Scat2Angle.__run__():
+            raise RuntimeError('Scat2Angle failed to convert '+scatter_file)
+    finally:
+        sys.argv=argv
+def run_grid_benchmarks(work_path,two_d=False,stations=10,nodes=41,samples=100000,points=10000,repeat=3,executable=False):
+    """Runs the benchmarks for one grid type
+
+    Args
+        work_path: str directory for the synthetic grids and scatter files
+
+    Keyword Args
+        two_d: bool flag to use 2D grids rather than 3D grids
+        stations: int number of stations
+        nodes: int number of grid nodes along each axis
+        samples: int number of scatter file samples
+        points: int number of points for the batch lookups
+        repeat: int number of times to repeat each benchmark
+        executable: str GetNLLOCScatterAngles path (False to skip the C++ benchmarks)
+
+    Returns
+        dict: dictionary of benchmark results (seconds, samples, stations and rate - samples x stations per second) by benchmark name
+    """
+    grid_root=synthetic.make_grids(os.path.join(work_path,'time'),stations,nodes,two_d=two_d,phases=('P','S'))
+    grid_path=os.path.dirname(grid_root)+os.path.sep
+    scatter_file=synthetic.make_scatter_file(os.path.join(work_path,'loc','event.scat'),samples)
+    control_file=os.path.join(work_path,'scat2angle.in')
+    open(control_file,'w').write(grid_root+'\n'+os.path.join(work_path,'loc','event')+'\n')
+    stations_list=Scat2Angle.get_stations(grid_root)
+    station_file=Scat2Angle.write_stations(stations_list,grid_root)
+    xyz=synthetic.make_samples(points,seed=synthetic.DEFAULT_SEED+1)
+    xyz=np.column_stack((xyz['x'],xyz['y'],xyz['z'])).astype(np.float64)
+    results={}
+    def record(name,function,nsamples):
+        seconds=_time(function,repeat)
+        results[name]={'seconds':seconds,'samples':nsamples,'stations':stations,'rate':nsamples*stations/seconds}
+    cwd=os.getcwd()
+    os.chdir(work_path)
+    try:
+        if executable:
+            def cpp():
+                _remove_scatangle(scatter_file)
+                if Scat2Angle.get_angles(station_file,scatter_file,True):
+                    raise RuntimeError(Scat2Angle.EXECUTABLE+' failed to convert '+scatter_file)
+            record('GetNLLOCScatterAngles',cpp,samples)
+            def cpp_threads():
+                _remove_scatangle(scatter_file)
+                if Scat2Angle.get_angles(station_file,scatter_file,True,threads=0):
+                    raise RuntimeError(Scat2Angle.EXECUTABLE+' failed to convert '+scatter_file)
+            record('GetNLLOCScatterAngles_threads',cpp_threads,samples)
+            def cpp_cells():
+                _remove_scatangle(scatter_file)
+                if Scat2Angle.get_angles(station_file,scatter_file,True,lookup=0.0):
+                    raise RuntimeError(Scat2Angle.EXECUTABLE+' failed to convert '+scatter_file)
+            record('GetNLLOCScatterAngles_cells',cpp_cells,samples)
+            record('Scat2Angle',lambda:_run_scat2angle(control_file,scatter_file),samples)
+        record('Scat2Angle_in_process',lambda:_run_scat2angle(control_file,scatter_file,['-i']),samples)
+        session=Scat2Angle.Scat2AngleSession(grid_root)
+        scatter=Scat2Angle.read_scatter(scatter_file)[0]
+        session.angles(scatter)
+        record('Scat2AngleSession',lambda:session.angles(scatter),samples)
+        cell_session=Scat2Angle.Scat2AngleSession(grid_root,lookup=0.0)
+        cell_session.angles(scatter)
+        record('Scat2AngleSession_cells',lambda:cell_session.angles(scatter),samples)
+        if executable:
+            record('XYZ2Angle',lambda:XYZ2Angle.get_angles(xyz[0,0],xyz[0,1],xyz[0,2],grid_path),1)
+        record('XYZ2Angle_batch',lambda:XYZ2Angle.get_angles_batch(xyz,grid_path),points)
+        XYZ2Angle.clear_sessions()
+        XYZ2Angle.angles_at(xyz[:1],grid_path)
+        record('angles_at',lambda:XYZ2Angle.angles_at(xyz,grid_path),points)
+        XYZ2Angle.times_at(xyz[:1],grid_path)
+        record('times_at',lambda:XYZ2Angle.times_at(xyz,grid_path),points)
+        XYZ2Angle.clear_sessions()
+    finally:
+        os.chdir(cwd)
+    return results
+def run_benchmarks(stations=10,nodes=41,samples=100000,points=10000,repeat=3,executable=False,work_path=False):
+    """Runs the benchmarks for 3D and 2D grids
+
+    Keyword Args
+        stations: int number of stations
+        nodes: int number of grid nodes along each axis
+        samples: int number of scatter file samples
+        points: int number of points for the batch lookups
+        repeat: int number of times to repeat each benchmark
+        executable: str GetNLLOCScatterAngles path [default is to look on the path and in the pyNLLoc source directory]
+        work_path: str directory for the synthetic files [default is a temporary directory, which is removed afterwards]
+
+    Returns
+        dict: benchmark results, with the configuration, platform and results (by grid type and benchmark name)
+    """
+    executable=find_executable(executable)
+    config={'stations':stations,'nodes':nodes,'samples':samples,'points':points,'repeat':repeat}
+    report={'created':datetime.datetime.now().isoformat(),'platform':platform.platform(),'python':platform.python_version(),
+            'numpy':np.__version__,'executable':bool(executable),'config':config,'results':{}}
+    executable_name=Scat2Angle.EXECUTABLE
+    if executable:
+        Scat2Angle.EXECUTABLE=executable
+    temporary=not work_path
+    if temporary:
+        work_path=tempfile.mkdtemp(prefix='pyNLLoc_benchmarks')
+    try:
+        for grid_type,two_d in [('3D',False),('2D',True)]:
+            results=run_grid_benchmarks(os.path.join(work_path,grid_type),two_d,stations,nodes,samples,points,repeat,executable)
+            for name,result in results.items():
+                report['results'][grid_type+'/'+name]=result
+    finally:
+        Scat2Angle.EXECUTABLE=executable_name
+        if temporary:
+            shutil.rmtree(work_path)
+    return report
+def compare(report,baseline,tolerance=DEFAULT_TOLERANCE):
+    """Compares the benchmark results to a baseline
+
+    Args
+        report: dict benchmark results (from run_benchmarks)
+        baseline: dict baseline benchmark results (from run_benchmarks)
+
+    Keyword Args
+        tolerance: float fractional drop in throughput reported as a regression
+
+    Returns
+        list: list of (name, rate, baseline rate) tuples for the regressions
+    """
+    if report['config']!=baseline['config']:
+        print ('Benchmark configuration does not match the baseline configuration: '+json.dumps(baseline['config']))
+    regressions=[]
+    for name,result in sorted(report['results'].items()):
+        if name in baseline['results'] and result['rate']<(1.0-tolerance)*baseline['results'][name]['rate']:
+            regressions.append((name,result['rate'],baseline['results'][name]['rate']))
+    return regressions
+def print_report(report,baseline=False):
+    """Prints the benchmark results table, with the change from the baseline rate if a baseline is given"""
+    print ('%-36s %12s %16s %10s'%('Benchmark','Time (s)','Rate (/s)','Change'))
+    for name,result in sorted(report['results'].items()):
+        change=''
+        if baseline and name in baseline['results']:
+            change='%+.1f%%'%(100.0*(result['rate']/baseline['results'][name]['rate']-1.0))
+        print ('%-36s %12.4f %16.4g %10s'%(name,result['seconds'],result['rate'],change))
+def __parser__(input_args=False):
+    """Parses the command line arguments
+
+    Keyword Args
+        input_args: list of command line arguments [default is to use sys.argv]
+
+    Returns
+        dict: dictionary of the command line options
+    """
+    parser=argparse.ArgumentParser(prog='run_benchmarks',description='pyNLLoc scatter to angle conversion and grid lookup benchmarks.')
+    parser.add_argument('-n','--stations',help='Number of stations [default=10]',type=int,dest='stations',default=10)
+    parser.add_argument('-g','--nodes',help='Number of grid nodes along each axis [default=41]',type=int,dest='nodes',default=41)
+    parser.add_argument('-s','--samples',help='Number of scatter file samples [default=100000]',type=int,dest='samples',default=100000)
+    parser.add_argument('-p','--points',help='Number of points for the batch lookups [default=10000]',type=int,dest='points',default=10000)
+    parser.add_argument('-r','--repeat',help='Number of times to repeat each benchmark [default=3]',type=int,dest='repeat',default=3)
+    parser.add_argument('-e','--executable',help='GetNLLOCScatterAngles path [default is to look on the path and in the pyNLLoc source directory]',dest='executable',default=False)
+    parser.add_argument('-w','--work_path',help='Directory for the synthetic files [default is a temporary directory]',dest='work_path',default=False)
+    parser.add_argument('-o','--output',help='JSON file to save the results to (e.g. as a new baseline)',dest='output',default=False)
+    parser.add_argument('-b','--baseline',help='JSON baseline file to compare the results to',dest='baseline',default=False)
+    parser.add_argument('-t','--tolerance',help='Fractional drop in throughput reported as a regression [default=0.2]',type=float,dest='tolerance',default=DEFAULT_TOLERANCE)
+    if input_args:
+        return vars(parser.parse_args(input_args))
+    return vars(parser.parse_args())
+def __run__(input_args=False):
+    """Runs the benchmarks from the command line
+
+    Keyword Args
+        input_args: list of command line arguments [default is to use sys.argv]
+
+    Returns
+        int: 1 if there are any regressions compared to the baseline, otherwise 0
+    """
+    options=__parser__(input_args)
+    report=run_benchmarks(options['stations'],options['nodes'],options['samples'],options['points'],options['repeat'],options['executable'],options['work_path'])
+    if not report['executable']:
+        print (Scat2Angle.EXECUTABLE+' not found, skipping the C++ benchmarks')
+    baseline=False
+    if options['baseline']:
+        baseline=json.load(open(options['baseline']))
+    print_report(report,baseline)
+    if options['output']:
+        json.dump(report,open(options['output'],'w'),indent=1,sort_keys=True)
+    if baseline:
+        regressions=compare(report,baseline,options['tolerance'])
+        for name,rate,baseline_rate in regressions:
+            print ('Regression: '+name+' rate '+'%.4g'%rate+' is below the baseline rate '+'%.4g'%baseline_rate)
+        return int(len(regressions)>0)
+    return 0
+if __name__=="__main__":
+    sys.exit(__run__())
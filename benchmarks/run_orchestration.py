@@ -0,0 +1,251 @@
+#!/usr/bin/python
+"""run_orchestration
+***********************
+
+Benchmarks for the pyNLLoc orchestration (__core__), using the stub NonLinLoc programs in stub_nlloc.py, so NonLinLoc does not need to be installed.
+
+A synthetic project is made for each run, with the control files, a velocity model (and models for the sweeps), a station file and an observation
+file with picks at every station for each event. The benchmarks are:
+
+    ============  ======================================================================================================
+    Benchmark     Description
+    ============  ======================================================================================================
+    setup         Folder setup and control file checks (_setup), including copying the observation file into ./obs
+    pipeline      Full pyNLLoc run with one process for each stage
+    grid2time     Full runs with -p N -s N (up to N Grid2Time processes, with the stations split into N shards per phase)
+    events        Full runs with -e N (N NLLoc processes, with the events split into N shards)
+    sweep         Full runs over the models with -w N (N models run concurrently)
+    ============  ======================================================================================================
+
+Each benchmark is repeated and the fastest time is used. For the scaling benchmarks, the stage time is the time from the start of the first
+to the end of the last scaled program run (Grid2Time for grid2time, NLLoc for events, and all the programs for sweep), and the busy time is the total
+time the scaled programs were running. The speed up is the stage time for one worker divided by the stage time for N workers, and the efficiency is
+the busy time divided by N times the stage time, i.e. the fraction of the worker slots that the scheduler kept busy. The events and sweep benchmarks
+are run with one Grid2Time process (-p 1), so only the scaled stage runs concurrently.
+
+The file sizes and stub run times are set using the command line flags (see -h), which are passed to the stubs as environment variables.
+The results can be saved as JSON using the -o flag.
+"""
+import os,sys,shutil,tempfile,timeit,json,platform,contextlib,argparse,datetime
+BENCHMARK_PATH=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(BENCHMARK_PATH))
+import __core__
+PROGRAMS=['Vel2Grid','Grid2Time','NLLoc','Scat2Angle']
+BENCHMARKS=['setup','pipeline','grid2time','events','sweep']
+@contextlib.contextmanager
+def _quiet():
+    """Redirects the stdout file descriptor (including any subprocess output) to devnull"""
+    sys.stdout.flush()
+    stdout=os.dup(1)
+    devnull=os.open(os.devnull,os.O_WRONLY)
+    os.dup2(devnull,1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(stdout,1)
+        os.close(stdout)
+        os.close(devnull)
+def make_stubs(bin_path):
+    """Writes a script for each NonLinLoc program that runs the stub program
+
+    Args
+        bin_path: str directory to write the scripts to (to be added to the path)
+
+    Returns
+        str: bin_path
+    """
+    if not os.path.exists(bin_path):
+        os.makedirs(bin_path)
+    for program in PROGRAMS:
+        script=os.path.join(bin_path,program)
+        open(script,'w').write('#!/bin/sh\nexec "'+sys.executable+'" "'+os.path.join(BENCHMARK_PATH,'stub_nlloc.py')+'" '+program+' "$@"\n')
+        os.chmod(script,0o755)
+    return bin_path
+def make_project(path,events=100,stations=10,models=0):
+    """Makes a synthetic pyNLLoc project, with the files in the target directory (as before the first run)
+
+    Args
+        path: str project directory
+
+    Keyword Args
+        events: int number of events in the observation file
+        stations: int number of stations
+        models: int number of models to write to path/models for the sweeps
+
+    Returns
+        str: project directory
+    """
+    os.makedirs(path)
+    open(os.path.join(path,'nlloc_control_vel2grid.in'),'w').write('CONTROL 1 54321\nVGOUT ./model/layer\nVGTYPE P\nVGTYPE S\nVGGRID 2 101 51 0.0 0.0 0.0 1.0 1.0 1.0 SLOW_LEN\nINCLUDE model.vel\n')
+    open(os.path.join(path,'nlloc_control_grid2time.in'),'w').write('CONTROL 1 54321\nGTFILES ./model/layer ./time/layer P 0\nGTMODE GRID2D ANGLES_YES\nINCLUDE stations.sta\n')
+    open(os.path.join(path,'nlloc_control_nlloc.in'),'w').write('CONTROL 1 54321\nLOCSIG pyNLLoc\nLOCFILES ./obs/obs.out NLLOC_OBS ./time/layer ./loc/obs 0\nLOCSEARCH OCT 10 10 10 0.01 10000 1000\nLOCGRID 41 41 41 -20.0 -20.0 0.0 1.0 1.0 1.0 PROB_DENSITY SAVE\n')
+    def model(i):
+        return ''.join(['LAYER %.1f %.2f 0.0 %.2f 0.0 2.7 0.0\n'%(depth,5.0+0.1*i+0.2*depth,(5.0+0.1*i+0.2*depth)/1.73) for depth in range(0,30,5)])
+    open(os.path.join(path,'model.vel'),'w').write(model(0))
+    names=['S'+str(i).zfill(4) for i in range(stations)]
+    open(os.path.join(path,'stations.sta'),'w').write(''.join(['GTSRCE '+name+' XYZ %.1f %.1f 0.0 0.0\n'%(i%10,i//10) for i,name in enumerate(names)]))
+    fid=open(os.path.join(path,'events.out'),'w')
+    for event in range(events):
+        date='2015%02d%02d'%(1+(event//1440)%12,1+event%28)
+        hourmin='%02d%02d'%((event//60)%24,event%60)
+        for name in names:
+            for phase,seconds in [('P',1.0),('S',1.7)]:
+                fid.write(name+' ?    ?    ? '+phase+'      ? '+date+' '+hourmin+' %7.4f GAU  2.00e-02 -1.00e+00 -1.00e+00 -1.00e+00\n'%seconds)
+        fid.write('\n')
+    fid.close()
+    if models:
+        os.makedirs(os.path.join(path,'models'))
+        for i in range(models):
+            open(os.path.join(path,'models','model'+str(i)+'.mod'),'w').write(model(i))
+    return path
+def _stub_environment(options):
+    """Sets the stub program environment variables from the options"""
+    os.environ['PYNLLOC_STUB_GRID_BYTES']=str(options['grid_bytes'])
+    os.environ['PYNLLOC_STUB_SAMPLES']=str(options['samples'])
+    os.environ['PYNLLOC_STUB_PROGRAM_DELAY']=str(options['program_delay'])
+    os.environ['PYNLLOC_STUB_STATION_DELAY']=str(options['station_delay'])
+    os.environ['PYNLLOC_STUB_EVENT_DELAY']=str(options['event_delay'])
+def _run(work_path,options,flags=[],setup_only=False,models=0,programs=PROGRAMS):
+    """Makes a project and times a pyNLLoc run (or the setup only)
+
+    Args
+        work_path: str directory for the project
+        options: dict of benchmark options
+
+    Keyword Args
+        flags: list of pyNLLoc command line flags
+        setup_only: bool flag to only time the folder setup and control file checks
+        models: int number of models to make for the sweep
+        programs: list of the programs to calculate the stage and busy times for
+
+    Returns
+        (float,float,float): tuple of the run time, the stage time (from the start of the first to the end of the last run of the programs)
+                                and the busy time (total time the programs were running)
+    """
+    if os.path.exists(work_path):
+        shutil.rmtree(work_path)
+    target=make_project(work_path,options['events'],options['stations'],models)
+    cwd=os.getcwd()
+    try:
+        with _quiet():
+            if setup_only:
+                pyNLLoc_options=__core__._parser([target]+flags)[0]
+                start=timeit.default_timer()
+                __core__._setup(target,pyNLLoc_options)
+                return timeit.default_timer()-start,0.0,0.0
+            start=timeit.default_timer()
+            results=__core__.run_pyNLLoc(input_args=[target]+flags)
+            elapsed=timeit.default_timer()-start
+    finally:
+        os.chdir(cwd)
+    failed=[result.name for result in results if result.returncode]
+    if failed:
+        raise RuntimeError('Stub program(s) failed: '+', '.join(failed))
+    results=[result for result in results if result.name in programs]
+    if not results:
+        raise RuntimeError('No '+', '.join(programs)+' runs')
+    return elapsed,max([result.end for result in results])-min([result.start for result in results]),sum([result.elapsed for result in results])
+def _best(work_path,options,flags=[],setup_only=False,models=0,programs=PROGRAMS):
+    """Gets the fastest run (run, stage and busy times) over the repeats"""
+    return min([_run(work_path,options,flags,setup_only,models,programs) for i in range(options['repeat'])])
+def run_benchmarks(options,work_path):
+    """Runs the orchestration benchmarks
+
+    Args
+        options: dict of benchmark options (from __parser__)
+        work_path: str directory for the projects
+
+    Returns
+        dict: benchmark results, with the configuration, platform and results by benchmark name
+    """
+    _stub_environment(options)
+    os.environ['PATH']=make_stubs(os.path.join(work_path,'bin'))+os.pathsep+os.environ.get('PATH','')
+    project=os.path.join(work_path,'project')
+    config=dict([(key,value) for key,value in options.items() if key not in ['output','work_path','benchmarks']])
+    report={'created':datetime.datetime.now().isoformat(),'platform':platform.platform(),'python':platform.python_version(),
+            'config':config,'results':{}}
+    if 'setup' in options['benchmarks']:
+        report['results']['setup']={'seconds':_best(project,options,setup_only=True)[0],'events':options['events']}
+    if 'pipeline' in options['benchmarks']:
+        seconds,stage_seconds,busy=_best(project,options,['-p','1'])
+        report['results']['pipeline']={'seconds':seconds,'stage_seconds':stage_seconds,'busy':busy,'overhead':seconds-busy}
+    scaling={'grid2time':lambda n:(['-p',str(n),'-s',str(n)],0,['Grid2Time']),
+             'events':lambda n:(['-p','1','-e',str(n)],0,['NLLoc']),
+             'sweep':lambda n:(['-p','1','-m',os.path.join(project,'models','model'),'-w',str(n)],options['models'],PROGRAMS)}
+    for name in ['grid2time','events','sweep']:
+        if name not in options['benchmarks']:
+            continue
+        base=None
+        for workers in options['workers']:
+            flags,models,programs=scaling[name](workers)
+            seconds,stage_seconds,busy=_best(project,options,flags,models=models,programs=programs)
+            if workers==1:
+                base=stage_seconds
+            report['results'][name+'/'+str(workers)]={'seconds':seconds,'stage_seconds':stage_seconds,'busy':busy,'workers':workers,
+                                                       'speedup':base/stage_seconds if base else None,'efficiency':busy/(workers*stage_seconds)}
+    return report
+def print_report(report):
+    """Prints the benchmark results table"""
+    print ('%-20s %12s %12s %12s %10s %12s'%('Benchmark','Time (s)','Stage (s)','Busy (s)','Speed up','Efficiency'))
+    for name,result in sorted(report['results'].items()):
+        print ('%-20s %12.4f %12s %12s %10s %12s'%(name,result['seconds'],'%.4f'%result['stage_seconds'] if 'stage_seconds' in result else '',
+                                               '%.4f'%result['busy'] if 'busy' in result else '',
+                                               '%.2f'%result['speedup'] if result.get('speedup') else '',
+                                               '%.2f'%result['efficiency'] if 'efficiency' in result else ''))
+def _int_list(string):
+    """Parses a comma separated list of integers"""
+    return [int(value) for value in string.split(',')]
+def __parser__(input_args=False):
+    """Parses the command line arguments
+
+    Keyword Args
+        input_args: list of command line arguments [default is to use sys.argv]
+
+    Returns
+        dict: dictionary of the command line options
+    """
+    parser=argparse.ArgumentParser(prog='run_orchestration',description='pyNLLoc orchestration benchmarks using stub NonLinLoc programs.')
+    parser.add_argument('benchmarks',help='Benchmarks to run (setup, pipeline, grid2time, events and/or sweep) [default=all]',nargs='*',default=[])
+    parser.add_argument('-n','--events',help='Number of events in the observation file [default=100]',type=int,dest='events',default=100)
+    parser.add_argument('-s','--stations',help='Number of stations [default=10]',type=int,dest='stations',default=10)
+    parser.add_argument('-m','--models',help='Number of models for the sweep benchmark [default=4]',type=int,dest='models',default=4)
+    parser.add_argument('-W','--workers',help='Comma separated numbers of workers for the scaling benchmarks [default=1,2,4]',type=_int_list,dest='workers',default=[1,2,4])
+    parser.add_argument('-g','--grid_bytes',help='Size of each stub grid buffer file in bytes [default=1048576]',type=int,dest='grid_bytes',default=1024**2)
+    parser.add_argument('-S','--samples',help='Number of stub scatter samples for each event [default=1000]',type=int,dest='samples',default=1000)
+    parser.add_argument('-d','--program_delay',help='Stub program start up time in seconds [default=0.05]',type=float,dest='program_delay',default=0.05)
+    parser.add_argument('-t','--station_delay',help='Stub Grid2Time time for each station in seconds [default=0.01]',type=float,dest='station_delay',default=0.01)
+    parser.add_argument('-e','--event_delay',help='Stub NLLoc and Scat2Angle time for each event in seconds [default=0.01]',type=float,dest='event_delay',default=0.01)
+    parser.add_argument('-r','--repeat',help='Number of times to repeat each benchmark [default=3]',type=int,dest='repeat',default=3)
+    parser.add_argument('-w','--work_path',help='Directory for the projects [default is a temporary directory, which is removed afterwards]',dest='work_path',default=False)
+    parser.add_argument('-o','--output',help='JSON file to save the results to',dest='output',default=False)
+    if input_args:
+        options=vars(parser.parse_args(input_args))
+    else:
+        options=vars(parser.parse_args())
+    for benchmark in options['benchmarks']:
+        if benchmark not in BENCHMARKS:
+            parser.error('Unknown benchmark: '+benchmark)
+    options['benchmarks']=options['benchmarks'] or BENCHMARKS
+    return options
+def __run__(input_args=False):
+    """Runs the benchmarks from the command line
+
+    Keyword Args
+        input_args: list of command line arguments [default is to use sys.argv]
+    """
+    options=__parser__(input_args)
+    work_path=options['work_path']
+    if not work_path:
+        work_path=tempfile.mkdtemp(prefix='pyNLLoc_orchestration')
+    work_path=os.path.abspath(work_path)
+    try:
+        report=run_benchmarks(options,work_path)
+    finally:
+        if not options['work_path']:
+            shutil.rmtree(work_path,ignore_errors=True)
+    print_report(report)
+    if options['output']:
+        json.dump(report,open(options['output'],'w'),indent=1,sort_keys=True)
+if __name__=="__main__":
+    __run__()
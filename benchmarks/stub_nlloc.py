@@ -0,0 +1,158 @@
+#!/usr/bin/python
+"""stub_nlloc
+***********************
+
+Stub NonLinLoc programs (Vel2Grid, Grid2Time, NLLoc and Scat2Angle) for benchmarking the pyNLLoc orchestration without NonLinLoc installed.
+
+The stubs read the same control file lines as the NonLinLoc programs, and read and write files with the same names and a similar size,
+but the file contents are not valid grids or locations. The program is given as the first argument::
+
+    $~ python stub_nlloc.py Grid2Time run/nlloc_control_grid2time_P.in
+
+and run_orchestration.py writes a script for each program that calls this, so they can be put on the path.
+
+The file sizes and run times are set by environment variables (so that they are passed through pyNLLoc to the stubs):
+
+    ==============================  ============================================================================  =======
+    Variable                        Description                                                                   Default
+    ==============================  ============================================================================  =======
+    PYNLLOC_STUB_GRID_BYTES         Size of each model, time and angle grid buffer file                           1048576
+    PYNLLOC_STUB_SAMPLES            Number of scatter samples for each event                                      1000
+    PYNLLOC_STUB_PROGRAM_DELAY      Start up time for each program run (s)                                        0.05
+    PYNLLOC_STUB_STATION_DELAY      Grid2Time time for each station (s)                                           0.01
+    PYNLLOC_STUB_EVENT_DELAY        NLLoc and Scat2Angle time for each event (s)                                  0.01
+    PYNLLOC_STUB_FAIL               Comma separated programs to fail (exit status 1) without writing any outputs
+                                    (e.g. Grid2Time), optionally with a control file name to match after a colon
+                                    (e.g. NLLoc:shard1)
+    ==============================  ============================================================================  =======
+"""
+import os,sys,glob,struct,time
+GRID_BYTES=int(os.environ.get('PYNLLOC_STUB_GRID_BYTES',1024**2))
+SAMPLES=int(os.environ.get('PYNLLOC_STUB_SAMPLES',1000))
+PROGRAM_DELAY=float(os.environ.get('PYNLLOC_STUB_PROGRAM_DELAY',0.05))
+STATION_DELAY=float(os.environ.get('PYNLLOC_STUB_STATION_DELAY',0.01))
+EVENT_DELAY=float(os.environ.get('PYNLLOC_STUB_EVENT_DELAY',0.01))
+FAIL=[program for program in os.environ.get('PYNLLOC_STUB_FAIL','').split(',') if program]
+def _read_control(control_file):
+    """Reads the control file, including any INCLUDEd files
+
+    Args
+        control_file: str control file path
+
+    Returns
+        list: list of lists of the words on each control line
+    """
+    control=[]
+    for line in open(control_file):
+        words=line.split()
+        if not words or words[0].startswith('#'):
+            continue
+        if words[0]=='INCLUDE':
+            control.extend(_read_control(words[1]))
+        else:
+            control.append(words)
+    return control
+def _read_file(filename):
+    """Reads the whole of a file (if it exists), to give the same read footprint as the NonLinLoc programs"""
+    if os.path.exists(filename):
+        fid=open(filename,'rb')
+        while fid.read(1024**2):
+            pass
+        fid.close()
+def _write_grid(grid_file,grid_type,label='',nbytes=GRID_BYTES):
+    """Writes a grid header and buffer file of the given size"""
+    fid=open(grid_file+'.hdr','w')
+    fid.write('1 1 %d  0.0 0.0 0.0  1.0 1.0 1.0 %s FLOAT\n'%(max(1,nbytes//4),grid_type))
+    if label:
+        fid.write(label+' 0.0 0.0 0.0\n')
+    fid.write('TRANSFORM  NONE\n')
+    fid.close()
+    fid=open(grid_file+'.buf','wb')
+    block=b'\0'*min(nbytes,1024**2)
+    written=0
+    while written<nbytes:
+        fid.write(block[:nbytes-written])
+        written+=min(len(block),nbytes-written)
+    fid.close()
+def vel2grid(control_file):
+    """Writes a model grid for each VGTYPE (VGOUT root.type.mod.hdr/.buf)"""
+    control=_read_control(control_file)
+    root=[words[1] for words in control if words[0]=='VGOUT'][0]
+    for wave_type in [words[1] for words in control if words[0]=='VGTYPE'] or ['P']:
+        _write_grid(root+'.'+wave_type+'.mod','SLOW_LEN')
+def grid2time(control_file):
+    """Reads the model grid and writes a time and angle grid for each station (GTFILES timeroot.phase.station.time/angle.hdr/.buf)"""
+    control=_read_control(control_file)
+    gtfiles=[words for words in control if words[0]=='GTFILES'][0]
+    _read_file(gtfiles[1]+'.'+gtfiles[3]+'.mod.buf')
+    for words in control:
+        if words[0]=='GTSRCE':
+            time.sleep(STATION_DELAY)
+            root=gtfiles[2]+'.'+gtfiles[3]+'.'+words[1]
+            _write_grid(root+'.time','TIME',words[1])
+            _write_grid(root+'.angle','ANGLE',words[1])
+def _iter_events(obs_file):
+    """Iterates over the events (separated by blank lines) in an observation file"""
+    event=[]
+    for line in open(obs_file):
+        if line.strip():
+            event.append(line)
+        elif event:
+            yield event
+            event=[]
+    if event:
+        yield event
+def _write_scatter(scatter_file,samples):
+    """Writes a scatter file with the given number of samples"""
+    fid=open(scatter_file,'wb')
+    fid.write(struct.pack('ifff',samples,0.0,0.0,0.0))
+    fid.write(struct.pack('ffff',0.0,0.0,0.0,1.0)*samples)
+    fid.close()
+def nlloc(control_file):
+    """Reads the time grid headers and writes the location hypocentre and scatter files for each event, with the summary and last files"""
+    control=_read_control(control_file)
+    locfiles=[words for words in control if words[0]=='LOCFILES'][0]
+    obs_file,time_root,loc_root=locfiles[1],locfiles[3],locfiles[4]
+    for header in glob.glob(time_root+'.*.time.hdr'):
+        _read_file(header)
+    summary=open(loc_root+'.sum.grid0.loc.hyp','w')
+    hyp=''
+    for i,event in enumerate(_iter_events(obs_file)):
+        time.sleep(EVENT_DELAY)
+        words=event[0].split()
+        event_root=loc_root+'.'+'.'.join(words[6:8] if len(words)>7 else [str(i)])+'.grid0.loc'
+        hyp='NLLOC "'+event_root+'" "LOCATED"\n'+'PHASE ID Ins Cmp On Pha FM Date HrMn Sec Err ErrMag Coda Amp Per\n'+''.join(event)+'END_PHASE\nEND_NLLOC\n\n'
+        open(event_root+'.hyp','w').write(hyp)
+        _write_scatter(event_root+'.scat',SAMPLES)
+        summary.write(hyp)
+    summary.close()
+    _write_scatter(loc_root+'.sum.grid0.loc.scat',0)
+    open(os.path.join(os.path.split(loc_root)[0],'last.hyp'),'w').write(hyp)
+def scat2angle(control_file):
+    """Writes a text scatangle file for each scatter file that has not been converted"""
+    control=open(control_file).readlines()
+    grid_root,scatter_root=control[0].strip(),control[1].strip()
+    stations=[path.split('.angle.hdr')[0].split('.')[-1] for path in glob.glob(grid_root+'*.P.*.angle.hdr')]
+    sample=''.join(['1.0\n']+[station+'\t0.0\t90.0\n' for station in stations]+['\n'])
+    for scatter_file in glob.glob(scatter_root+'*.scat'):
+        if os.path.exists(scatter_file+'angle'):
+            continue
+        time.sleep(EVENT_DELAY)
+        _read_file(scatter_file)
+        fid=open(scatter_file+'angle','w')
+        for i in range(struct.unpack('i',open(scatter_file,'rb').read(4))[0]):
+            fid.write(sample)
+        fid.close()
+PROGRAMS={'Vel2Grid':vel2grid,'Grid2Time':grid2time,'NLLoc':nlloc,'Scat2Angle':scat2angle}
+if __name__=="__main__":
+    if len(sys.argv)<3 or sys.argv[1] not in PROGRAMS:
+        print ('Usage: stub_nlloc.py ['+'|'.join(sorted(PROGRAMS))+'] control_file')
+        sys.exit(1)
+    print (sys.argv[1]+' (stub) '+sys.argv[2])
+    time.sleep(PROGRAM_DELAY)
+    for program in FAIL:
+        name,control=(program.split(':',1)+[''])[:2]
+        if name==sys.argv[1] and control in os.path.split(sys.argv[2])[1]:
+            print (sys.argv[1]+' (stub) failed')
+            sys.exit(1)
+    PROGRAMS[sys.argv[1]](sys.argv[2])
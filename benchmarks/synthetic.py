@@ -0,0 +1,174 @@
+#!/usr/bin/python
+"""synthetic
+***********************
+
+Generates synthetic NonLinLoc angle and time grids and scatter files for the benchmarks.
+
+The grids are calculated for straight rays in a homogeneous half space, so they are smooth and valid everywhere,
+and use the same header and buffer formats as the Grid2Time output (grid.phase.station.angle/time.hdr/.buf).
+The scatter files use the same format as the NLLoc output (.scat), with the samples drawn from a normal distribution
+about the centre of the grid.
+
+The stations and samples are generated from a fixed seed, so the files are the same for each run.
+Requires the pyNLLoc source directory to be on the python path (as set up by run_benchmarks.py).
+"""
+import os,struct
+import numpy as np
+DEFAULT_SEED=1#Random seed for the stations and samples
+VELOCITY={'P':6.0,'S':3.5}#Homogeneous half space velocities (km/s)
+def station_names(stations):
+    """Gets the synthetic station names
+
+    Args
+        stations: int number of stations
+
+    Returns
+        list: list of station names
+    """
+    return ['S'+str(i).zfill(4) for i in range(stations)]
+def station_locations(stations,size,seed=DEFAULT_SEED):
+    """Gets the synthetic station locations, randomly spread over the surface of the grid
+
+    Args
+        stations: int number of stations
+        size: float grid size (km)
+
+    Keyword Args
+        seed: int random seed
+
+    Returns
+        numpy.array: stations x 3 array of x, y, z coordinates (km)
+    """
+    state=np.random.RandomState(seed)
+    locations=np.zeros((stations,3))
+    locations[:,:2]=state.uniform(-size/2.0,size/2.0,(stations,2))
+    return locations
+def _write_grid(grid_file,values,origin,spacing,grid_type,station,location):
+    """Writes a grid header and buffer file
+
+    Args
+        grid_file: str grid file root (without the .hdr or .buf extension)
+        values: numpy array of grid values (numx x numy x numz)
+        origin: tuple of the grid origin x, y, z (km)
+        spacing: float grid node spacing (km)
+        grid_type: str NonLinLoc grid type (e.g. ANGLE or TIME2D)
+        station: str station name
+        location: station x, y, z coordinates (km)
+    """
+    numx,numy,numz=values.shape
+    fid=open(grid_file+'.hdr','w')
+    fid.write('%d %d %d  %f %f %f  %f %f %f %s FLOAT\n'%(numx,numy,numz,origin[0],origin[1],origin[2],spacing,spacing,spacing,grid_type))
+    fid.write('%s %f %f %f\n'%(station,location[0],location[1],location[2]))
+    fid.write('TRANSFORM  NONE\n')
+    fid.close()
+    np.ascontiguousarray(values,dtype=np.float32).tofile(grid_file+'.buf')
+def _grid_nodes(nodes,size,two_d=False):
+    """Gets the grid origin and node coordinates
+
+    Args
+        nodes: int number of nodes along each axis
+        size: float grid size (km)
+
+    Keyword Args
+        two_d: bool flag for a 2D (distance, depth) grid
+
+    Returns
+        (tuple,float,numpy.array,numpy.array,numpy.array): tuple of the grid origin, spacing and the x, y, z node coordinates
+    """
+    spacing=size/(nodes-1.0)
+    if two_d:
+        #2D grids are indexed by epicentral distance, which can be up to the grid diagonal
+        origin=(0.0,0.0,0.0)
+        x=np.zeros(1)
+        y=np.arange(int(np.ceil(np.sqrt(2.0)*nodes)))*spacing
+    else:
+        origin=(-size/2.0,-size/2.0,0.0)
+        x=origin[0]+np.arange(nodes)*spacing
+        y=origin[1]+np.arange(nodes)*spacing
+    z=np.arange(nodes)*spacing
+    return origin,spacing,x,y,z
+def make_grids(grid_path,stations=10,nodes=41,size=20.0,two_d=False,phases=('P',),seed=DEFAULT_SEED):
+    """Makes the synthetic angle and time grids for the stations
+
+    The grid files are written as grid_path/grid.phase.station.angle.hdr/.buf and grid_path/grid.phase.station.time.hdr/.buf
+
+    Args
+        grid_path: str directory to write the grids to
+
+    Keyword Args
+        stations: int number of stations
+        nodes: int number of grid nodes along each axis
+        size: float grid size (km)
+        two_d: bool flag to make 2D (ANGLE2D and TIME2D) grids rather than 3D grids
+        phases: tuple of phases to make grids for
+        seed: int random seed for the station locations
+
+    Returns
+        str: grid file root (grid_path/grid)
+    """
+    from GridLib import encode_angles
+    if not os.path.exists(grid_path):
+        os.makedirs(grid_path)
+    origin,spacing,x,y,z=_grid_nodes(nodes,size,two_d)
+    x,y,z=np.meshgrid(x,y,z,indexing='ij')
+    suffix='2D' if two_d else ''
+    for name,location in zip(station_names(stations),station_locations(stations,size,seed)):
+        if two_d:
+            horizontal=y
+            azimuth=np.ones(y.shape)
+        else:
+            xtmp=location[0]-x
+            ytmp=location[1]-y
+            horizontal=np.sqrt(xtmp*xtmp+ytmp*ytmp)
+            azimuth=np.mod(np.degrees(np.arctan2(xtmp,ytmp)),360.0)
+        vertical=z-location[2]
+        #Take-off angle from downwards vertical (rays up to a surface station have take-off angles above 90 degrees)
+        takeoff=180.0-np.degrees(np.arctan2(horizontal,vertical))
+        distance=np.sqrt(horizontal*horizontal+vertical*vertical)
+        for phase in phases:
+            root=os.path.join(grid_path,'grid.'+phase+'.'+name)
+            _write_grid(root+'.angle',encode_angles(azimuth,takeoff,np.full(y.shape,10)),origin,spacing,'ANGLE'+suffix,name,location)
+            _write_grid(root+'.time',distance/VELOCITY[phase],origin,spacing,'TIME'+suffix,name,location)
+    return os.path.join(grid_path,'grid')
+def make_samples(samples,size=20.0,seed=DEFAULT_SEED):
+    """Makes synthetic location samples, normally distributed about the centre of the grid
+
+    Args
+        samples: int number of samples
+
+    Keyword Args
+        size: float grid size (km)
+        seed: int random seed
+
+    Returns
+        numpy.array: structured array of samples with x, y, z, p float32 fields
+    """
+    state=np.random.RandomState(seed)
+    result=np.empty(samples,dtype=[('x','f4'),('y','f4'),('z','f4'),('p','f4')])
+    result['x']=np.clip(state.normal(0.0,size/10.0,samples),-size/2.0,size/2.0)
+    result['y']=np.clip(state.normal(0.0,size/10.0,samples),-size/2.0,size/2.0)
+    result['z']=np.clip(state.normal(size/2.0,size/10.0,samples),0.0,size)
+    result['p']=state.uniform(0.0,1.0,samples)
+    return result
+def make_scatter_file(scatter_file,samples,size=20.0,seed=DEFAULT_SEED):
+    """Makes a synthetic NonLinLoc scatter file
+
+    Args
+        scatter_file: str scatter file path
+        samples: int number of samples
+
+    Keyword Args
+        size: float grid size (km)
+        seed: int random seed
+
+    Returns
+        str: scatter file path
+    """
+    directory=os.path.split(scatter_file)[0]
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    fid=open(scatter_file,'wb')
+    fid.write(struct.pack('=ifff',samples,0.0,0.0,0.0))
+    make_samples(samples,size,seed).tofile(fid)
+    fid.close()
+    return scatter_file
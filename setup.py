@@ -53,11 +53,12 @@ def setup_package(install=False,build=False,clean=False):
                              "Topic :: Scientific/Engineering"
                             ])
     if _SETUPTOOLS:
-        kwargs['extras_require']={'Cluster':['pyqsub>=1.0.0']}
+        kwargs['extras_require']={'Cluster':['pyqsub>=1.0.0'],'NumPy':['numpy']}
         kwargs['install_requires'].append('pyqsub>=1.0.0')
+        kwargs['python_requires']='>=3.8'
         kwargs.pop('scripts')
         kwargs['version']=__looseversion__
-        kwargs['entry_points']={'console_scripts': ['pyNLLoc = pyNLLoc:pyNLLoc_run','Scat2Angle = pyNLLoc:Scat2Angle_run','XYZ2Angle = pyNLLoc:XYZ2Angle_run']#,'XYZ2Time = pyNLLoc:XYZ2Time_run']
+        kwargs['entry_points']={'console_scripts': ['pyNLLoc = pyNLLoc:pyNLLoc_run','Scat2Angle = pyNLLoc:Scat2Angle_run','XYZ2Angle = pyNLLoc:XYZ2Angle_run','XYZ2Time = pyNLLoc:XYZ2Time_run']
                                 }
     if build or 'build_all' in sys.argv or 'build-all' in sys.argv:
         #clean dist dir